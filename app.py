@@ -5,6 +5,8 @@ Clean, educational, NothingOS-inspired design
 
 import streamlit as st
 import os
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,6 +14,10 @@ load_dotenv()
 
 # Import our modules
 from services.analyzer import CodeAnalyzer
+from services import metrics
+from services.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+from services.llm import AsyncLLMClient
+from services.quotas import CHEAPER, DELAYED, verified_identity
 from ui.theme import apply_theme
 
 # Page config
@@ -25,7 +31,43 @@ st.set_page_config(
 # Apply NothingOS theme
 apply_theme()
 
+TAB_LABELS = [
+    "📝 Explanations", 
+    "🧠 Concepts", 
+    "⚠️ Misconceptions", 
+    "❓ Quiz"
+]
+
+# Seconds between checks on a running analysis
+JOB_POLL_SECONDS = 0.5
+
+# Tab label of each section generated after the explanations
+SECTION_NAMES = {
+    "concepts": "concepts",
+    "misconceptions": "misconceptions",
+    "quiz": "quiz questions"
+}
+
+SECTION_INTROS = {
+    "concepts": "Key concepts used in your code:",
+    "misconceptions": "Areas where students often get confused:",
+    "quiz": "Test your understanding:"
+}
+
+@st.cache_resource
+def get_analyzer():
+    """Process-wide analyzer, so every session shares one warm connection pool"""
+    metrics.configure_from_env()
+    return CodeAnalyzer(llm_client_class=AsyncLLMClient)
+
+@st.cache_resource
+def get_jobs():
+    """Process-wide job queue; analyses keep running across reruns and reconnects"""
+    return JobQueue.from_env(get_analyzer())
+
 def main():
+    metrics.increment("app_reruns_total")
+    
     # Custom header
     st.markdown("""
     <div class="custom-header">
@@ -39,76 +81,54 @@ def main():
         st.session_state.analysis = None
     if 'quiz_revealed' not in st.session_state:
         st.session_state.quiz_revealed = {}
+    if 'job_id' not in st.session_state:
+        # A reloaded page finds its job again through the URL
+        st.session_state.job_id = st.query_params.get("job")
+    if 'analysis_job' not in st.session_state:
+        # The finished job, whose deferred sections are generated on request
+        st.session_state.analysis_job = None
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'caller' not in st.session_state:
+        # The course page links here with ?user=...&course=...&sig=... so quotas apply per student and class;
+        # without a valid signature every visitor shares the anonymous budgets
+        user, course = verified_identity(
+            st.query_params.get("user"), st.query_params.get("course"), st.query_params.get("sig")
+        )
+        st.session_state.caller = {"user": user, "course": course}
     
     # Main layout - simple two columns
     col1, col2 = st.columns([1, 1.2])
     
     with col1:
-        st.markdown("### Code Input")
-        
-        # Language selector
-        language = st.selectbox(
-            "Programming Language",
-            ["python", "javascript", "java", "cpp", "c"],
-            index=0
-        )
-        
-        # Code input
-        code = st.text_area(
-            "Enter your code",
-            height=350,
-            placeholder="# Paste your code here to understand it\n# Try this example:\n\ndef fibonacci(n):\n    if n <= 1:\n        return n\n    return fibonacci(n-1) + fibonacci(n-2)\n\nresult = fibonacci(5)\nprint(f'Result: {result}')"
-        )
-        
-        # Analyze button
-        if st.button("🔍 Analyze Code", type="primary", use_container_width=True):
-            if code.strip():
-                with st.spinner("🧠 Analyzing your code..."):
-                    try:
-                        analyzer = CodeAnalyzer()
-                        analysis = analyzer.analyze_code(code, language)
-                        st.session_state.analysis = analysis
-                        st.session_state.quiz_revealed = {}
-                        st.success("✅ Analysis complete!")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"❌ Analysis failed: {str(e)}")
-            else:
-                st.warning("⚠️ Please enter some code to analyze")
-        
-        # Code stats
-        if code.strip():
-            lines = len([line for line in code.split('\n') if line.strip()])
-            chars = len(code)
-            st.markdown(f"""
-            <div class="code-stats">
-                📊 {lines} lines • {chars} characters • {language.upper()}
-            </div>
-            """, unsafe_allow_html=True)
+        code_input()
     
     with col2:
         st.markdown("### Analysis Results")
         
-        if st.session_state.analysis:
-            # Tabs for different analysis views
-            tab1, tab2, tab3, tab4 = st.tabs([
-                "📝 Explanations", 
-                "🧠 Concepts", 
-                "⚠️ Misconceptions", 
-                "❓ Quiz"
-            ])
+        if st.session_state.job_id:
+            follow_job(st.session_state.job_id)
+        elif st.session_state.analysis:
+            job = get_jobs().get(st.session_state.analysis_job) if st.session_state.analysis_job else None
+            if job is not None and job.analysis is not None:
+                # Picks up deferred sections generated since the last run
+                st.session_state.analysis = job.analysis
             
-            with tab1:
-                show_explanations(st.session_state.analysis)
-            
-            with tab2:
-                show_concepts(st.session_state.analysis)
-            
-            with tab3:
-                show_misconceptions(st.session_state.analysis)
+            # Tabs for different analysis views
+            tab1, tab2, tab3, tab4 = st.tabs(TAB_LABELS)
             
-            with tab4:
-                show_quiz(st.session_state.analysis)
+            with metrics.span("render"):
+                with tab1:
+                    show_explanations(st.session_state.analysis)
+                
+                with tab2:
+                    show_section(job, "concepts", show_concepts)
+                
+                with tab3:
+                    show_section(job, "misconceptions", show_misconceptions)
+                
+                with tab4:
+                    show_section(job, "quiz", show_quiz)
         else:
             # Empty state
             st.markdown("""
@@ -118,92 +138,266 @@ def main():
             </div>
             """, unsafe_allow_html=True)
 
+@st.fragment
+def code_input():
+    """Editor and Analyze button; typing reruns only this fragment"""
+    st.markdown("### Code Input")
+    
+    # Language selector
+    language = st.selectbox(
+        "Programming Language",
+        ["python", "javascript", "java", "cpp", "c"],
+        index=0
+    )
+    
+    # Code input
+    code = st.text_area(
+        "Enter your code",
+        height=350,
+        placeholder="# Paste your code here to understand it\n# Try this example:\n\ndef fibonacci(n):\n    if n <= 1:\n        return n\n    return fibonacci(n-1) + fibonacci(n-2)\n\nresult = fibonacci(5)\nprint(f'Result: {result}')"
+    )
+    
+    # Analyze button
+    if st.button("🔍 Analyze Code", type="primary", use_container_width=True):
+        if code.strip():
+            # The analysis runs in the background; later runs only poll it
+            job = get_jobs().submit(code, language, st.session_state.session_id, **st.session_state.caller)
+            st.session_state.job_id = job.id
+            st.query_params["job"] = job.id
+            st.session_state.analysis = None
+            st.session_state.analysis_job = None
+            st.session_state.quiz_revealed = {}
+            # The results column is outside this fragment
+            st.rerun()
+        else:
+            st.warning("⚠️ Please enter some code to analyze")
+    
+    # Code stats
+    if code.strip():
+        lines = len([line for line in code.split('\n') if line.strip()])
+        chars = len(code)
+        quote = get_jobs().quote(code, language, st.session_state.session_id, **st.session_state.caller)
+        cost = f" • ~{format_tokens(quote.tokens)} tokens" if quote is not None and quote.tokens else ""
+        st.markdown(f"""
+        <div class="code-stats">
+            📊 {lines} lines • {chars} characters • {language.upper()}{cost}
+        </div>
+        """, unsafe_allow_html=True)
+        note = quota_note(quote)
+        if note:
+            st.caption(note)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def follow_job(job_id):
+    """
+    Show a background analysis, rendering the items it has produced so far
+    
+    Only this fragment reruns while polling; the whole page reruns once when the job finishes.
+    """
+    job = get_jobs().get(job_id)
+    if job is None:
+        # Expired, or lost with a server restart
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        st.rerun()
+    
+    if job.status == FAILED:
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        st.error(f"❌ Analysis failed: {job.error}")
+        return
+    if job.status == DONE:
+        # Re-render the finished analysis with its interactive widgets
+        st.session_state.analysis = job.analysis
+        st.session_state.analysis_job = job.id
+        st.session_state.job_id = None
+        st.rerun()
+    
+    if job.status == QUEUED and job.quota is not None and job.quota.mode == DELAYED:
+        starts_in = max(0, job.created + job.quota.wait_seconds - time.time())
+        st.markdown(f"⏳ You have used your token budget for now. Your analysis starts in about {format_wait(starts_in)}.")
+        return
+    st.markdown("🧠 Analyzing your code...")
+    if job.quota is not None and job.quota.degraded:
+        st.caption("Running on a faster model because you are over your token budget.")
+    tabs = dict(zip(["line_explanations", "concepts", "misconceptions", "quiz"], st.tabs(TAB_LABELS)))
+    counts = {section: 0 for section in tabs}
+    for section, item in list(job.items):
+        index = counts[section]
+        counts[section] += 1
+        with tabs[section]:
+            if index == 0 and section in SECTION_INTROS:
+                st.markdown(SECTION_INTROS[section])
+            if section == "line_explanations":
+                render_explanation(item, expanded=index < 2)
+            elif section == "concepts":
+                render_concept(item)
+            elif section == "misconceptions":
+                render_misconception(item)
+            else:
+                render_quiz_question(index, item)
+
+def quota_note(quote):
+    """What submitting will do for a caller over budget, or None within budget"""
+    if quote is None or quote.mode not in (CHEAPER, DELAYED):
+        return None
+    if quote.mode == CHEAPER:
+        return f"⚠️ This is over your {quote.scope}'s token budget, so it will run on a faster, less thorough model."
+    return (f"⏳ This is over your {quote.scope}'s token budget. It will wait about "
+            f"{format_wait(quote.wait_seconds)}, then run on a faster, less thorough model.")
+
+def format_tokens(tokens):
+    """Token count as 850 or 12.3k"""
+    return f"{tokens / 1000:.1f}k" if tokens >= 1000 else str(tokens)
+
+def format_wait(seconds):
+    """Rough wait such as 40 seconds or 12 minutes"""
+    if seconds < 10:
+        return "a few seconds"
+    if seconds < 90:
+        return f"{round(seconds)} seconds"
+    return f"{round(seconds / 60)} minutes"
+
+def show_section(job, section, show):
+    """
+    Display a section generated after the explanations, once it is ready
+    
+    Until then it shows progress, or a button to generate a section that is not prefetched.
+    """
+    status = job.sections.get(section) if job is not None else DONE
+    if status == DONE:
+        show(st.session_state.analysis)
+    elif status in (QUEUED, RUNNING):
+        wait_for_section(job.id, section)
+    else:
+        if status == FAILED:
+            st.error(f"❌ Could not generate {SECTION_NAMES[section]}: {job.section_errors.get(section)}")
+        if st.button(f"✨ Generate {SECTION_NAMES[section]}", key=f"generate_{section}", use_container_width=True):
+            get_jobs().request_section(job.id, section)
+            st.rerun()
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def wait_for_section(job_id, section):
+    """Poll a section being generated; the whole page reruns once it is ready"""
+    job = get_jobs().get(job_id)
+    if job is None or job.sections.get(section) not in (QUEUED, RUNNING):
+        st.rerun()
+    st.markdown(f"🧠 Generating {SECTION_NAMES[section]}...")
+
 def show_explanations(analysis):
     """Display line-by-line explanations"""
-    explanations = analysis.get('line_explanations', [])
+    explanations = analysis.line_explanations
     if not explanations:
         st.info("No explanations available")
         return
     
     for i, explanation in enumerate(explanations):
-        line_code = explanation['code'].strip()
-        if len(line_code) > 50:
-            line_code = line_code[:47] + "..."
+        render_explanation(explanation, expanded=i < 2)
+
+def render_explanation(explanation, expanded=False):
+    """Display a single line explanation"""
+    line_code = explanation.code.strip()
+    if len(line_code) > 50:
+        line_code = line_code[:47] + "..."
+    
+    with st.expander(f"**Line {explanation.line_number}** • `{line_code}`", expanded=expanded):
+        # Show full code if truncated
+        if len(explanation.code.strip()) > 50:
+            st.code(explanation.code, language='python')
         
-        with st.expander(f"**Line {explanation['line_number']}** • `{line_code}`", expanded=i < 2):
-            # Show full code if truncated
-            if len(explanation['code'].strip()) > 50:
-                st.code(explanation['code'], language='python')
-            
-            st.markdown(f"**🔍 What it does:** {explanation['what_it_does']}")
-            st.markdown(f"**🎯 Why it exists:** {explanation['why_it_exists']}")
-            st.markdown(f"**💥 What breaks:** {explanation['what_breaks']}")
+        # One element instead of three keeps each rerun's payload down
+        st.markdown(
+            f"**🔍 What it does:** {explanation.what_it_does}\n\n"
+            f"**🎯 Why it exists:** {explanation.why_it_exists}\n\n"
+            f"**💥 What breaks:** {explanation.what_breaks}"
+        )
 
 def show_concepts(analysis):
     """Display programming concepts"""
-    concepts = analysis.get('concepts', [])
+    concepts = analysis.concepts
     if not concepts:
         st.info("No concepts identified")
         return
     
-    st.markdown("Key concepts used in your code:")
-    
-    for concept in concepts:
-        concept_name = concept.replace('_', ' ').title()
-        st.markdown(f"""
-        <div class="concept-item">
-            🔹 {concept_name}
-        </div>
-        """, unsafe_allow_html=True)
+    st.markdown(SECTION_INTROS["concepts"])
+    st.markdown("".join(concept_html(concept) for concept in concepts), unsafe_allow_html=True)
+
+def render_concept(concept):
+    """Display a single programming concept"""
+    st.markdown(concept_html(concept), unsafe_allow_html=True)
+
+def concept_html(concept):
+    """HTML of a single programming concept"""
+    concept_name = concept.replace('_', ' ').title()
+    return f"""
+    <div class="concept-item">
+        🔹 {concept_name}
+    </div>
+    """
 
 def show_misconceptions(analysis):
     """Display common misconceptions"""
-    misconceptions = analysis.get('misconceptions', [])
+    misconceptions = analysis.misconceptions
     if not misconceptions:
         st.info("No misconceptions identified")
         return
     
-    st.markdown("Areas where students often get confused:")
-    
-    for misconception in misconceptions:
-        st.markdown(f"""
-        <div class="misconception-item">
-            {misconception}
-        </div>
-        """, unsafe_allow_html=True)
+    st.markdown(SECTION_INTROS["misconceptions"])
+    st.markdown("".join(misconception_html(item) for item in misconceptions), unsafe_allow_html=True)
+
+def render_misconception(misconception):
+    """Display a single misconception"""
+    st.markdown(misconception_html(misconception), unsafe_allow_html=True)
+
+def misconception_html(misconception):
+    """HTML of a single misconception"""
+    return f"""
+    <div class="misconception-item">
+        {misconception}
+    </div>
+    """
 
 def show_quiz(analysis):
     """Display quiz questions"""
-    questions = analysis.get('quiz', [])
+    questions = analysis.quiz
     if not questions:
         st.info("No quiz questions available")
         return
     
-    st.markdown("Test your understanding:")
+    st.markdown(SECTION_INTROS["quiz"])
     
     for i, question in enumerate(questions):
+        quiz_item(i, question)
+
+@st.fragment
+def quiz_item(index, question):
+    """A quiz question with its reveal button; revealing reruns only this fragment"""
+    render_quiz_question(index, question)
+    
+    # Answer reveal button
+    if st.button(f"💡 Reveal Answer", key=f"reveal_{index}", use_container_width=True):
+        st.session_state.quiz_revealed[index] = True
+    
+    # Show answer if revealed
+    if st.session_state.quiz_revealed.get(index, False):
         st.markdown(f"""
-        <div class="quiz-question">
-            <div class="quiz-question-text">
-                **Q{i + 1}:** {question['question']}
-            </div>
+        <div class="quiz-answer">
+            <strong>Answer:</strong> {question.answer}
         </div>
         """, unsafe_allow_html=True)
         
-        # Answer reveal button
-        if st.button(f"💡 Reveal Answer", key=f"reveal_{i}", use_container_width=True):
-            st.session_state.quiz_revealed[i] = True
-        
-        # Show answer if revealed
-        if st.session_state.quiz_revealed.get(i, False):
-            st.markdown(f"""
-            <div class="quiz-answer">
-                <strong>Answer:</strong> {question['answer']}
-            </div>
-            """, unsafe_allow_html=True)
-            
-            if 'concept' in question:
-                st.markdown(f"**Related Concept:** {question['concept'].replace('_', ' ').title()}")
+        if question.concept:
+            st.markdown(f"**Related Concept:** {question.concept.replace('_', ' ').title()}")
+
+def render_quiz_question(index, question):
+    """Display a single quiz question"""
+    st.markdown(f"""
+    <div class="quiz-question">
+        <div class="quiz-question-text">
+            **Q{index + 1}:** {question.question}
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,345 @@
+"""
+End-to-end benchmark for the analysis pipeline
+Runs against the offline synthetic backend and reports per-stage latency,
+throughput under concurrent sessions and memory per session
+
+Usage:
+    python -m benchmarks.pipeline --output bench-results.json
+    python -m benchmarks.pipeline --compare bench-results.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.analyzer import CodeAnalyzer
+from services.backends import SyntheticBackend
+from services.cache import AnalysisCache
+from services.llm import DEFERRED_SECTIONS, AsyncLLMClient, LLMClient
+from services.models import Analysis
+from services.static_analysis import analyze_static
+
+LANGUAGES = ["python", "javascript", "java", "cpp", "c"]
+SIZES = {"small": 5, "medium": 30, "large": 120}
+
+_STATEMENTS = {
+    "python": ("def step_{i}(values):", "    total_{i} = sum(values) + {i}", "    return total_{i} * 2", ""),
+    "javascript": ("function step{i}(values) {{", "  const total{i} = values.reduce((a, b) => a + b, {i});",
+                   "  return total{i} * 2;", "}}"),
+    "java": ("static int step{i}(int[] values) {{", "    int total{i} = {i}; for (int v : values) total{i} += v;",
+             "    return total{i} * 2;", "}}"),
+    "cpp": ("int step{i}(const std::vector<int>& values) {{",
+            "    int total{i} = std::accumulate(values.begin(), values.end(), {i});",
+            "    return total{i} * 2;", "}}"),
+    "c": ("int step{i}(const int *values, int n) {{", "    int total{i} = {i}; for (int k = 0; k < n; k++) total{i} += values[k];",
+          "    return total{i} * 2;", "}}"),
+}
+
+
+def build_corpus() -> List[Tuple[str, str, str]]:
+    """Deterministic (name, language, code) snippets of every size and language"""
+    corpus = []
+    for language in LANGUAGES:
+        template = _STATEMENTS[language]
+        for size_name, line_count in SIZES.items():
+            lines = []
+            i = 0
+            while len(lines) < line_count:
+                lines.extend(line.format(i=i) for line in template)
+                i += 1
+            corpus.append((f"{language}-{size_name}", language, "\n".join(lines[:line_count])))
+    return corpus
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Linearly interpolated percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean of a list of durations, in milliseconds"""
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def _timed(function: Callable[[], Any]) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def load_renderers() -> Optional[Dict[str, Callable[[Analysis], None]]]:
+    """Import the app's render functions (Streamlit runs them in bare mode), or None if unavailable"""
+    try:
+        import app
+    except Exception:
+        return None
+
+    def render_quiz(analysis: Analysis) -> None:
+        # show_quiz needs a live session for its reveal buttons
+        for index, question in enumerate(analysis.quiz):
+            app.render_quiz_question(index, question)
+
+    return {
+        "explanations": app.show_explanations,
+        "concepts": app.show_concepts,
+        "misconceptions": app.show_misconceptions,
+        "quiz": render_quiz,
+    }
+
+
+def chunk_analyzer(client: LLMClient) -> CodeAnalyzer:
+    """An analyzer over client with every shortcut off, so each call goes to the model (chunked if need be)"""
+    return CodeAnalyzer(
+        cache=AnalysisCache(path=None, max_memory_entries=0),
+        llm_client=client,
+        incremental=False,
+        near_duplicates=False,
+        precomputed=False,
+    )
+
+
+def bench_stages(client: LLMClient, corpus, iterations: int, renderers) -> Dict[str, Any]:
+    """
+    Time static analysis plus prompt build, API call, parse/validate and rendering for every snippet
+
+    prompt/api/parse cover the explanations request; each deferred section's
+    request is timed end to end under its own name. Snippets too long for one
+    request go through the analyzer's chunked path instead, see bench_chunked.
+    """
+    results = {}
+    analyzer = chunk_analyzer(client)
+    for name, language, code in corpus:
+        if not client.fits(code, language):
+            results[name] = bench_chunked(analyzer, language, code, iterations, renderers)
+            continue
+        stages: Dict[str, List[float]] = {"prompt": [], "api": [], "parse": [], "render": []}
+        stages.update({section: [] for section in DEFERRED_SECTIONS})
+        for _ in range(iterations):
+            request, elapsed = _timed(
+                lambda: client._build_request(code, language, static=analyze_static(code, language))
+            )
+            stages["prompt"].append(elapsed)
+            completion, elapsed = _timed(lambda: client.backend.complete(request))
+            stages["api"].append(elapsed)
+            analysis, elapsed = _timed(lambda: client._parse_analysis(completion.content))
+            stages["parse"].append(elapsed)
+            for section in DEFERRED_SECTIONS:
+                def run_section() -> Dict[str, Any]:
+                    section_request = client._build_request(code, language, section=section)
+                    return client._parse_analysis(client.backend.complete(section_request).content, section)
+                generated, elapsed = _timed(run_section)
+                analysis[section] = generated[section]
+                stages[section].append(elapsed)
+            if renderers:
+                # The app keeps and renders the typed model, as built from a finished job
+                typed = Analysis.from_dict(analysis)
+                _, elapsed = _timed(lambda: [render(typed) for render in renderers.values()])
+                stages["render"].append(elapsed)
+        results[name] = {
+            "lines": len(code.split("\n")),
+            "response_bytes": len(completion.content.encode("utf-8")),
+            "stages": {stage: summarize(samples) for stage, samples in stages.items() if samples},
+        }
+    return results
+
+
+def bench_chunked(analyzer: CodeAnalyzer, language: str, code: str, iterations: int, renderers) -> Dict[str, Any]:
+    """
+    Time a snippet too long for one request: its explanations end to end over
+    concurrent chunks ("chunked"), then each deferred section and rendering
+    """
+    stages: Dict[str, List[float]] = {"chunked": [], "render": []}
+    stages.update({section: [] for section in DEFERRED_SECTIONS})
+    for _ in range(iterations):
+        analysis, elapsed = _timed(lambda: analyzer.analyze_code(code, language))
+        stages["chunked"].append(elapsed)
+        for section in DEFERRED_SECTIONS:
+            analysis[section], elapsed = _timed(lambda: analyzer.analyze_section(code, language, section))
+            stages[section].append(elapsed)
+        if renderers:
+            typed = Analysis.from_dict(analysis)
+            _, elapsed = _timed(lambda: [render(typed) for render in renderers.values()])
+            stages["render"].append(elapsed)
+    return {
+        "lines": len(code.split("\n")),
+        "stages": {stage: summarize(samples) for stage, samples in stages.items() if samples},
+    }
+
+
+def bench_concurrency(backend: SyntheticBackend, corpus, sessions: int, per_session: int) -> Dict[str, Any]:
+    """Run `sessions` concurrent users through one shared analyzer, each analyzing distinct code"""
+    analyzer = CodeAnalyzer(
+        cache=AnalysisCache(path=None, max_memory_entries=0),
+        llm_client=AsyncLLMClient(backend=backend, max_concurrency=sessions),
+        incremental=False,
+        near_duplicates=False
+    )
+    snippets = [(language, code) for _, language, code in corpus if len(code.split("\n")) <= SIZES["medium"]]
+
+    def session(index: int) -> List[float]:
+        latencies = []
+        for j in range(per_session):
+            language, code = snippets[(index + j) % len(snippets)]
+            # Make every request unique so neither the cache nor coalescing kicks in
+            code = f"{code}\n{_unique_line(language, index, j)}"
+            _, elapsed = _timed(lambda: analyzer.analyze_code(code, language))
+            latencies.append(elapsed)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        latencies = [value for values in pool.map(session, range(sessions)) for value in values]
+    elapsed = time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "analyses": len(latencies),
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": summarize(latencies),
+    }
+
+
+def bench_memory(client: LLMClient, corpus, sessions: int) -> Dict[str, Any]:
+    """Bytes retained per session holding one analysis of each size, as st.session_state would"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    retained = []
+    analyzer = chunk_analyzer(client)
+    snippets = [(language, code) for _, language, code in corpus]
+    for index in range(sessions):
+        for language, code in snippets:
+            # Through the analyzer, so snippets too long for one request are chunked rather than left out
+            analysis = analyzer.analyze_code(f"{code}\n{_unique_line(language, index, 0)}", language)
+            retained.append(Analysis.from_dict(analysis))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "sessions": sessions,
+        "analyses_per_session": len(snippets),
+        "bytes_per_session": total / sessions if sessions else 0,
+    }
+
+
+def _unique_line(language: str, session: int, index: int) -> str:
+    if language == "python":
+        return f"marker_{session}_{index} = {index}"
+    if language == "javascript":
+        return f"const marker_{session}_{index} = {index};"
+    return f"int marker_{session}_{index} = {index};"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+            min_delta_ms: float = 1.0) -> List[str]:
+    """Describe every p95 stage latency or throughput that regressed beyond tolerance, and every stage no longer measured"""
+    regressions = []
+    for name, snippet in baseline.get("stages", {}).items():
+        for stage in snippet.get("stages", {}):
+            if stage not in current["stages"].get(name, {}).get("stages", {}):
+                regressions.append(f"{name} {stage} is no longer measured")
+    for name, snippet in current["stages"].items():
+        for stage, stats in snippet["stages"].items():
+            old = baseline.get("stages", {}).get(name, {}).get("stages", {}).get(stage)
+            if (old and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance)
+                    and stats["p95_ms"] - old["p95_ms"] > min_delta_ms):
+                regressions.append(f"{name} {stage} p95 {old['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms")
+    old_runs = {run["sessions"]: run for run in baseline.get("concurrency", [])}
+    for run in current["concurrency"]:
+        old = old_runs.get(run["sessions"])
+        if old and run["throughput_per_s"] < old["throughput_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{run['sessions']} sessions throughput "
+                f"{old['throughput_per_s']:.1f}/s -> {run['throughput_per_s']:.1f}/s"
+            )
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline offline")
+    parser.add_argument("--iterations", type=int, default=20, help="Runs per snippet for stage timings")
+    parser.add_argument("--sessions", default="1,8,32", help="Comma-separated concurrent session counts")
+    parser.add_argument("--per-session", type=int, default=5, help="Analyses per session")
+    parser.add_argument("--latency", default="fixed:0", help="Synthetic time-to-first-token distribution")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Synthetic generation throughput")
+    parser.add_argument("--no-render", action="store_true", help="Skip timing the Streamlit render functions")
+    parser.add_argument("--output", default="bench-results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore p95 changes smaller than this")
+    args = parser.parse_args(argv)
+
+    backend = SyntheticBackend(latency=args.latency, tokens_per_second=args.tokens_per_second, seed=0)
+    client = LLMClient(backend=backend)
+    corpus = build_corpus()
+    renderers = None if args.no_render else load_renderers()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "render_timed": renderers is not None,
+        },
+        "stages": bench_stages(client, corpus, args.iterations, renderers),
+        "concurrency": [
+            bench_concurrency(backend, corpus, int(sessions), args.per_session)
+            for sessions in args.sessions.split(",")
+        ],
+        "memory": bench_memory(client, corpus, sessions=10),
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for name, snippet in results["stages"].items():
+        timings = "  ".join(
+            f"{stage} p50 {stats['p50_ms']:.2f} p95 {stats['p95_ms']:.2f} p99 {stats['p99_ms']:.2f}"
+            for stage, stats in snippet["stages"].items()
+        )
+        print(f"{name:<18} {timings}")
+    for run in results["concurrency"]:
+        print(
+            f"{run['sessions']:>3} sessions: {run['throughput_per_s']:.1f} analyses/s, "
+            f"p95 {run['latency']['p95_ms']:.1f}ms"
+        )
+    print(f"memory: {results['memory']['bytes_per_session'] / 1024:.1f} KiB per session")
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Quota benchmark - Latency of light users while one session floods the queue
+Runs background jobs on the synthetic backend under an emulated tokens-per-
+minute limit. A few light sessions submit small snippets at a steady pace;
+in the noisy scenarios one heavy session also keeps submitting long files.
+Reports the light sessions' job latency alone, next to the heavy session
+without quotas, and next to it with a session quota.
+
+Usage: python -m benchmarks.quotas [--duration 20] [--session-quota 60000]
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from benchmarks.pipeline import summarize
+from services.analyzer import CodeAnalyzer
+from services.backends import SyntheticBackend
+from services.cache import AnalysisCache
+from services.jobs import JobQueue
+from services.llm import AsyncLLMClient
+
+
+def make_code(lines: int, variant: int) -> str:
+    """A Python file of `lines` lines whose constants make every variant a distinct analysis"""
+    body = []
+    index = 0
+    while len(body) < lines:
+        body.extend([
+            f"def step_{index}(values):",
+            f"    total = {variant * 1000 + index}",
+            "    for value in values:",
+            f"        total += value % {index + 2}",
+            "    return total",
+            "",
+        ])
+        index += 1
+    return "\n".join(body[:lines])
+
+
+def run(args: argparse.Namespace, heavy: bool, session_quota: float) -> Dict[str, Any]:
+    """One scenario; returns the light sessions' latency and what happened to the heavy session's jobs"""
+    backend = SyntheticBackend(latency=args.latency, tokens_per_minute=args.tokens_per_minute, seed=1)
+    analyzer = CodeAnalyzer(
+        cache=AnalysisCache(path=None),
+        llm_client=AsyncLLMClient(backend=backend, max_concurrency=16),
+        incremental=False,
+        near_duplicates=False,
+        precomputed=False,
+    )
+    options: Dict[str, Any] = {}
+    if session_quota:
+        # Imported here so the scenarios without quotas also run on trees that predate them
+        from services.quotas import QuotaManager
+        options["quotas"] = QuotaManager({"session": session_quota})
+    jobs = JobQueue(analyzer, path=None, max_workers=args.workers, prefetch=(), **options)
+
+    light_jobs, heavy_jobs = [], []
+    stop = time.monotonic() + args.duration
+    variants = iter(range(1, 1_000_000))
+
+    def light(session: str) -> None:
+        while time.monotonic() < stop:
+            light_jobs.append(jobs.submit(make_code(args.light_lines, next(variants)), "python", session))
+            time.sleep(args.light_interval)
+
+    def flood() -> None:
+        while time.monotonic() < stop:
+            heavy_jobs.append(jobs.submit(make_code(args.heavy_lines, next(variants)), "python", "heavy"))
+            time.sleep(args.heavy_interval)
+
+    threads = [threading.Thread(target=light, args=(f"light-{index}",)) for index in range(args.light_sessions)]
+    if heavy:
+        threads.append(threading.Thread(target=flood))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    deadline = time.monotonic() + args.timeout
+    while any(not job.finished for job in light_jobs) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    # Heavy jobs still waiting are abandoned rather than drained
+    jobs._pool.shutdown(wait=False, cancel_futures=True)
+
+    latencies = [job.finished_at - job.created for job in light_jobs if job.finished]
+    modes = Counter(job.quota.mode if getattr(job, "quota", None) is not None else "normal" for job in heavy_jobs)
+    return {
+        "light_jobs": len(light_jobs),
+        "light_unfinished": sum(1 for job in light_jobs if not job.finished),
+        "light_failed": sum(1 for job in light_jobs if job.finished and job.error),
+        "light_latency": summarize(latencies),
+        "heavy_jobs": len(heavy_jobs),
+        "heavy_finished": sum(1 for job in heavy_jobs if job.finished),
+        "heavy_modes": dict(modes),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure light users' latency next to a heavy user, with and without quotas")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds jobs are submitted for")
+    parser.add_argument("--light-sessions", type=int, default=4, help="Sessions submitting small snippets")
+    parser.add_argument("--light-lines", type=int, default=8, help="Lines of each light snippet")
+    parser.add_argument("--light-interval", type=float, default=2.0, help="Seconds between a light session's jobs")
+    parser.add_argument("--heavy-lines", type=int, default=200, help="Lines of each heavy file")
+    parser.add_argument("--heavy-interval", type=float, default=1.0, help="Seconds between the heavy session's jobs")
+    parser.add_argument("--tokens-per-minute", type=float, default=240000, help="Emulated account token limit")
+    parser.add_argument("--session-quota", type=float, default=60000, help="Tokens per hour per session")
+    parser.add_argument("--latency", default="fixed:0.3", help="Synthetic backend latency, see parse_latency")
+    parser.add_argument("--workers", type=int, default=4, help="Job workers")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for light jobs to finish")
+    parser.add_argument("--output", default="quota-results.json", help="Where to write the results")
+    args = parser.parse_args(argv)
+
+    results = {
+        "light_only": run(args, heavy=False, session_quota=0),
+        "heavy_no_quota": run(args, heavy=True, session_quota=0),
+        "heavy_with_quota": run(args, heavy=True, session_quota=args.session_quota),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for name, result in results.items():
+        latency = result["light_latency"]
+        heavy = ""
+        if result["heavy_jobs"]:
+            modes = ", ".join(f"{mode} {count}" for mode, count in sorted(result["heavy_modes"].items()))
+            heavy = f"  heavy: {result['heavy_finished']}/{result['heavy_jobs']} finished ({modes})"
+        print(f"{name:<17} light p50 {latency['p50_ms']:.0f}ms p95 {latency['p95_ms']:.0f}ms "
+              f"({result['light_jobs']} jobs, {result['light_unfinished']} unfinished){heavy}")
+    print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Rerun benchmark - Time Streamlit reruns and measure their websocket payload
+Starts the app against the synthetic backend, drives it over the same
+websocket protocol the browser uses, analyzes a large snippet and then
+measures plain reruns and "Reveal Answer" clicks on the finished analysis.
+
+Usage: python -m benchmarks.render [--lines 200] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+from benchmarks.pipeline import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_code(lines: int) -> str:
+    """A Python file of roughly `lines` lines made of small functions"""
+    body = []
+    index = 0
+    while len(body) < lines:
+        body.extend([
+            f"def step_{index}(values, limit):",
+            "    total = 0",
+            "    for value in values:",
+            f"        if value % {index + 2} == 0 and value < limit:",
+            f"            total += value * {index + 1}",
+            "    return total",
+            "",
+        ])
+        index += 1
+    return "\n".join(body[:lines])
+
+
+class Widget:
+    """A widget found in the app's output"""
+
+    def __init__(self, kind: str, widget_id: str, label: str, fragment_id: str):
+        self.kind = kind
+        self.id = widget_id
+        self.label = label
+        self.fragment_id = fragment_id
+
+
+class Session:
+    """One browser tab, speaking the Streamlit websocket protocol"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.connection = None
+        self.widget_states: Dict[str, WidgetState] = {}
+        self.widgets: Dict[str, Widget] = {}
+        self.auto_reruns: Dict[str, float] = {}
+
+    async def connect(self) -> None:
+        self.connection = await websocket_connect(
+            f"ws://localhost:{self.port}/_stcore/stream", max_message_size=256 * 1024 * 1024
+        )
+
+    async def rerun(self, trigger: Optional[Widget] = None, fragment_id: str = "") -> Tuple[float, int, int]:
+        """
+        Rerun the script (or one fragment) and wait for it to finish
+
+        Returns:
+            (seconds, payload bytes, messages) received for the run
+        """
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        if fragment_id:
+            message.rerun_script.fragment_id = fragment_id
+        states = list(self.widget_states.values())
+        if trigger is not None:
+            states.append(WidgetState(id=trigger.id, trigger_value=True))
+        message.rerun_script.widget_states.widgets.extend(states)
+
+        started = time.perf_counter()
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        payload = messages = 0
+        while True:
+            data = await self.connection.read_message()
+            if data is None:
+                raise RuntimeError("The app closed the websocket")
+            payload += len(data)
+            messages += 1
+            forward = ForwardMsg.FromString(data)
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                # Sent when a full run starts; fragments it keeps polling announce themselves again
+                self.auto_reruns.clear()
+            elif kind == "delta":
+                self._note_widget(forward)
+            elif kind == "auto_rerun":
+                self.auto_reruns[forward.auto_rerun.fragment_id] = forward.auto_rerun.interval
+            elif kind == "script_finished":
+                # A run cut short by st.rerun is followed by the next one
+                if forward.script_finished in (ForwardMsg.FINISHED_SUCCESSFULLY,
+                                               ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY):
+                    return time.perf_counter() - started, payload, messages
+
+    def find(self, kind: str, label: str) -> List[Widget]:
+        return [widget for widget in self.widgets.values() if widget.kind == kind and label in widget.label]
+
+    def _note_widget(self, forward: ForwardMsg) -> None:
+        if forward.delta.WhichOneof("type") != "new_element":
+            return
+        element = forward.delta.new_element
+        kind = element.WhichOneof("type")
+        if kind in ("button", "text_area", "selectbox"):
+            proto = getattr(element, kind)
+            self.widgets[proto.id] = Widget(kind, proto.id, proto.label, forward.delta.fragment_id)
+
+
+async def measure(port: int, lines: int, repeat: int, timeout: float) -> Dict[str, Any]:
+    session = Session(port)
+    await session.connect()
+    _, first_payload, _ = await session.rerun()
+
+    text_area, = session.find("text_area", "Enter your code")
+    analyze, = session.find("button", "Analyze Code")
+    session.widget_states[text_area.id] = WidgetState(id=text_area.id, string_value=make_code(lines))
+
+    # Submit, ask for the quiz once the explanations are in, then let the page poll until its buttons are shown
+    await session.rerun(trigger=analyze)
+    deadline = time.monotonic() + timeout
+    quiz_requested = False
+    while not session.find("button", "Reveal Answer"):
+        if time.monotonic() > deadline:
+            raise RuntimeError("The analysis did not finish in time")
+        generate = session.find("button", "Generate quiz")
+        if generate and not quiz_requested:
+            quiz_requested = True
+            await session.rerun(trigger=generate[0])
+        elif session.auto_reruns:
+            fragment_id, interval = next(iter(session.auto_reruns.items()))
+            await asyncio.sleep(interval)
+            await session.rerun(fragment_id=fragment_id)
+        else:
+            # Pages that poll with st.rerun keep sending runs without being asked
+            await session.rerun()
+
+    reruns, reveals = [], []
+    for _ in range(repeat):
+        reruns.append(await session.rerun())
+    for _ in range(repeat):
+        reveal = session.find("button", "Reveal Answer")[0]
+        reveals.append(await session.rerun(trigger=reveal, fragment_id=reveal.fragment_id))
+
+    def describe(samples: List[Tuple[float, int, int]]) -> Dict[str, Any]:
+        return {
+            "time": summarize([seconds for seconds, _, _ in samples]),
+            "payload_bytes": max(payload for _, payload, _ in samples),
+            "messages": max(messages for _, _, messages in samples),
+        }
+
+    return {"lines": lines, "first_run_bytes": first_payload,
+            "rerun": describe(reruns), "reveal_answer": describe(reveals)}
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+async def _wait_for_server(port: int, timeout: float) -> None:
+    client = AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.fetch(f"http://localhost:{port}/_stcore/health")
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure Streamlit rerun time and websocket payload")
+    parser.add_argument("--lines", type=int, default=200, help="Lines of the analyzed snippet")
+    parser.add_argument("--repeat", type=int, default=5, help="Samples of each interaction")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for the analysis")
+    parser.add_argument("--output", default="render-results.json", help="Where to write the results")
+    args = parser.parse_args(argv)
+
+    port = _free_port()
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "synthetic",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark"),
+        "ANALYSIS_CACHE_PATH": "",
+        "ANALYSIS_JOBS_PATH": "",
+        "SIMILARITY_INDEX": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(_wait_for_server(port, 30.0))
+        results = asyncio.run(measure(port, args.lines, args.repeat, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"first run: {results['first_run_bytes'] / 1024:.1f} KiB")
+    for name in ("rerun", "reveal_answer"):
+        stats = results[name]
+        print(f"{name:<14} p50 {stats['time']['p50_ms']:.1f}ms p95 {stats['time']['p95_ms']:.1f}ms  "
+              f"{stats['payload_bytes'] / 1024:.1f} KiB in {stats['messages']} messages")
+    print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Local Redis stand-in - Serves the subset of the Redis protocol the shared cache uses
+Keeps everything in memory in one asyncio loop, so commands are atomic just
+as on a real server. Lets the shared-cache harness exercise the redis://
+store on machines without Redis.
+
+Usage: python -m benchmarks.resp_server [--port 6399]
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.stores import REDIS_RELEASE_SCRIPT
+
+
+class Database:
+    """Keys with optional expiry in monotonic seconds"""
+
+    def __init__(self):
+        self.values: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def execute(self, command: List[bytes]) -> Any:
+        name = command[0].upper()
+        args = command[1:]
+        if name == b"PING":
+            return _Status(b"PONG")
+        if name in (b"AUTH", b"SELECT"):
+            return _Status(b"OK")
+        if name == b"GET":
+            return self.get(args[0])
+        if name == b"SET":
+            return self.set(args)
+        if name == b"DEL":
+            live = [key for key in args if self.get(key) is not None]
+            for key in live:
+                del self.values[key]
+            return len(live)
+        if name == b"EXISTS":
+            return sum(self.get(key) is not None for key in args)
+        if name == b"TTL":
+            if self.get(args[0]) is None:
+                return -2
+            expires = self.values[args[0]][1]
+            return -1 if expires is None else int(expires - time.monotonic())
+        if name == b"SCAN":
+            pattern = args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*"
+            keys = [key for key in list(self.values) if self.get(key) is not None
+                    and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return [b"0", keys]
+        if name == b"EVAL":
+            if args[0].decode() != REDIS_RELEASE_SCRIPT:
+                return _Error(b"ERR only the cache's release script is supported")
+            key, owner = args[2], args[3]
+            if self.get(key) == owner:
+                del self.values[key]
+                return 1
+            return 0
+        return _Error(b"ERR unknown command '" + name + b"'")
+
+    def set(self, args: List[bytes]) -> Any:
+        key, value = args[0], args[1]
+        options = [arg.upper() for arg in args[2:]]
+        expires = None
+        if b"EX" in options:
+            expires = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+        elif b"PX" in options:
+            expires = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+        if b"NX" in options and self.get(key) is not None:
+            return None
+        self.values[key] = (value, expires)
+        return _Status(b"OK")
+
+
+class _Status(bytes):
+    pass
+
+
+class _Error(bytes):
+    pass
+
+
+def encode_reply(reply: Any) -> bytes:
+    if isinstance(reply, _Status):
+        return b"+" + reply + b"\r\n"
+    if isinstance(reply, _Error):
+        return b"-" + reply + b"\r\n"
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode_reply(item) for item in reply)
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as typed into telnet
+        return line.split()
+    command = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(length + 2))[:-2])
+    return command
+
+
+async def serve(port: int) -> None:
+    database = Database()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                command = await read_command(reader)
+                if not command:
+                    break
+                writer.write(encode_reply(database.execute(command)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    print(f"listening on redis://127.0.0.1:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="In-memory stand-in for the Redis commands the cache uses")
+    parser.add_argument("--port", type=int, default=6399, help="Port to listen on (localhost only)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Shared-cache benchmark - N worker processes analyzing the same snippets against one store
+Each worker is a separate interpreter with its own analyzer and in-memory
+cache tier, as a Streamlit replica would be; they share only the store. All
+workers analyze every snippet, each in its own order, starting together.
+With working claims every snippet costs exactly one LLM request per stage
+across all workers, and every worker gets the same result.
+
+Usage:
+    python -m benchmarks.shared_cache --workers 4
+    python -m benchmarks.shared_cache --store redis://localhost:6379/0
+    python -m benchmarks.shared_cache --store standin
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.pipeline import SIZES, build_corpus, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def snippets(count: int) -> List[Tuple[str, str, str]]:
+    """(name, language, code) of the first `count` snippets that fit one request"""
+    corpus = [entry for entry in build_corpus() if len(entry[2].split("\n")) <= SIZES["medium"]]
+    return corpus[:count]
+
+
+def worker(index: int, store: str, latency: str, count: int, sections: List[str], start: Any, results: Any) -> None:
+    """Analyze every snippet in a worker-specific order and report what it cost"""
+    from services import metrics
+    from services.analyzer import CodeAnalyzer
+    from services.backends import SyntheticBackend
+    from services.cache import AnalysisCache
+    from services.llm import LLMClient
+
+    analyzer = CodeAnalyzer(
+        cache=AnalysisCache(path=store),
+        llm_client=LLMClient(backend=SyntheticBackend(latency=latency, seed=index)),
+        incremental=False,
+        near_duplicates=False,
+        precomputed=False,
+    )
+    order = snippets(count)
+    random.Random(index).shuffle(order)
+
+    start.wait()
+    latencies, digests = [], {}
+    for name, language, code in order:
+        started = time.perf_counter()
+        analysis = analyzer.analyze_code(code, language, sections)
+        latencies.append(time.perf_counter() - started)
+        digests[name] = hashlib.sha256(json.dumps(analysis, sort_keys=True).encode("utf-8")).hexdigest()
+
+    snapshot = metrics.REGISTRY.snapshot()
+    results.put({
+        "worker": index,
+        "llm_requests": int(sum(snapshot.get("llm_requests_total", {}).values())),
+        "sources": {labels: value for labels, value in snapshot.get("analysis_requests_total", {}).items()},
+        "latencies": latencies,
+        "digests": digests,
+    })
+
+
+def run(store: str, workers: int, latency: str, count: int, sections: List[str]) -> Dict[str, Any]:
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(index, store, latency, count, sections, start, results))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Give the interpreters time to import before releasing them together
+    time.sleep(2.0)
+    started = time.perf_counter()
+    start.set()
+    reports = [results.get(timeout=600) for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    unique = len(snippets(count))
+    expected = unique * (1 + len(sections))
+    requests = sum(report["llm_requests"] for report in reports)
+    sources: Counter = Counter()
+    for report in reports:
+        sources.update(report["sources"])
+    mismatched = sorted(
+        name for name in reports[0]["digests"]
+        if len({report["digests"][name] for report in reports}) > 1
+    )
+    return {
+        "store": store,
+        "workers": workers,
+        "snippets": unique,
+        "sections": sections,
+        "elapsed_s": elapsed,
+        "llm_requests": requests,
+        "expected_requests": expected,
+        "duplicate_requests": requests - expected,
+        "sources": dict(sources),
+        "mismatched": mismatched,
+        "latency": summarize([value for report in reports for value in report["latencies"]]),
+    }
+
+
+def _start_standin() -> Tuple[subprocess.Popen, str]:
+    """Start the local Redis stand-in on a free port"""
+    import socket
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.resp_server", "--port", str(port)],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    server.stdout.readline()
+    return server, f"redis://127.0.0.1:{port}/0"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run worker processes against one shared analysis cache")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--snippets", type=int, default=8, help="Distinct snippets every worker analyzes")
+    parser.add_argument("--sections", default="quiz", help="Comma-separated deferred sections to request too")
+    parser.add_argument("--latency", default="fixed:0.2", help="Synthetic backend latency, see parse_latency")
+    parser.add_argument("--store", help="SQLite path, redis:// URL or 'standin' (default: a fresh SQLite file)")
+    parser.add_argument("--output", default="shared-cache-results.json", help="Where to write the results")
+    args = parser.parse_args(argv)
+    sections = [section for section in args.sections.split(",") if section]
+
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        store = args.store or os.path.join(directory, "analysis.sqlite3")
+        if store == "standin":
+            server, store = _start_standin()
+        try:
+            results = run(store, args.workers, args.latency, args.snippets, sections)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"{results['workers']} workers x {results['snippets']} snippets against {results['store']}")
+    print(f"LLM requests: {results['llm_requests']} (expected {results['expected_requests']}, "
+          f"{results['duplicate_requests']} duplicated)")
+    print(f"sources: {', '.join(f'{labels} {value:.0f}' for labels, value in sorted(results['sources'].items()))}")
+    print(f"latency p50 {results['latency']['p50_ms']:.1f}ms p95 {results['latency']['p95_ms']:.1f}ms  "
+          f"wall {results['elapsed_s']:.2f}s")
+    print(f"results written to {args.output}")
+
+    failed = False
+    if results["duplicate_requests"] > 0:
+        print(f"DUPLICATED WORK: {results['duplicate_requests']} LLM requests repeated another worker's")
+        failed = True
+    if results["mismatched"]:
+        print(f"MISMATCHED RESULTS: {', '.join(results['mismatched'])}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Startup benchmark - Cold import time of the app and the CLI
+Imports each entry point in fresh interpreters with `python -X importtime`,
+reports the median import time by top-level package and checks that heavy
+dependencies are left for first use
+
+Usage:
+    python -m benchmarks.startup --output startup-results.json
+    python -m benchmarks.startup --compare startup-results.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry points a new worker loads; app.py imports in Streamlit's bare mode
+ENTRY_POINTS = ["app", "cli"]
+# Loaded on first use only: a worker that never calls the model should not pay for them
+LAZY_MODULES = ["openai", "httpx", "tiktoken"]
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(module, self µs, cumulative µs, depth) of every line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            entries.append((module, int(own), int(cumulative), (len(indent) - 1) // 2))
+    return entries
+
+
+def measure_once(module: str) -> Dict[str, Any]:
+    """Import `module` in a fresh interpreter"""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    entries = parse_importtime(process.stderr)
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {module} failed: {errors[-1] if errors else process.returncode}")
+
+    packages: Dict[str, int] = defaultdict(int)
+    for name, own, _, _ in entries:
+        packages[name.split(".")[0]] += own
+    top = [cumulative for name, _, cumulative, depth in entries if name == module and depth == 0]
+    return {
+        "wall_ms": wall * 1000,
+        "import_ms": (top[-1] if top else 0) / 1000,
+        "modules": len(entries),
+        "packages_ms": {name: own / 1000 for name, own in packages.items()},
+        "loaded": {name for name, _, _, _ in entries},
+    }
+
+
+def measure(module: str, repeat: int) -> Dict[str, Any]:
+    """Median cold-start figures of `repeat` fresh imports of `module`"""
+    runs = [measure_once(module) for _ in range(repeat)]
+    packages = sorted(
+        ((name, statistics.median(run["packages_ms"].get(name, 0.0) for run in runs))
+         for name in runs[0]["packages_ms"]),
+        key=lambda item: item[1], reverse=True,
+    )
+    return {
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "wall_ms": statistics.median(run["wall_ms"] for run in runs),
+        "modules": runs[0]["modules"],
+        "top_packages_ms": dict(packages[:15]),
+        "eager_lazy_modules": [name for name in LAZY_MODULES if name in runs[0]["loaded"]],
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float) -> List[str]:
+    """Describe every entry point whose import time regressed beyond tolerance"""
+    regressions = []
+    for module, result in current["entry_points"].items():
+        old = baseline.get("entry_points", {}).get(module)
+        if (old and result["import_ms"] > old["import_ms"] * (1 + tolerance)
+                and result["import_ms"] - old["import_ms"] > min_delta_ms):
+            regressions.append(f"{module} import {old['import_ms']:.1f}ms -> {result['import_ms']:.1f}ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure cold import time with python -X importtime")
+    parser.add_argument("--module", action="append", help="Entry point to import (repeatable; default app and cli)")
+    parser.add_argument("--repeat", type=int, default=7, help="Fresh interpreters per entry point")
+    parser.add_argument("--output", default="startup-results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging")
+    parser.add_argument("--min-delta-ms", type=float, default=20.0, help="Ignore changes smaller than this")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": sys.version.split()[0],
+            "repeat": args.repeat,
+        },
+        "entry_points": {module: measure(module, args.repeat) for module in args.module or ENTRY_POINTS},
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    failed = False
+    for module, result in results["entry_points"].items():
+        heaviest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in list(result["top_packages_ms"].items())[:5])
+        print(f"{module:<6} import {result['import_ms']:.1f}ms  process {result['wall_ms']:.1f}ms  "
+              f"{result['modules']} modules  ({heaviest})")
+        for name in result["eager_lazy_modules"]:
+            print(f"EAGER IMPORT: {module} loads {name} at startup")
+            failed = True
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Truncation benchmark - Cost of responses cut off partway through their JSON
+Analyzes the corpus on the synthetic backend with a fraction of responses
+cut off, as when a model runs out of max_tokens. The strict client discards
+any response json.loads rejects and retries the whole stage on a stronger
+model, failing when none is left; the default client keeps what was finished
+and asks only for the lines the response did not reach.
+
+Usage: python -m benchmarks.truncation [--truncate-rate 0.3]
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.pipeline import build_corpus, summarize
+from services import metrics
+from services.analyzer import CodeAnalyzer
+from services.backends import SyntheticBackend
+from services.cache import AnalysisCache
+from services.llm import EXPLANATIONS, LLMClient
+
+
+class StrictClient(LLMClient):
+    """Discards every response json.loads rejects, as the client did before partial recovery"""
+
+    def _parse_analysis(self, content: Optional[str], section: str = EXPLANATIONS) -> Dict[str, Any]:
+        if content:
+            json.loads(content)
+        return super()._parse_analysis(content, section)
+
+
+def run(client_class: type, args: argparse.Namespace, sections: List[str]) -> Dict[str, Any]:
+    """Analyze every snippet once; returns what it cost and how many analyses failed"""
+    metrics.REGISTRY.reset()
+    backend = SyntheticBackend(
+        latency=args.latency, tokens_per_second=args.tokens_per_second,
+        truncate_rate=args.truncate_rate, seed=args.seed,
+    )
+    client = client_class(backend=backend)
+    analyzer = CodeAnalyzer(
+        cache=AnalysisCache(path=None),
+        llm_client=client,
+        incremental=False,
+        near_duplicates=False,
+        precomputed=False,
+    )
+    latencies, failed, missing = [], 0, 0
+    for _, language, code in build_corpus():
+        started = time.perf_counter()
+        try:
+            analysis = analyzer.analyze_code(code, language, sections)
+        except ValueError:
+            failed += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        explained = {explanation["line_number"] for explanation in analysis["line_explanations"]}
+        missing += sum(
+            1 for number, line in enumerate(code.split("\n"), start=1) if line.strip() and number not in explained
+        )
+
+    snapshot = metrics.REGISTRY.snapshot()
+    usage = client.usage_stats()
+    return {
+        "analyses": len(latencies),
+        "failed": failed,
+        "lines_unexplained": missing,
+        "llm_requests": usage["requests"],
+        "completion_tokens": usage["completion_tokens"],
+        "total_tokens": usage["total_tokens"],
+        # Failed analyses spend tokens too, so compare what each finished analysis cost
+        "tokens_per_analysis": usage["total_tokens"] / len(latencies) if latencies else 0.0,
+        "escalations": int(sum(snapshot.get("routing_escalations_total", {}).values())),
+        "truncations": {labels: value for labels, value in snapshot.get("llm_truncated_responses_total", {}).items()},
+        "latency": summarize(latencies),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare discarding truncated responses with recovering them")
+    parser.add_argument("--truncate-rate", type=float, default=0.3, help="Fraction of responses cut off partway")
+    parser.add_argument("--sections", default="quiz", help="Comma-separated deferred sections to request too")
+    parser.add_argument("--latency", default="fixed:0.05", help="Synthetic backend latency, see parse_latency")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Synthetic generation throughput")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for which responses are cut off")
+    parser.add_argument("--output", default="truncation-results.json", help="Where to write the results")
+    args = parser.parse_args(argv)
+    sections = [section for section in args.sections.split(",") if section]
+
+    results = {
+        "truncate_rate": args.truncate_rate,
+        "strict": run(StrictClient, args, sections),
+        "recovering": run(LLMClient, args, sections),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for name in ("strict", "recovering"):
+        result = results[name]
+        print(f"{name:<11} {result['analyses']} analyzed, {result['failed']} failed, "
+              f"{result['lines_unexplained']} lines unexplained; {result['llm_requests']} requests, "
+              f"{result['total_tokens']} tokens ({result['tokens_per_analysis']:.0f} per analysis); "
+              f"p50 {result['latency']['p50_ms']:.0f}ms p95 {result['latency']['p95_ms']:.0f}ms")
+    print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
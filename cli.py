@@ -0,0 +1,273 @@
+"""
+Code Understanding Assistant - Command-line interface
+Headless batch analysis of whole directories, precomputed bundles of course material,
+and signed links that carry a student's quota identity
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from dotenv import load_dotenv
+
+from services import metrics
+from services.analyzer import CodeAnalyzer
+from services.backends import create_backend
+from services.bundle import BundleWriter
+from services.llm import DEFERRED_SECTIONS, PROMPT_VERSION, LLMClient
+from services.quotas import sign_identity
+
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".js": "javascript",
+    ".mjs": "javascript",
+    ".cjs": "javascript",
+    ".jsx": "javascript",
+    ".java": "java",
+    ".cpp": "cpp",
+    ".cc": "cpp",
+    ".cxx": "cpp",
+    ".hpp": "cpp",
+    ".hh": "cpp",
+    ".c": "c",
+    ".h": "c",
+}
+
+SKIPPED_DIRECTORIES = {".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv", ".cache"}
+
+
+class RateLimiter:
+    """Spaces out calls so no more than `per_minute` start in any minute"""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until the next call is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def find_source_files(root: str) -> List[Tuple[str, str]]:
+    """
+    Walk a directory for files in a supported language
+
+    Args:
+        root: Directory to walk
+
+    Returns:
+        Sorted (path, language) pairs
+    """
+    files = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if d not in SKIPPED_DIRECTORIES)
+        for filename in filenames:
+            language = LANGUAGE_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+            if language:
+                files.append((os.path.join(directory, filename), language))
+    return sorted(files)
+
+
+def load_completed(output_path: str) -> Dict[str, str]:
+    """Map relative path -> content hash for every successful record already written"""
+    completed = {}
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            if "analysis" in record:
+                completed[record["path"]] = record["sha256"]
+    return completed
+
+
+def analyze_directory(args: argparse.Namespace) -> int:
+    """Run the `analyze` command"""
+    try:
+        llm_client = LLMClient(backend=create_backend(args.backend))
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    # Files in a batch are unrelated, so diffing one against the last is pointless
+    analyzer = CodeAnalyzer(max_workers=args.workers, llm_client=llm_client, incremental=False)
+
+    completed = {} if args.no_resume else load_completed(args.output)
+    pending = []
+    skipped = 0
+    for path, language in find_source_files(args.directory):
+        relative = os.path.relpath(path, args.directory)
+        with open(path, encoding="utf-8", errors="replace") as f:
+            code = f.read()
+        digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        if not code.strip() or completed.get(relative) == digest:
+            skipped += 1
+            continue
+        pending.append((relative, language, code, digest))
+
+    sections = [section.strip() for section in args.sections.split(",") if section.strip()]
+    unknown = [section for section in sections if section not in DEFERRED_SECTIONS]
+    if unknown:
+        print(f"error: unknown sections {unknown}; choose from {list(DEFERRED_SECTIONS)}", file=sys.stderr)
+        return 1
+    limiter = RateLimiter(args.rate_limit)
+
+    def analyze(language: str, code: str):
+        limiter.wait()
+        return analyzer.analyze_code(code, language, sections=sections)
+
+    succeeded = failed = 0
+    started = time.monotonic()
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(analyze, language, code): (relative, language, digest)
+            for relative, language, code, digest in pending
+        }
+        for future in as_completed(futures):
+            relative, language, digest = futures[future]
+            record = {"path": relative, "language": language, "sha256": digest}
+            try:
+                record["analysis"] = future.result()
+                succeeded += 1
+            except Exception as e:
+                record["error"] = str(e)
+                failed += 1
+                print(f"failed: {relative}: {e}", file=sys.stderr)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    elapsed = time.monotonic() - started
+
+    usage = analyzer.llm_client.usage_stats()
+    cache = analyzer.cache_stats()
+    rate = succeeded / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"analyzed {succeeded} files, {failed} failed, {skipped} already done")
+    print(f"elapsed {elapsed:.1f}s, throughput {rate:.1f} files/min")
+    print(
+        f"tokens: {usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion "
+        f"= {usage['total_tokens']} over {usage['requests']} requests"
+    )
+    print(f"cache: {cache['hits']} hits, {cache['misses']} misses")
+    return 1 if failed else 0
+
+
+def build_bundle(args: argparse.Namespace) -> int:
+    """Run the `bundle` command"""
+    try:
+        llm_client = LLMClient(backend=create_backend(args.backend))
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    # Course material gets fresh analyses, never ones adapted from similar code or read from the old bundle
+    analyzer = CodeAnalyzer(max_workers=args.workers, llm_client=llm_client, incremental=False,
+                            near_duplicates=False, precomputed=False)
+    writer = BundleWriter({"model": llm_client.model_key, "prompt_version": PROMPT_VERSION})
+
+    sources = []
+    for path, language in find_source_files(args.directory):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            code = f.read()
+        if code.strip():
+            sources.append((os.path.relpath(path, args.directory), language, code))
+
+    limiter = RateLimiter(args.rate_limit)
+
+    def analyze(language: str, code: str):
+        limiter.wait()
+        return analyzer.analyze_code(code, language, sections=DEFERRED_SECTIONS)
+
+    failed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(analyze, language, code): (relative, language, code)
+                   for relative, language, code in sources}
+        for future in as_completed(futures):
+            relative, language, code = futures[future]
+            try:
+                writer.add(code, language, future.result())
+            except Exception as e:
+                failed += 1
+                print(f"failed: {relative}: {e}", file=sys.stderr)
+    writer.write(args.output)
+
+    usage = llm_client.usage_stats()
+    print(f"bundled {len(writer)} analyses of {len(sources) - failed} files into {args.output}, {failed} failed")
+    print(f"elapsed {time.monotonic() - started:.1f}s, {usage['total_tokens']} tokens over {usage['requests']} requests")
+    return 1 if failed else 0
+
+
+def sign_link(args: argparse.Namespace) -> int:
+    """Run the `sign` command"""
+    key = os.getenv("QUOTA_SIGNING_KEY")
+    if not key:
+        print("error: QUOTA_SIGNING_KEY is not set", file=sys.stderr)
+        return 1
+    params = {"user": args.user}
+    if args.course:
+        params["course"] = args.course
+    params["sig"] = sign_identity(args.user, args.course, key)
+    print(f"{args.url}?{urlencode(params)}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command-line argument parser"""
+    parser = argparse.ArgumentParser(description="Code Understanding Assistant batch tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze = commands.add_parser("analyze", help="Analyze every supported file in a directory")
+    analyze.add_argument("directory", help="Directory to analyze")
+    analyze.add_argument("-o", "--output", default="analyses.jsonl", help="JSONL file to append results to")
+    analyze.add_argument("-w", "--workers", type=int, default=4, help="Files analyzed concurrently")
+    analyze.add_argument("--rate-limit", type=float, default=None, help="Maximum files started per minute")
+    analyze.add_argument("--backend", choices=["openai", "synthetic", "replay", "record"], default=None,
+                         help="LLM backend (defaults to LLM_BACKEND or openai)")
+    analyze.add_argument("--sections", default=",".join(DEFERRED_SECTIONS),
+                         help="Sections generated after the explanations (comma-separated; empty for none)")
+    analyze.add_argument("--no-resume", action="store_true", help="Re-analyze files already in the output")
+    analyze.set_defaults(handler=analyze_directory)
+
+    bundle = commands.add_parser("bundle", help="Precompute analyses of course material into a bundle file")
+    bundle.add_argument("directory", help="Directory of course snippets")
+    bundle.add_argument("-o", "--output", default="course.bundle", help="Bundle file to write (replaced whole)")
+    bundle.add_argument("-w", "--workers", type=int, default=4, help="Files analyzed concurrently")
+    bundle.add_argument("--rate-limit", type=float, default=None, help="Maximum files started per minute")
+    bundle.add_argument("--backend", choices=["openai", "synthetic", "replay", "record"], default=None,
+                        help="LLM backend (defaults to LLM_BACKEND or openai)")
+    bundle.set_defaults(handler=build_bundle)
+
+    sign = commands.add_parser("sign", help="Print a link to the app that charges a student's quotas")
+    sign.add_argument("user", help="Student id")
+    sign.add_argument("--course", default=None, help="Course id")
+    sign.add_argument("--url", default="http://localhost:8501/", help="Address of the app")
+    sign.set_defaults(handler=sign_link)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    metrics.configure_from_env()
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,50 +3,647 @@ Code Analyzer - Main analysis logic
 Coordinates LLM calls and response processing
 """
 
-from typing import Dict, Any
-from .llm import LLMClient
+import contextvars
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+from . import metrics
+from .bundle import AnalysisBundle, get_default_bundle
+from .cache import AnalysisCache, get_default_cache, make_cache_key
+from .chunker import CHUNK_THRESHOLD_LINES, Chunk, ChunkMerger, split_into_chunks
+from .incremental import Edit, diff_analysis
+from .llm import DEFERRED_SECTIONS, LLMClient, PROMPT_VERSION, TruncatedResponse
+from .normalizer import CanonicalCode, canonicalize, split_source_lines
+from .scheduler import current_session
+from .similarity import SimilarityIndex, get_default_index
+from .singleflight import SingleFlight
+from .static_analysis import analyze_static
+from .streaming import iter_analysis_items
 
 class CodeAnalyzer:
     """Main code analysis coordinator"""
     
-    def __init__(self):
-        """Initialize the analyzer"""
-        try:
-            self.llm_client = LLMClient()
-        except ValueError as e:
-            # Handle missing API key gracefully
-            self.llm_client = None
-            self.error_message = str(e)
+    def __init__(
+        self,
+        cache: Optional[AnalysisCache] = None,
+        max_workers: int = 8,
+        llm_client_class: Type[LLMClient] = LLMClient,
+        llm_client: Optional[LLMClient] = None,
+        incremental: bool = True,
+        max_sessions: int = 1024,
+        similarity_index: Optional[SimilarityIndex] = None,
+        near_duplicates: bool = True,
+        bundle: Optional[AnalysisBundle] = None,
+        precomputed: bool = True
+    ):
+        """
+        Initialize the analyzer
+        
+        Args:
+            cache: Analysis cache to use (defaults to the process-wide cache)
+            max_workers: Maximum number of chunks of a large file analyzed concurrently
+            llm_client_class: LLMClient or AsyncLLMClient
+            llm_client: Ready-made client, e.g. over an offline backend
+            incremental: Re-analyze only the lines a session changed since its last analysis
+            max_sessions: Sessions whose last analysis is kept for incremental re-analysis
+            similarity_index: Index of past analyses (defaults to the process-wide index)
+            near_duplicates: Adapt the analysis of structurally identical past code
+                instead of calling the LLM
+            bundle: Precomputed analyses checked before anything else (defaults to ANALYSIS_BUNDLE)
+            precomputed: Serve analyses from the bundle; off when building one
+        
+        Share one analyzer between sessions so identical concurrent
+        requests are coalesced into a single LLM call.
+        """
+        self.cache = cache if cache is not None else get_default_cache()
+        self.max_workers = max_workers
+        self.incremental = incremental
+        self.max_sessions = max_sessions
+        self.similar = None
+        if near_duplicates:
+            self.similar = similarity_index if similarity_index is not None else get_default_index()
+        self.bundle = None
+        if precomputed:
+            self.bundle = bundle if bundle is not None else get_default_bundle()
+        self._recent: "OrderedDict[str, Tuple[str, str, Dict[str, Any]]]" = OrderedDict()
+        self._recent_lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.llm_client = llm_client
+        if self.llm_client is None:
+            try:
+                self.llm_client = llm_client_class()
+            except ValueError as e:
+                # Handle missing API key gracefully
+                self.llm_client = None
+                self.error_message = str(e)
     
-    def analyze_code(self, code: str, language: str) -> Dict[str, Any]:
+    def analyze_code(self, code: str, language: str, sections: Iterable[str] = ()) -> Dict[str, Any]:
         """
         Analyze code and return structured explanation
         
         Args:
             code: The code to analyze
             language: Programming language
+            sections: DEFERRED_SECTIONS to generate as well; the others hold
+                only what the explanations stage found (see analyze_section)
             
         Returns:
             Structured analysis dictionary
         """
+        bundled = self._from_bundle(code, language)
+        if bundled is not None:
+            # Precomputed with every section
+            metrics.increment("analysis_requests_total", source="bundle")
+            self._remember(code, language, bundled)
+            return bundled
+        
         if not self.llm_client:
             # Return mock data if no API key
+            metrics.increment("analysis_requests_total", source="mock")
             return self._get_mock_analysis(code, language)
         
-        # Validate inputs
+        analysis = self._explain(code, language)
+        for section in sections:
+            analysis[section] = self.analyze_section(code, language, section)
+        return analysis
+    
+    def _explain(self, code: str, language: str) -> Dict[str, Any]:
+        """Run the explanations stage: line explanations plus statically detected concepts"""
+        
+        self._validate_input(code, language)
+        
+        # Near-identical snippets share one canonical form and cache entry
+        canonical = canonicalize(code, language)
+        cache_key = self._cache_key(canonical, language)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            metrics.increment("analysis_requests_total", source="cache")
+            analysis = self._from_canonical_lines(cached, canonical, code)
+            self._remember(code, language, analysis)
+            return analysis
+        
+        edit, source = self._plan(code, language)
+        
+        # Identical concurrent requests wait on a single LLM call, in this process and across workers
+        def run_analysis():
+            stored = self.cache.claim_or_wait(cache_key)
+            if stored is not None:
+                return self._from_canonical_lines(stored, canonical, code), stored, "shared"
+            try:
+                try:
+                    if edit is not None:
+                        analysis = self._last_analysis(self._analyze_edit(edit, language))
+                    elif self._needs_chunking(code, language):
+                        analysis = self._last_analysis(self._analyze_chunks(code, language))
+                    else:
+                        analysis = self._explain_lines(code, language)
+                except Exception as e:
+                    metrics.increment("analysis_failures_total")
+                    raise ValueError(f"Analysis failed: {str(e)}")
+                
+                canonical_analysis = canonical.to_canonical_analysis(analysis)
+                self.cache.set(cache_key, canonical_analysis)
+            finally:
+                self.cache.release(cache_key)
+            self._index(code, language, analysis, source)
+            return analysis, canonical_analysis, source
+        
+        (analysis, canonical_analysis, origin), shared = self.flights.do(cache_key, run_analysis)
+        if shared:
+            metrics.increment("analysis_requests_total", source="coalesced")
+            analysis = self._from_canonical_lines(canonical_analysis, canonical, code)
+        else:
+            metrics.increment("analysis_requests_total", source=origin)
+        self._remember(code, language, analysis)
+        return analysis
+    
+    def analyze_code_stream(self, code: str, language: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Analyze code, yielding results progressively
+        
+        Args:
+            code: The code to analyze
+            language: Programming language
+            
+        Yields:
+            (section, item) pairs as they become available, then
+            ("analysis", dict) with the complete analysis
+        """
+        bundled = self._from_bundle(code, language)
+        if bundled is not None:
+            metrics.increment("analysis_requests_total", source="bundle")
+            self._remember(code, language, bundled)
+            yield from iter_analysis_items(bundled)
+            yield "analysis", bundled
+            return
+        
+        if not self.llm_client:
+            metrics.increment("analysis_requests_total", source="mock")
+            analysis = self._get_mock_analysis(code, language)
+            yield from iter_analysis_items(analysis)
+            yield "analysis", analysis
+            return
+        
+        self._validate_input(code, language)
+        
+        canonical = canonicalize(code, language)
+        cache_key = self._cache_key(canonical, language)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            metrics.increment("analysis_requests_total", source="cache")
+            analysis = self._from_canonical_lines(cached, canonical, code)
+            self._remember(code, language, analysis)
+            yield from iter_analysis_items(analysis)
+            yield "analysis", analysis
+            return
+        
+        # Followers of an in-flight identical request replay its result
+        flight, leader = self.flights.join(cache_key)
+        if not leader:
+            metrics.increment("analysis_requests_total", source="coalesced")
+            # Flights resolve to (analysis, canonical analysis, origin) whether the leader streamed or not
+            canonical_analysis = self.flights.wait(flight)[1]
+            analysis = self._from_canonical_lines(canonical_analysis, canonical, code)
+            self._remember(code, language, analysis)
+            yield from iter_analysis_items(analysis)
+            yield "analysis", analysis
+            return
+        
+        analysis = stored = None
+        claimed = False
+        try:
+            # Another worker sharing the cache may already be analyzing this code
+            stored = self.cache.claim_or_wait(cache_key)
+            if stored is None:
+                claimed = True
+                edit, source = self._plan(code, language)
+                metrics.increment("analysis_requests_total", source=source)
+                if edit is not None:
+                    events = self._analyze_edit(edit, language)
+                elif self._needs_chunking(code, language):
+                    events = self._analyze_chunks(code, language)
+                else:
+                    events = self._stream_lines(code, language)
+                
+                try:
+                    for section, item in events:
+                        if section == "analysis":
+                            analysis = item
+                        else:
+                            yield section, item
+                except Exception as e:
+                    metrics.increment("analysis_failures_total")
+                    raise ValueError(f"Analysis failed: {str(e)}")
+                
+                canonical_analysis = canonical.to_canonical_analysis(analysis)
+                self.cache.set(cache_key, canonical_analysis)
+                self._index(code, language, analysis, source)
+        except BaseException as e:
+            # Covers the consumer abandoning the stream, so waiters never hang
+            error = e if isinstance(e, Exception) else ValueError("Analysis was cancelled")
+            self.flights.resolve(cache_key, flight, error=error)
+            raise
+        finally:
+            if claimed:
+                self.cache.release(cache_key)
+        
+        origin = source if stored is None else "shared"
+        if stored is not None:
+            metrics.increment("analysis_requests_total", source="shared")
+            canonical_analysis = stored
+            analysis = self._from_canonical_lines(stored, canonical, code)
+        self.flights.resolve(cache_key, flight, result=(analysis, canonical_analysis, origin))
+        self._remember(code, language, analysis)
+        if stored is not None:
+            yield from iter_analysis_items(analysis)
+        yield "analysis", analysis
+    
+    def analyze_section(self, code: str, language: str, section: str) -> List[Any]:
+        """
+        Generate one deferred section of an analysis with its own request
+        
+        Sections are cached and coalesced separately from the explanations,
+        so the UI can ask for each only when it is about to be shown.
+        
+        Args:
+            code: The code to analyze
+            language: Programming language
+            section: "concepts", "misconceptions" or "quiz"
+            
+        Returns:
+            The section's items
+        """
+        if section not in DEFERRED_SECTIONS:
+            raise ValueError(f"Unknown analysis section: {section}. Deferred sections: {list(DEFERRED_SECTIONS)}")
+        bundled = self._from_bundle(code, language)
+        if bundled is not None:
+            metrics.increment("analysis_sections_total", section=section, source="bundle")
+            return bundled[section]
+        if not self.llm_client:
+            metrics.increment("analysis_sections_total", section=section, source="mock")
+            return self._get_mock_analysis(code, language)[section]
+        
+        self._validate_input(code, language)
+        
+        cache_key = self._cache_key(canonicalize(code, language), language, section)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            metrics.increment("analysis_sections_total", section=section, source="cache")
+            return cached[section]
+        
+        def run_section():
+            stored = self.cache.claim_or_wait(cache_key)
+            if stored is not None:
+                return stored[section], "shared"
+            try:
+                try:
+                    if self.llm_client.fits(code, language, section):
+                        items = self.llm_client.analyze_section(code, language, section)
+                    else:
+                        items = self._section_from_chunks(code, language, section)
+                except Exception as e:
+                    metrics.increment("analysis_failures_total")
+                    raise ValueError(f"Analysis failed: {str(e)}")
+                # Stored as an analysis holding only this section
+                self.cache.set(cache_key, {"line_explanations": [], "concepts": [], "misconceptions": [], "quiz": [],
+                                           section: items})
+            finally:
+                self.cache.release(cache_key)
+            return items, "llm"
+        
+        (items, origin), shared = self.flights.do(cache_key, run_section)
+        metrics.increment("analysis_sections_total", section=section, source="coalesced" if shared else origin)
+        return list(items)
+    
+    def _section_from_chunks(self, code: str, language: str, section: str) -> List[Any]:
+        """Generate a section of a file too long for one request from its chunks, merged"""
+        chunks = self._fit_chunks(split_into_chunks(code, language), language)
+        contexts = [self._chunk_context(chunk, index, len(chunks), language) for index, chunk in enumerate(chunks)]
+        
+        def analyze(chunk: Chunk, chunk_language: str, context: str) -> Dict[str, Any]:
+            return {section: self.llm_client.analyze_section(chunk.code, chunk_language, section, context)}
+        
+        merger = ChunkMerger()
+        for chunk, analysis in self._run_chunks(chunks, contexts, language, analyze):
+            merger.add(chunk, analysis)
+        return merger.result()[section]
+    
+    def estimate_tokens(
+        self, code: str, language: str, sections: Iterable[str] = (), explanations: bool = True
+    ) -> int:
+        """
+        Tokens analyzing code would spend: the explanations (unless turned off) plus the given deferred sections
+        
+        Stages already in the bundle or the cache are free. Otherwise a stage
+        is counted as a full analysis (prompt plus max_tokens of each request
+        it would take), so edits and near-duplicates cost less than estimated.
+        
+        Raises:
+            ValueError: If the code is empty, in an unsupported language, or a line is too long for any model
+        """
+        if not self.llm_client or self.is_precomputed(code, language):
+            return 0
+        self._validate_input(code, language)
+        canonical = canonicalize(code, language)
+        total = 0
+        if explanations and not self.cache.contains(self._cache_key(canonical, language)):
+            if self._needs_chunking(code, language):
+                chunks = self._fit_chunks(split_into_chunks(code, language), language)
+                total += sum(self.llm_client.estimate_tokens(chunk.code, language) for chunk in chunks)
+            else:
+                total += self.llm_client.estimate_tokens(code, language)
+        for section in sections:
+            if self.cache.contains(self._cache_key(canonical, language, section)):
+                continue
+            if self.llm_client.fits(code, language, section):
+                total += self.llm_client.estimate_tokens(code, language, section)
+            else:
+                chunks = self._fit_chunks(split_into_chunks(code, language), language)
+                total += sum(self.llm_client.estimate_tokens(chunk.code, language, section) for chunk in chunks)
+        return total
+    
+    def is_precomputed(self, code: str, language: str) -> bool:
+        """Whether the bundle holds code's full analysis, deferred sections included"""
+        return self.bundle is not None and self.bundle.get(canonicalize(code, language)) is not None
+    
+    def _from_bundle(self, code: str, language: str) -> Optional[Dict[str, Any]]:
+        """The precomputed analysis of code, numbered by its own lines, or None"""
+        if self.bundle is None:
+            return None
+        canonical = canonicalize(code, language)
+        analysis = self.bundle.get(canonical)
+        if analysis is None:
+            return None
+        return self._from_canonical_lines(analysis, canonical, code)
+    
+    def _needs_chunking(self, code: str, language: str) -> bool:
+        """Whether the code is too long for a single analysis request"""
+        if len(code.strip().split('\n')) > CHUNK_THRESHOLD_LINES:
+            return True
+        # Long lines can overflow the model's context window well below the line threshold
+        return not self.llm_client.fits(code, language)
+    
+    def _analyze_chunks(self, code: str, language: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Analyze a large file as concurrent chunks
+        
+        Yields:
+            (section, item) pairs as each chunk finishes, then
+            ("analysis", dict) with the merged analysis
+        """
+        chunks = self._fit_chunks(split_into_chunks(code, language), language)
+        merger = ChunkMerger()
+        contexts = [self._chunk_context(chunk, index, len(chunks), language) for index, chunk in enumerate(chunks)]
+        for chunk, analysis in self._run_chunks(chunks, contexts, language):
+            yield from merger.add(chunk, analysis)
+        
+        yield "analysis", merger.result()
+    
+    def _fit_chunks(self, chunks: List[Chunk], language: str) -> List[Chunk]:
+        """Halve chunks until each fits in one request; a single line too long for any model is left to fail"""
+        fitted = []
+        pending = list(chunks)
+        while pending:
+            chunk = pending.pop(0)
+            if len(chunk.lines) == 1 or self.llm_client.fits(chunk.code, language):
+                fitted.append(chunk)
+                continue
+            half = len(chunk.lines) // 2
+            pending[:0] = [Chunk(chunk.start_line, chunk.lines[:half]),
+                           Chunk(chunk.start_line + half, chunk.lines[half:])]
+        return fitted
+    
+    def _analyze_edit(self, edit: Edit, language: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Re-analyze only the changed regions of an edited file
+        
+        Yields:
+            The explanations carried over from the previous analysis, then
+            (section, item) pairs as each region finishes, then
+            ("analysis", dict) with the merged analysis
+        """
+        merger = ChunkMerger()
+        yield from merger.add(edit.baseline, edit.reused)
+        contexts = [self._edit_context(region, language) for region in edit.regions]
+        
+        def analyze(region: Chunk, region_language: str, context: str) -> Dict[str, Any]:
+            # The unchanged lines around an edit are only there for the model to read
+            return self._explain_lines(region.code, region_language, context, edit.changed_in(region))
+        
+        for region, analysis in self._run_chunks(edit.regions, contexts, language, analyze):
+            yield from merger.add(region, edit.changed_only(region, analysis))
+        
+        yield "analysis", merger.result()
+    
+    def _run_chunks(
+        self,
+        chunks: List[Chunk],
+        contexts: List[str],
+        language: str,
+        analyze: Optional[Callable[[Chunk, str, str], Dict[str, Any]]] = None
+    ) -> Iterator[Tuple[Chunk, Dict[str, Any]]]:
+        """
+        Analyze chunks concurrently, yielding (chunk, analysis) as each finishes
+        
+        `analyze(chunk, language, context)` defaults to _explain_lines of the chunk's code.
+        """
+        if not chunks:
+            return
+        analyze = analyze or (lambda chunk, chunk_language, context: self._explain_lines(
+            chunk.code, chunk_language, context
+        ))
+        pool = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks))))
+        try:
+            # Each worker runs in a copy of the caller's context so its requests keep the caller's session
+            futures = {
+                pool.submit(
+                    contextvars.copy_context().run,
+                    analyze,
+                    chunk,
+                    language,
+                    context
+                ): chunk
+                for chunk, context in zip(chunks, contexts)
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Stop queued chunks if one failed or the consumer went away
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _explain_lines(
+        self, code: str, language: str, context: Optional[str] = None, lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """llm_client.analyze_code, finishing a response cut off partway with a request for the rest"""
+        try:
+            return self.llm_client.analyze_code(code, language, context, lines)
+        except TruncatedResponse as truncated:
+            return self._last_analysis(self._continue(code, language, truncated))
+    
+    def _stream_lines(self, code: str, language: str) -> Iterator[Tuple[str, Any]]:
+        """llm_client.analyze_code_stream, finishing a response cut off partway with a request for the rest"""
+        try:
+            yield from self.llm_client.analyze_code_stream(code, language)
+        except TruncatedResponse as truncated:
+            yield from self._continue(code, language, truncated)
+    
+    def _continue(self, code: str, language: str, truncated: TruncatedResponse) -> Iterator[Tuple[str, Any]]:
+        """
+        Explain only the lines a truncated response left out and stitch everything together
+        
+        Yields:
+            (section, item) pairs of the continuations, then
+            ("analysis", dict) with the stitched analysis
+        """
+        lines = split_source_lines(code)
+        gaps = [Chunk(first, lines[first - 1:last]) for first, last in truncated.gaps]
+        covered = {number for gap in gaps for number in range(gap.start_line, gap.end_line + 1)}
+        merger = ChunkMerger()
+        # Each gap's own analysis explains every line in it, template-explained ones included
+        merger.add(Chunk(1, lines), {
+            **truncated.analysis,
+            "line_explanations": [
+                explanation for explanation in truncated.analysis["line_explanations"]
+                if explanation["line_number"] not in covered
+            ],
+        })
+        # A continuation may itself be cut off; each gap leaves out a line the response did explain
+        contexts = [self._continuation_context(gap, len(lines), language) for gap in gaps]
+        for gap, analysis in self._run_chunks(gaps, contexts, language):
+            yield from merger.add(gap, analysis)
+        
+        yield "analysis", merger.result()
+    
+    def _chunk_context(self, chunk: Chunk, index: int, total: int, language: str) -> str:
+        """Tell the model which part of the file a chunk is"""
+        return (
+            f"This is part {index + 1} of {total} of a larger {language} file "
+            f"(lines {chunk.start_line}-{chunk.end_line}). Explain only the lines shown, "
+            f"numbering them from 1 at the start of this excerpt."
+        )
+    
+    def _edit_context(self, region: Chunk, language: str) -> str:
+        """Tell the model which part of an edited file a region is"""
+        return (
+            f"This excerpt is lines {region.start_line}-{region.end_line} of a larger {language} file "
+            f"that the student just edited. Number lines from 1 at the start of this excerpt."
+        )
+    
+    def _continuation_context(self, gap: Chunk, total: int, language: str) -> str:
+        """Tell the model which part of a snippet is left after a truncated response"""
+        return (
+            f"This excerpt is lines {gap.start_line}-{gap.end_line} of a {total}-line {language} snippet "
+            f"whose other lines are already explained. Explain every line shown, numbering them from 1 "
+            f"at the start of this excerpt."
+        )
+    
+    def _plan(self, code: str, language: str) -> Tuple[Optional[Edit], str]:
+        """
+        Decide how much of a cache miss needs the LLM
+
+        Returns:
+            (edit, source): an Edit when a previous analysis can be reused,
+            and the metrics label of the path taken
+        """
+        edit = self._plan_edit(code, language)
+        if edit is not None:
+            return edit, "incremental"
+        edit = self._plan_from_similar(code, language)
+        if edit is not None:
+            return edit, "similar"
+        return None, "llm"
+    
+    def _plan_edit(self, code: str, language: str) -> Optional[Edit]:
+        """Diff code against this session's previous analysis, if it is worth reusing"""
+        if not self.incremental:
+            return None
+        with self._recent_lock:
+            previous = self._recent.get(current_session.get())
+        if previous is None or previous[1] != language:
+            return None
+        return diff_analysis(previous[0], previous[2], code)
+    
+    def _plan_from_similar(self, code: str, language: str) -> Optional[Edit]:
+        """
+        Reuse the analysis of structurally identical past code
+
+        The stored code and analysis get this snippet's identifiers, then any
+        lines that still differ are re-analyzed like an edit.
+        """
+        if self.similar is None or self._needs_chunking(code, language):
+            return None
+        match = self.similar.find(code, language, self._variant())
+        if match is None:
+            return None
+        adapted_code, adapted_analysis = match.adapted()
+        return diff_analysis(adapted_code, adapted_analysis, code)
+    
+    def _index(self, code: str, language: str, analysis: Dict[str, Any], source: str) -> None:
+        """Make a fresh analysis available to near-duplicate lookups"""
+        if self.similar is not None and source != "similar":
+            self.similar.add(code, language, analysis, self._variant())
+    
+    def _remember(self, code: str, language: str, analysis: Dict[str, Any]) -> None:
+        """Keep the session's latest analysis for incremental re-analysis"""
+        if not self.incremental:
+            return
+        session = current_session.get()
+        with self._recent_lock:
+            self._recent[session] = (code, language, analysis)
+            self._recent.move_to_end(session)
+            while len(self._recent) > self.max_sessions:
+                self._recent.popitem(last=False)
+    
+    def _last_analysis(self, events: Iterator[Tuple[str, Any]]) -> Dict[str, Any]:
+        """Drain an event stream and return its final analysis"""
+        analysis = None
+        for section, item in events:
+            if section == "analysis":
+                analysis = item
+        return analysis
+    
+    def _validate_input(self, code: str, language: str) -> None:
+        """Reject empty code and unsupported languages"""
         if not code.strip():
             raise ValueError("Code cannot be empty")
         
         supported_languages = ["python", "javascript", "java", "cpp", "c"]
         if language.lower() not in supported_languages:
             raise ValueError(f"Language '{language}' not supported. Supported: {supported_languages}")
+    
+    def _variant(self) -> str:
+        """Model tiers and prompt version an analysis was made with, as in _cache_key"""
+        return f"{self.llm_client.model_key}/{PROMPT_VERSION}"
+    
+    def _cache_key(self, canonical: CanonicalCode, language: str, section: Optional[str] = None) -> str:
+        """Cache key for a canonicalized snippet (or one deferred section of it) under the current model and prompt"""
+        prompt_version = f"{PROMPT_VERSION}/{section}" if section else PROMPT_VERSION
+        return make_cache_key(canonical.text, language, self.llm_client.model_key, prompt_version)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Return cache hit/miss counters"""
+        return self.cache.stats()
+    
+    def _from_canonical_lines(self, analysis: Dict[str, Any], canonical: CanonicalCode, code: str) -> Dict[str, Any]:
+        """
+        Renumber cached explanations onto the lines of this particular variant
         
-        # Get AI analysis
-        try:
-            analysis = self.llm_client.analyze_code(code, language)
-            return analysis
-        except Exception as e:
-            raise ValueError(f"Analysis failed: {str(e)}")
+        The canonical form has no comment lines, so their template explanations
+        are restored as a fresh analysis of this variant would give them.
+        """
+        source_lines = split_source_lines(code)
+        explanations = []
+        for explanation in analysis.get("line_explanations", []):
+            line_number = canonical.to_source(explanation.get("line_number"))
+            if line_number is None:
+                continue
+            explanations.append({
+                **explanation,
+                "line_number": line_number,
+                "code": source_lines[line_number - 1].strip(),
+            })
+        return analyze_static(code, canonical.language).apply({**analysis, "line_explanations": explanations})
     
     def _get_mock_analysis(self, code: str, language: str) -> Dict[str, Any]:
         """
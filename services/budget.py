@@ -0,0 +1,135 @@
+"""
+Token Budget - Size prompts and responses to the model's limits
+Counts prompt tokens (with tiktoken when it is installed, otherwise a local
+approximation), sizes max_tokens from the number of lines to explain or the
+section requested, and refuses requests that cannot fit in the model's
+context window
+"""
+
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+# (context window, largest completion) by model name prefix; longest prefix wins
+MODEL_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gpt-3.5-turbo": (4096, 4096),
+    "gpt-3.5-turbo-16k": (16385, 16385),
+    "gpt-3.5-turbo-1106": (16385, 4096),
+    "gpt-3.5-turbo-0125": (16385, 4096),
+    "gpt-4": (8192, 8192),
+    "gpt-4-32k": (32768, 32768),
+    "gpt-4-1106": (128000, 4096),
+    "gpt-4-turbo": (128000, 4096),
+    "gpt-4o": (128000, 4096),
+}
+DEFAULT_MODEL_LIMITS = (8192, 4096)
+
+# Expected completion size of the explanations stage: the JSON envelope plus an object per line
+OUTPUT_BASE_TOKENS = 40
+OUTPUT_TOKENS_PER_LINE = 90
+# Expected completion size of each section generated by its own request
+SECTION_OUTPUT_TOKENS = {"concepts": 80, "misconceptions": 260, "quiz": 380}
+# Headroom over the expectation, so verbose answers are not cut off mid-JSON
+OUTPUT_MARGIN = 1.3
+
+# Framing tokens the chat format adds per message and per reply
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+
+# Pieces of text the local approximation counts: words, short digit runs, punctuation runs, whitespace
+_PIECES = re.compile(r" ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+")
+# Characters per token within a piece: long words and symbol runs split into several tokens
+_WORD_CHARS_PER_TOKEN = 5
+_SYMBOL_CHARS_PER_TOKEN = 2
+
+
+class PromptTooLarge(ValueError):
+    """The request cannot fit in the model's context window"""
+
+    def __init__(self, prompt_tokens: int, output_tokens: int, context_window: int, model: str):
+        super().__init__(
+            f"Code is too long to analyze in one request: about {prompt_tokens} prompt tokens plus "
+            f"{output_tokens} for the answer exceed {model}'s {context_window}-token context window"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.context_window = context_window
+
+
+def model_limits(model: Optional[str]) -> Tuple[int, int]:
+    """(context window, largest completion) of a model"""
+    if model:
+        prefixes = [prefix for prefix in MODEL_LIMITS if model.startswith(prefix)]
+        if prefixes:
+            return MODEL_LIMITS[max(prefixes, key=len)]
+    return DEFAULT_MODEL_LIMITS
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in a piece of text"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        piece = piece.lstrip(" ") or piece
+        if piece[0].isalpha():
+            tokens += math.ceil(len(piece) / _WORD_CHARS_PER_TOKEN)
+        elif piece[0].isspace() or piece[0].isdigit():
+            tokens += 1
+        else:
+            tokens += math.ceil(len(piece) / _SYMBOL_CHARS_PER_TOKEN)
+    return tokens
+
+
+def count_message_tokens(messages: Iterable[Mapping[str, Any]]) -> int:
+    """Prompt tokens of a list of chat messages, including the chat format's framing"""
+    return _REPLY_OVERHEAD + sum(
+        _MESSAGE_OVERHEAD + count_tokens(message.get("content") or "") for message in messages
+    )
+
+
+def expected_output_tokens(lines: int) -> int:
+    """max_tokens for an analysis explaining `lines` lines"""
+    return math.ceil((OUTPUT_BASE_TOKENS + OUTPUT_TOKENS_PER_LINE * lines) * OUTPUT_MARGIN)
+
+
+def section_output_tokens(section: str) -> int:
+    """max_tokens for a request generating one of SECTION_OUTPUT_TOKENS"""
+    return math.ceil(SECTION_OUTPUT_TOKENS[section] * OUTPUT_MARGIN)
+
+
+def fit_output(prompt_tokens: int, wanted: int, model: str) -> int:
+    """
+    Check that a request has room for its completion
+
+    Args:
+        prompt_tokens: Tokens of the prompt messages
+        wanted: Expected completion tokens (expected_output_tokens or section_output_tokens)
+        model: Model the request goes to
+
+    Returns:
+        max_tokens for the request
+
+    Raises:
+        PromptTooLarge: If the prompt plus the expected answer exceed the context window
+    """
+    context_window, max_output = model_limits(model)
+    if wanted > max_output or prompt_tokens + wanted > context_window:
+        raise PromptTooLarge(prompt_tokens, wanted, context_window, model)
+    return wanted
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """tiktoken's encoding for the GPT-3.5/4 family, or None if tiktoken is not installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding is downloaded on first use, which fails offline
+        return None
@@ -0,0 +1,164 @@
+"""
+Analysis Bundles - Precomputed analyses of course material in one read-only file
+Built offline (`python cli.py bundle`), memory-mapped by every worker so the
+operating system's page cache holds a single shared copy, and looked up
+through an open-addressing hash index over the canonical code: one probe
+sequence and the decoding of the matching entry only
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import Analysis
+from .normalizer import CanonicalCode, canonicalize
+
+# File layout: header, metadata JSON, index slots (8-byte aligned), then the encoded analyses
+MAGIC = b"CXBUNDLE"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQI")
+# Slot: 16-byte digest of the key, offset and length of the entry; length 0 marks an empty slot
+_SLOT = struct.Struct("<16sQI4x")
+# Index slots per entry, so probe sequences stay short
+_SLOTS_PER_ENTRY = 2
+
+
+def bundle_key(canonical: CanonicalCode) -> bytes:
+    """Lookup key of a canonicalized snippet: a prefix of its fingerprint"""
+    return bytes.fromhex(canonical.fingerprint)[:16]
+
+
+class BundleWriter:
+    """Collects analyses and writes them as a bundle"""
+
+    def __init__(self, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            metadata: Provenance stored in the bundle header, e.g. the model and prompt version
+        """
+        self.metadata = dict(metadata or {})
+        self._entries: Dict[bytes, bytes] = {}
+
+    def add(self, code: str, language: str, analysis: Dict[str, Any]) -> None:
+        """Add the analysis of a snippet; a later analysis of the same canonical code replaces it"""
+        canonical = canonicalize(code, language)
+        analysis = Analysis.from_dict(canonical.to_canonical_analysis(analysis))
+        self._entries[bundle_key(canonical)] = analysis.encode()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def write(self, path: str) -> None:
+        """
+        Write the bundle atomically
+
+        The new file replaces the old one by rename, so workers that have the
+        old bundle mapped keep reading it until they reopen.
+        """
+        slots = 1
+        while slots < max(len(self._entries), 1) * _SLOTS_PER_ENTRY:
+            slots *= 2
+        metadata = json.dumps({**self.metadata, "built": time.time(), "entries": len(self._entries)}).encode("utf-8")
+        table_offset = _align(_HEADER.size + len(metadata))
+        offset = table_offset + slots * _SLOT.size
+
+        table = bytearray(slots * _SLOT.size)
+        blobs: List[bytes] = []
+        for key, blob in self._entries.items():
+            slot = _home_slot(key, slots)
+            while _SLOT.unpack_from(table, slot * _SLOT.size)[2]:
+                slot = (slot + 1) & (slots - 1)
+            _SLOT.pack_into(table, slot * _SLOT.size, key, offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".bundle-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, slots, len(self._entries), len(metadata)))
+                f.write(metadata)
+                f.write(b"\0" * (table_offset - _HEADER.size - len(metadata)))
+                f.write(table)
+                for blob in blobs:
+                    f.write(blob)
+            # mkstemp creates the file private to its owner; workers may run as another user
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class AnalysisBundle:
+    """Read-only, memory-mapped bundle of precomputed analyses"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Bundle file written by BundleWriter
+
+        Raises:
+            ValueError: If the file is not a bundle of a supported version
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{path} is not an analysis bundle")
+        magic, version, self._slots, self._entries, metadata_length = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an analysis bundle")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported analysis bundle version {version} in {path}")
+        self.metadata = json.loads(bytes(self._map[_HEADER.size:_HEADER.size + metadata_length]))
+        self._table_offset = _align(_HEADER.size + metadata_length)
+
+    def get(self, canonical: CanonicalCode) -> Optional[Dict[str, Any]]:
+        """Return the analysis of a canonicalized snippet, numbered by canonical lines, or None"""
+        key = bundle_key(canonical)
+        slot = _home_slot(key, self._slots)
+        for _ in range(self._slots):
+            stored, offset, length = _SLOT.unpack_from(self._map, self._table_offset + slot * _SLOT.size)
+            if not length:
+                return None
+            if stored == key:
+                return Analysis.decode(self._map[offset:offset + length]).to_dict()
+            slot = (slot + 1) & (self._slots - 1)
+        return None
+
+    def __len__(self) -> int:
+        return self._entries
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _home_slot(key: bytes, slots: int) -> int:
+    return int.from_bytes(key[:8], "little") & (slots - 1)
+
+
+_default_bundle: Tuple[bool, Optional[AnalysisBundle]] = (False, None)
+_default_bundle_lock = threading.Lock()
+
+
+def get_default_bundle() -> Optional[AnalysisBundle]:
+    """Return the process-wide bundle named by ANALYSIS_BUNDLE, or None if none is configured"""
+    global _default_bundle
+    with _default_bundle_lock:
+        loaded, bundle = _default_bundle
+        if not loaded:
+            path = os.getenv("ANALYSIS_BUNDLE")
+            bundle = AnalysisBundle(path) if path else None
+            _default_bundle = (True, bundle)
+        return bundle
@@ -0,0 +1,253 @@
+"""
+Analysis Cache - Content-addressed storage for analysis results
+In-memory LRU tier of typed analyses in front of a shared store (a SQLite
+file or a Redis server, see stores.py) holding their compact binary
+encoding, with claims so that workers sharing the store compute each
+missing entry once
+"""
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from . import metrics
+from .models import Analysis
+from .stores import CacheStore, open_store
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "analysis.sqlite3")
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_CLAIM_TTL_SECONDS = 180.0
+# Waiting workers poll the store with exponential backoff between these bounds
+CLAIM_POLL_SECONDS = 0.05
+CLAIM_POLL_MAX_SECONDS = 0.5
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normalize code so trivially different pastes share a cache key
+
+    Only changes that cannot move a line are applied (line endings,
+    trailing spaces, trailing blank lines), so cached line numbers stay valid.
+    """
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).rstrip("\n")
+
+
+def make_cache_key(code: str, language: str, model: str, prompt_version: str) -> str:
+    """
+    Build the content-addressed key for an analysis
+
+    Args:
+        code: The code being analyzed
+        language: Programming language
+        model: LLM model name
+        prompt_version: Version of the analysis prompt
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = "\0".join([prompt_version, model, language.lower(), normalize_code(code)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier cache: an in-memory LRU in front of a store shared by every worker"""
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        max_memory_entries: int = 256,
+        max_disk_entries: int = 10000,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        claim_ttl_seconds: float = DEFAULT_CLAIM_TTL_SECONDS,
+    ):
+        """
+        Initialize the cache
+
+        Args:
+            path: SQLite file or redis:// URL of the shared tier, or None for memory only
+            max_memory_entries: Size of the in-memory LRU tier
+            max_disk_entries: Maximum number of entries kept in a SQLite tier
+            ttl_seconds: Age after which entries are treated as expired
+            claim_ttl_seconds: How long a claim on a missing entry lasts before
+                another worker may take over from its (presumably dead) holder
+        """
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0,
+                       "claims": 0, "shared_waits": 0}
+        # Identifies this cache's claims among every worker sharing the store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._store: Optional[CacheStore] = open_store(path, max_disk_entries, ttl_seconds) if path else None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached analysis as a fresh dict, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    metrics.increment("cache_lookups_total", result="memory_hit")
+                    return value.to_dict()
+                del self._memory[key]
+
+        value = self._load(key)
+        with self._lock:
+            if value is not None:
+                self._stats["disk_hits"] += 1
+                metrics.increment("cache_lookups_total", result="disk_hit")
+                return value.to_dict()
+            self._stats["misses"] += 1
+            metrics.increment("cache_lookups_total", result="miss")
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Whether an entry is cached, without counting a lookup"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                return True
+        return self._store is not None and self._store.get(key) is not None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store an analysis in both tiers"""
+        now = time.time()
+        value = Analysis.from_dict(value)
+        with self._lock:
+            self._remember(key, now, value)
+            self._stats["writes"] += 1
+        if self._store is not None:
+            evicted = self._store.set(key, value.encode(), now)
+            with self._lock:
+                self._stats["evictions"] += evicted
+
+    def claim_or_wait(self, key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Take responsibility for computing a missing entry, or wait for the worker that has
+
+        Exactly one of the workers sharing the store holds the claim on a key
+        at a time. The others poll until its result is stored, or take over
+        if the claim is released or expires without one.
+
+        Args:
+            key: Cache key that just missed
+            timeout: Longest wait in seconds (default: the claim TTL)
+
+        Returns:
+            The analysis another worker stored, or None once this worker holds
+            the claim and should compute the entry and then call release()
+        """
+        if self._store is None:
+            return None
+        deadline = time.monotonic() + (self.claim_ttl_seconds if timeout is None else timeout)
+        delay = CLAIM_POLL_SECONDS
+        while True:
+            if self._store.claim(key, self.owner, self.claim_ttl_seconds):
+                # The previous holder may have stored its result just before releasing
+                value = self._load(key)
+                if value is None:
+                    with self._lock:
+                        self._stats["claims"] += 1
+                    return None
+                self._store.release(key, self.owner)
+                return value.to_dict()
+
+            metrics.increment("cache_claim_waits_total")
+            while True:
+                if time.monotonic() >= deadline:
+                    # The holder outlived our patience: compute the entry without a claim
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, CLAIM_POLL_MAX_SECONDS)
+                value = self._load(key)
+                if value is not None:
+                    with self._lock:
+                        self._stats["shared_waits"] += 1
+                    return value.to_dict()
+                if not self._store.is_claimed(key):
+                    # Released without a result (the holder failed): try to take over
+                    break
+
+    def release(self, key: str) -> None:
+        """Give up this worker's claim on a key, whether or not its entry was stored"""
+        if self._store is not None:
+            self._store.release(key, self.owner)
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self._store is not None:
+            self._store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        disk_entries = self._store.count() if self._store is not None else 0
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = disk_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _load(self, key: str) -> Optional[Analysis]:
+        """Read an entry from the shared tier into the memory tier"""
+        if self._store is None:
+            return None
+        stored = self._store.get(key)
+        if stored is None:
+            return None
+        value, created = _decode(stored[0]), stored[1]
+        with self._lock:
+            self._remember(key, created, value)
+        return value
+
+    def _remember(self, key: str, created: float, value: Analysis) -> None:
+        """Insert into the memory tier, evicting the least recently used entry"""
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+
+def _decode(stored: Any) -> Analysis:
+    """Decode a disk row, written either as a binary encoding or (by older versions) as JSON"""
+    if isinstance(stored, bytes):
+        return Analysis.decode(stored)
+    return Analysis.from_dict(json.loads(stored))
+
+
+_default_cache: Optional[AnalysisCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> AnalysisCache:
+    """Return the process-wide cache, configured from the environment"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            path = os.getenv("ANALYSIS_CACHE_PATH", DEFAULT_CACHE_PATH)
+            _default_cache = AnalysisCache(
+                path=path or None,
+                max_memory_entries=int(os.getenv("ANALYSIS_CACHE_MEMORY_ENTRIES", "256")),
+                max_disk_entries=int(os.getenv("ANALYSIS_CACHE_DISK_ENTRIES", "10000")),
+                ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL", str(DEFAULT_TTL_SECONDS))),
+                claim_ttl_seconds=float(os.getenv("ANALYSIS_CLAIM_TTL", str(DEFAULT_CLAIM_TTL_SECONDS))),
+            )
+        return _default_cache
@@ -0,0 +1,203 @@
+"""
+Code Chunker - Split large files along syntactic boundaries
+Chunks are analyzed independently and merged back into one analysis
+"""
+
+import ast
+from typing import Any, Dict, List, Optional, Tuple
+
+from .normalizer import iter_c_family_tokens, split_source_lines
+
+# Files up to this many lines are analyzed in a single request
+CHUNK_THRESHOLD_LINES = 40
+# Target size of each chunk; a single function larger than this stays whole
+CHUNK_MAX_LINES = 30
+# Quiz questions kept after merging, picked round-robin across chunks
+MERGED_QUIZ_LIMIT = 5
+
+
+class Chunk:
+    """A contiguous slice of a source file"""
+
+    def __init__(self, start_line: int, lines: List[str]):
+        """
+        Args:
+            start_line: 1-based line number of the first line in the file
+            lines: Source lines of the chunk
+        """
+        self.start_line = start_line
+        self.lines = lines
+        self.code = "\n".join(lines)
+
+    @property
+    def end_line(self) -> int:
+        """1-based line number of the last line in the file"""
+        return self.start_line + len(self.lines) - 1
+
+
+def split_into_chunks(code: str, language: str, max_lines: int = CHUNK_MAX_LINES) -> List[Chunk]:
+    """
+    Split code into chunks at function/class (or brace-block) boundaries
+
+    Args:
+        code: The code to split
+        language: Programming language
+        max_lines: Target number of lines per chunk
+
+    Returns:
+        Chunks covering every line of the file, in order
+    """
+    lines = split_source_lines(code)
+    if language.lower() == "python":
+        starts = _python_unit_starts(code, max_lines)
+    else:
+        starts = _brace_unit_starts(code, max_lines)
+    if starts is None:
+        starts = list(range(1, len(lines) + 1))
+
+    # Greedily pack syntactic units into chunks of at most max_lines
+    boundaries = sorted(set([1] + [start for start in starts if 1 < start <= len(lines)]))
+    chunk_starts = [1]
+    previous = 1
+    for start in boundaries[1:] + [len(lines) + 1]:
+        if start - chunk_starts[-1] > max_lines and previous > chunk_starts[-1]:
+            chunk_starts.append(previous)
+        previous = start
+    chunk_starts.append(len(lines) + 1)
+
+    chunks = []
+    for begin, end in zip(chunk_starts, chunk_starts[1:]):
+        chunk_lines = lines[begin - 1:end - 1]
+        if any(line.strip() for line in chunk_lines):
+            chunks.append(Chunk(begin, chunk_lines))
+    return chunks
+
+
+def _python_unit_starts(code: str, max_lines: int) -> Optional[List[int]]:
+    """First line of every top-level statement; oversized classes are split per member"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    starts = []
+    for node in tree.body:
+        starts.append(_first_line(node))
+        if isinstance(node, ast.ClassDef) and node.end_lineno - _first_line(node) + 1 > max_lines:
+            starts.extend(_first_line(member) for member in node.body[1:])
+    return starts
+
+
+def _first_line(node: ast.AST) -> int:
+    """Line a statement starts on, including any decorators"""
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+
+def _brace_unit_starts(code: str, max_lines: int) -> List[int]:
+    """
+    Lines following a top-level '}' or ';' in C-family code
+
+    Oversized top-level blocks (e.g. a Java class) are split further at
+    the end of each nested block, i.e. per method.
+    """
+    outer, inner = [1], []
+    depth = 0
+    for kind, text, row in iter_c_family_tokens(code):
+        if kind != "op":
+            continue
+        if text in "{([":
+            depth += 1
+        elif text in "})]":
+            depth = max(depth - 1, 0)
+            if text == "}" and depth == 0:
+                outer.append(row + 1)
+            elif text == "}" and depth == 1:
+                inner.append(row + 1)
+        elif text == ";" and depth == 0:
+            outer.append(row + 1)
+
+    starts = list(outer)
+    for begin, end in zip(outer, outer[1:] + [code.count("\n") + 2]):
+        if end - begin > max_lines:
+            starts.extend(start for start in inner if begin < start < end)
+    return starts
+
+
+class ChunkMerger:
+    """Merge per-chunk analyses into one analysis with file-level line numbers"""
+
+    def __init__(self):
+        """Initialize an empty merged analysis"""
+        self._explanations: List[Dict[str, Any]] = []
+        self._concepts: List[str] = []
+        self._misconceptions: List[str] = []
+        self._quizzes: List[Tuple[int, List[Dict[str, Any]]]] = []
+        self._seen_concepts = set()
+        self._seen_misconceptions = set()
+
+    def add(self, chunk: Chunk, analysis: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        """
+        Add the analysis of one chunk
+
+        Args:
+            chunk: The chunk that was analyzed
+            analysis: Its analysis, numbered from line 1 of the chunk
+
+        Returns:
+            (section, item) pairs that are new to the merged analysis
+        """
+        added = []
+        for explanation in analysis.get("line_explanations", []):
+            local = explanation.get("line_number")
+            if not isinstance(local, int) or not 1 <= local <= len(chunk.lines):
+                continue
+            explanation = {**explanation, "line_number": chunk.start_line + local - 1}
+            self._explanations.append(explanation)
+            added.append(("line_explanations", explanation))
+
+        for concept in analysis.get("concepts", []):
+            key = concept_key(concept)
+            if key not in self._seen_concepts:
+                self._seen_concepts.add(key)
+                self._concepts.append(concept)
+                added.append(("concepts", concept))
+
+        for misconception in analysis.get("misconceptions", []):
+            key = " ".join(misconception.lower().split())
+            if key not in self._seen_misconceptions:
+                self._seen_misconceptions.add(key)
+                self._misconceptions.append(misconception)
+                added.append(("misconceptions", misconception))
+
+        self._quizzes.append((chunk.start_line, list(analysis.get("quiz", []))))
+        return added
+
+    def result(self) -> Dict[str, Any]:
+        """Return the merged analysis"""
+        return {
+            "line_explanations": sorted(self._explanations, key=lambda item: item["line_number"]),
+            "concepts": list(self._concepts),
+            "misconceptions": list(self._misconceptions),
+            "quiz": self._merged_quiz(),
+        }
+
+    def _merged_quiz(self) -> List[Dict[str, Any]]:
+        """Pick quiz questions round-robin across chunks, in file order"""
+        queues = [list(quiz) for _, quiz in sorted(self._quizzes, key=lambda entry: entry[0])]
+        quiz, seen = [], set()
+        while len(quiz) < MERGED_QUIZ_LIMIT and any(queues):
+            for queue in queues:
+                if not queue or len(quiz) >= MERGED_QUIZ_LIMIT:
+                    continue
+                question = queue.pop(0)
+                key = " ".join(str(question.get("question", "")).lower().split())
+                if key not in seen:
+                    seen.add(key)
+                    quiz.append(question)
+        return quiz
+
+
+def concept_key(concept: str) -> str:
+    """Case/separator-insensitive key so "Control Flow" and "control_flow" merge"""
+    return "_".join(concept.lower().replace("-", " ").replace("_", " ").split())
@@ -0,0 +1,112 @@
+"""
+Incremental Analysis - Re-explain only the lines an edit touched
+Diffs new code against a previously analyzed version, carries over the
+explanations of unchanged lines and marks the changed regions for the LLM
+"""
+
+import difflib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .chunker import Chunk
+from .normalizer import split_source_lines
+
+# Unchanged lines sent on each side of an edit so the model sees its surroundings
+INCREMENTAL_CONTEXT_LINES = 3
+# Beyond this share of changed lines a full re-analysis is cheaper and better
+INCREMENTAL_MAX_CHANGED_RATIO = 0.5
+
+
+class Edit:
+    """How new code differs from a previously analyzed version"""
+
+    def __init__(self, baseline: Chunk, reused: Dict[str, Any], regions: List[Chunk], changed_lines: Set[int]):
+        """
+        Args:
+            baseline: The whole new file, as the chunk `reused` is numbered against
+            reused: Previous analysis with explanations moved to the new line numbers
+            regions: Excerpts of the new file (changed lines plus context) to analyze
+            changed_lines: New line numbers whose explanations must be regenerated
+        """
+        self.baseline = baseline
+        self.reused = reused
+        self.regions = regions
+        self.changed_lines = changed_lines
+
+    def changed_in(self, region: Chunk) -> List[int]:
+        """A region's changed lines, numbered from 1 at its start"""
+        return [
+            line - region.start_line + 1
+            for line in sorted(self.changed_lines) if region.start_line <= line <= region.end_line
+        ]
+
+    def changed_only(self, region: Chunk, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Drop a region's explanations of context lines, which are already reused"""
+        explanations = [
+            explanation for explanation in analysis.get("line_explanations", [])
+            if isinstance(explanation.get("line_number"), int)
+            and region.start_line + explanation["line_number"] - 1 in self.changed_lines
+        ]
+        return {**analysis, "line_explanations": explanations}
+
+
+def diff_analysis(
+    old_code: str,
+    old_analysis: Dict[str, Any],
+    new_code: str,
+    context_lines: int = INCREMENTAL_CONTEXT_LINES,
+    max_changed_ratio: float = INCREMENTAL_MAX_CHANGED_RATIO
+) -> Optional[Edit]:
+    """
+    Plan an incremental re-analysis of edited code
+
+    Args:
+        old_code: Code the previous analysis was made for
+        old_analysis: That analysis, numbered by old_code's lines
+        new_code: The edited code
+        context_lines: Unchanged lines included around each changed region
+        max_changed_ratio: Largest share of changed non-blank lines worth diffing
+
+    Returns:
+        The edit, or None if the code changed too much to reuse anything
+    """
+    old_lines = [line.rstrip() for line in split_source_lines(old_code)]
+    new_lines = split_source_lines(new_code)
+    matcher = difflib.SequenceMatcher(None, old_lines, [line.rstrip() for line in new_lines], autojunk=False)
+
+    moved: Dict[int, int] = {}
+    changed: Set[int] = set()
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            moved.update({i1 + offset + 1: j1 + offset + 1 for offset in range(i2 - i1)})
+        else:
+            changed.update(line for line in range(j1 + 1, j2 + 1) if new_lines[line - 1].strip())
+
+    code_lines = sum(1 for line in new_lines if line.strip())
+    if not moved or len(changed) > max_changed_ratio * code_lines:
+        return None
+
+    explanations = []
+    for explanation in old_analysis.get("line_explanations", []):
+        line_number = moved.get(explanation.get("line_number"))
+        if line_number is not None:
+            explanations.append({**explanation, "line_number": line_number,
+                                 "code": new_lines[line_number - 1].strip()})
+    reused = {**old_analysis, "line_explanations": explanations}
+
+    regions = [
+        Chunk(start, new_lines[start - 1:end])
+        for start, end in _merge_ranges(changed, context_lines, len(new_lines))
+    ]
+    return Edit(Chunk(1, new_lines), reused, regions, changed)
+
+
+def _merge_ranges(lines: Set[int], padding: int, total: int) -> List[Tuple[int, int]]:
+    """Pad each line into a range and merge ranges that overlap or touch"""
+    ranges: List[Tuple[int, int]] = []
+    for line in sorted(lines):
+        start, end = max(1, line - padding), min(total, line + padding)
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
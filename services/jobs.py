@@ -0,0 +1,348 @@
+"""
+Analysis Jobs - Run analyses in the background, independent of the page
+A Streamlit rerun or dropped websocket abandons the script run, not the
+job: the UI keeps only a job ID and polls for progress, and finished
+results are stored so a reconnecting session picks them up without
+another LLM call. A job first explains the code; the deferred sections
+(concepts, misconceptions, quiz) are generated afterwards, prefetched or
+on request. Each job is charged to its caller's token quotas when it is
+submitted, which decides whether it runs normally, degraded or later
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .analyzer import CodeAnalyzer
+from .llm import DEFERRED_SECTIONS
+from .models import Analysis, item_from_dict
+from .quotas import DELAYED, Caller, QuotaDecision, QuotaManager
+from .router import cheapest_tier
+from .scheduler import session_scope
+
+DEFAULT_JOBS_PATH = os.path.join(".cache", "jobs.sqlite3")
+DEFAULT_JOB_TTL_SECONDS = 24 * 60 * 60
+# Sections generated as soon as the explanations are done; the quiz waits until it is asked for
+DEFAULT_PREFETCH = ("concepts", "misconceptions")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class Job:
+    """One submitted analysis and everything it has produced so far"""
+
+    def __init__(self, job_id: str, session: str, code: str, language: str, caller: Optional[Caller] = None):
+        self.id = job_id
+        self.session = session
+        self.code = code
+        self.language = language
+        self.caller = caller or Caller(session)
+        # How the caller's quotas let the explanations and prefetched sections run
+        self.quota: Optional[QuotaDecision] = None
+        self.status = QUEUED
+        self.items: List[Tuple[str, Any]] = []
+        self.analysis: Optional[Analysis] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished_at: Optional[float] = None
+        # Status of each deferred section requested so far, and why any failed
+        self.sections: Dict[str, str] = {}
+        self.section_errors: Dict[str, str] = {}
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job is done or failed"""
+        return self.status in (DONE, FAILED)
+
+    @property
+    def busy(self) -> bool:
+        """Whether the explanations or any requested section are still being generated"""
+        return not self.finished or any(status in (QUEUED, RUNNING) for status in self.sections.values())
+
+
+class JobQueue:
+    """Worker pool that runs analyses and keeps their results"""
+
+    def __init__(
+        self,
+        analyzer: CodeAnalyzer,
+        path: Optional[str] = DEFAULT_JOBS_PATH,
+        max_workers: int = 4,
+        ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS,
+        prefetch: Iterable[str] = DEFAULT_PREFETCH,
+        quotas: Optional[QuotaManager] = None
+    ):
+        """
+        Args:
+            analyzer: Analyzer the jobs run on
+            path: SQLite file finished jobs are kept in, or None for memory only
+            max_workers: Analyses run at the same time; later jobs wait queued
+            ttl_seconds: How long finished jobs can be picked up
+            prefetch: Deferred sections generated as soon as a job's explanations are done
+            quotas: Token budgets jobs are charged to (None for unlimited)
+        """
+        self.analyzer = analyzer
+        self.ttl_seconds = ttl_seconds
+        self.prefetch = [section for section in prefetch if section in DEFERRED_SECTIONS]
+        self.quotas = quotas if quotas is not None and quotas.enabled else None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, session TEXT NOT NULL, language TEXT NOT NULL, code TEXT NOT NULL, "
+                "status TEXT NOT NULL, analysis BLOB, error TEXT, created REAL NOT NULL, finished REAL NOT NULL, "
+                "sections TEXT, user TEXT, course TEXT)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "sections" not in columns:
+                # Stores written before deferred sections existed
+                self._db.execute("ALTER TABLE jobs ADD COLUMN sections TEXT")
+            for column in ("user", "course"):
+                if column not in columns:
+                    # Stores written before quotas; their jobs are charged to the session only
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    @classmethod
+    def from_env(cls, analyzer: CodeAnalyzer) -> "JobQueue":
+        """
+        Queue configured by environment variables
+
+        ANALYSIS_JOBS_PATH: SQLite file for finished jobs (empty keeps them in memory)
+        ANALYSIS_JOB_WORKERS: Analyses run at the same time
+        ANALYSIS_JOB_TTL: Seconds finished jobs are kept
+        ANALYSIS_PREFETCH: Comma-separated sections generated right after the explanations
+        QUOTA_*: Token budgets, see QuotaManager.from_env
+        """
+        path = os.getenv("ANALYSIS_JOBS_PATH", DEFAULT_JOBS_PATH)
+        prefetch = os.getenv("ANALYSIS_PREFETCH", ",".join(DEFAULT_PREFETCH))
+        return cls(
+            analyzer,
+            path=path or None,
+            max_workers=int(os.getenv("ANALYSIS_JOB_WORKERS", "4")),
+            ttl_seconds=float(os.getenv("ANALYSIS_JOB_TTL", str(DEFAULT_JOB_TTL_SECONDS))),
+            prefetch=[section.strip() for section in prefetch.split(",") if section.strip()],
+            quotas=QuotaManager.from_env(),
+        )
+
+    def submit(
+        self, code: str, language: str, session: str, user: Optional[str] = None, course: Optional[str] = None
+    ) -> Job:
+        """
+        Queue an analysis
+
+        A session resubmitting the code it is already waiting on (a double
+        click, say) gets the running job back instead of a second one.
+
+        Args:
+            code: The code to analyze
+            language: Programming language
+            session: Browser session submitting it
+            user: Signed-in user, charged along with the session
+            course: The user's course, charged along with the session
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if (job.session, job.code, job.language) == (session, code, language) and not job.finished:
+                    return job
+            job = Job(uuid.uuid4().hex, session, code, language, Caller(session, user, course))
+            self._jobs[job.id] = job
+            self._expire(time.time())
+        metrics.increment("analysis_jobs_total", status=QUEUED)
+        job.quota = self._admit(job.caller, code, language, self.prefetch)
+        self._start(job.quota, self._run, job)
+        return job
+
+    def quote(
+        self, code: str, language: str, session: str, user: Optional[str] = None, course: Optional[str] = None
+    ) -> Optional[QuotaDecision]:
+        """
+        How submitting an analysis would run and what it would cost, without charging for it
+
+        Returns:
+            The decision (its tokens are the estimate), or None without quotas or for code that cannot be analyzed
+        """
+        if self.quotas is None:
+            return None
+        try:
+            tokens = self.analyzer.estimate_tokens(code, language, self.prefetch)
+        except ValueError:
+            return None
+        return self.quotas.check(Caller(session, user, course), tokens)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job by ID, from memory or the store, or None if unknown or expired"""
+        with self._lock:
+            return self._get(job_id)
+
+    def request_section(self, job_id: str, section: str) -> Optional[Job]:
+        """
+        Generate a deferred section of a finished job's analysis in the background
+
+        Asking again for a section that is queued, running or done does
+        nothing; a failed one is retried.
+
+        Returns:
+            The job, or None if it is unknown or expired
+        """
+        if section not in DEFERRED_SECTIONS:
+            raise ValueError(f"Unknown analysis section: {section}. Deferred sections: {list(DEFERRED_SECTIONS)}")
+        with self._lock:
+            job = self._get(job_id)
+            if job is None or job.status != DONE or job.sections.get(section) in (QUEUED, RUNNING, DONE):
+                return job
+            # Marked queued before it is estimated, so a double click is charged once
+            job.sections[section] = QUEUED
+            job.section_errors.pop(section, None)
+            self._jobs[job.id] = job
+        quota = self._admit(job.caller, job.code, job.language, [section], explanations=False)
+        self._start(quota, self._run_section, job, section, quota)
+        return job
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        """Look a job up (lock held)"""
+        job = self._jobs.get(job_id)
+        if job is not None or self._db is None:
+            return job
+        row = self._db.execute(
+            "SELECT session, language, code, status, analysis, error, created, finished, sections, user, course "
+            "FROM jobs WHERE id = ? AND finished >= ?",
+            (job_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return None
+        # Sections requested after a reload are charged to the same user and course as the job
+        job = Job(job_id, row[0], row[2], row[1], Caller(row[0], row[9], row[10]))
+        job.status, job.error, job.created, job.finished_at = row[3], row[5], row[6], row[7]
+        job.analysis = Analysis.decode(row[4]) if row[4] else None
+        # Only generated sections are stored; ones cut off by a restart can be requested again
+        job.sections = {section: DONE for section in (row[8] or "").split(",") if section}
+        return job
+
+    def _queue_section(self, job: Job, section: str, quota: Optional[QuotaDecision] = None) -> None:
+        """Submit a section to the pool (lock held); the job stays in memory until it finishes"""
+        job.sections[section] = QUEUED
+        job.section_errors.pop(section, None)
+        self._jobs[job.id] = job
+        self._start(quota, self._run_section, job, section, quota)
+
+    def _admit(
+        self, caller: Caller, code: str, language: str, sections: Iterable[str], explanations: bool = True
+    ) -> Optional[QuotaDecision]:
+        """Charge an analysis's estimate to the caller's quotas"""
+        if self.quotas is None:
+            return None
+        try:
+            tokens = self.analyzer.estimate_tokens(code, language, sections, explanations)
+        except ValueError:
+            # Invalid code fails in the job itself, without calling the model
+            return None
+        return self.quotas.admit(caller, tokens)
+
+    def _start(self, quota: Optional[QuotaDecision], run, *args) -> None:
+        """Run on the pool now, or once a delayed caller's budget has refilled"""
+        if quota is not None and quota.mode == DELAYED and quota.wait_seconds > 0:
+            timer = threading.Timer(quota.wait_seconds, self._pool.submit, (run, *args))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._pool.submit(run, *args)
+
+    @contextmanager
+    def _scope(self, job: Job, quota: Optional[QuotaDecision]) -> Iterator[None]:
+        """Attribute a job's requests to its session, at its quota's queue share and model tier"""
+        with session_scope(job.session, weight=quota.weight if quota is not None else 1.0):
+            if quota is not None and quota.degraded:
+                with cheapest_tier():
+                    yield
+            else:
+                yield
+
+    def stats(self) -> Dict[str, int]:
+        """Jobs held in memory by status"""
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _run(self, job: Job) -> None:
+        job.status = RUNNING
+        try:
+            # Rate-limited requests still queue fairly per browser session
+            with self._scope(job, job.quota):
+                for section, item in self.analyzer.analyze_code_stream(job.code, job.language):
+                    if section == "analysis":
+                        job.analysis = Analysis.from_dict(item)
+                        continue
+                    try:
+                        job.items.append((section, item_from_dict(section, item)))
+                    except ValueError:
+                        # Malformed partial items are dropped; the final analysis is validated whole
+                        pass
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        job.finished_at = time.time()
+        metrics.increment("analysis_jobs_total", status=job.status)
+        metrics.observe("analysis_job_seconds", job.finished_at - job.created, status=job.status)
+        if job.status == DONE and self.analyzer.is_precomputed(job.code, job.language):
+            # Course material comes with every section
+            job.sections = {section: DONE for section in DEFERRED_SECTIONS}
+        elif job.status == DONE:
+            # Queued behind other jobs' explanations, which come first; already charged with them
+            with self._lock:
+                for section in self.prefetch:
+                    self._queue_section(job, section, job.quota)
+        self._store(job)
+
+    def _run_section(self, job: Job, section: str, quota: Optional[QuotaDecision] = None) -> None:
+        job.sections[section] = RUNNING
+        try:
+            with self._scope(job, quota):
+                items = self.analyzer.analyze_section(job.code, job.language, section)
+            setattr(job.analysis, section, [item_from_dict(section, item) for item in items])
+            job.sections[section] = DONE
+        except Exception as e:
+            job.section_errors[section] = str(e)
+            job.sections[section] = FAILED
+        self._store(job)
+
+    def _store(self, job: Job) -> None:
+        """Persist a finished job; once nothing is left to generate it is served from disk rather than memory"""
+        if self._db is None:
+            return
+        with self._lock:
+            done = ",".join(section for section, status in job.sections.items() if status == DONE)
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "(id, session, language, code, status, analysis, error, created, finished, sections, user, course) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.session, job.language, job.code, job.status,
+                 job.analysis.encode() if job.analysis is not None else None,
+                 job.error, job.created, job.finished_at, done, job.caller.user, job.caller.course),
+            )
+            if not job.busy:
+                self._jobs.pop(job.id, None)
+
+    def _expire(self, now: float) -> None:
+        """Forget finished jobs past their TTL (lock held)"""
+        cutoff = now - self.ttl_seconds
+        for job_id in [job.id for job in self._jobs.values() if not job.busy and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        if self._db is not None:
+            self._db.execute("DELETE FROM jobs WHERE finished < ?", (cutoff,))
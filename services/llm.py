@@ -3,71 +3,518 @@ LLM Client for code analysis
 Handles OpenAI API calls and response parsing
 """
 
+import asyncio
 import json
 import os
-from typing import Dict, Any, Optional
-import openai
-from openai import OpenAI
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
+from . import metrics
+from .backends import BackendError, Completion, LLMBackend, create_backend
+from .budget import (
+    PromptTooLarge, count_message_tokens, expected_output_tokens, fit_output, section_output_tokens
+)
+from .models import Analysis, item_from_dict
+from .router import ModelRouter, RoutingDecision
+from .scheduler import RequestScheduler, estimate_request_tokens
+from .normalizer import split_source_lines
+from .static_analysis import StaticAnalysis, analyze_static, format_lines
+from .streaming import ANALYSIS_SECTIONS, IncrementalJSONParser, recover_analysis
+
+# Bump whenever the prompts change so cached analyses are invalidated
+PROMPT_VERSION = "4"
+
+# The first request explains the code line by line; each of these sections has its own, smaller request
+EXPLANATIONS = "line_explanations"
+DEFERRED_SECTIONS = ("concepts", "misconceptions", "quiz")
+
+# Instruction and JSON shape of each deferred section's prompt
+_SECTION_PROMPTS = {
+    "concepts": (
+        "List the key programming concepts the following {language} code uses.",
+        '{"concepts": ["..."]}',
+    ),
+    "misconceptions": (
+        "List the misconceptions students commonly have about the following {language} code: "
+        "what they expect it to do that it does not, or why they think a line is needed.",
+        '{"misconceptions": ["..."]}',
+    ),
+    "quiz": (
+        "Write 3 concept-check questions about the following {language} code that test "
+        "understanding, not memorization. Give each its answer and the concept it checks.",
+        '{"quiz": [{"question": "...", "answer": "...", "concept": "..."}]}',
+    ),
+}
+
+
+class TruncatedResponse(ValueError):
+    """A response cut off before its end, typically at max_tokens, whose finished items were recovered"""
+
+    def __init__(self, section: str, analysis: Dict[str, Any], gaps: Optional[List[Tuple[int, int]]] = None):
+        """
+        Args:
+            section: The stage that was cut short
+            analysis: That stage's analysis holding only the recovered items
+            gaps: For explanations, (first, last) line ranges of the code still to be explained
+        """
+        super().__init__(f"Response was cut off before the end of {section}")
+        self.section = section
+        self.analysis = analysis
+        self.gaps = gaps or []
+
 
 class LLMClient:
     """Client for interacting with OpenAI API"""
     
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the LLM client"""
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        backend: Optional[LLMBackend] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        router: Optional[ModelRouter] = None
+    ):
+        """
+        Initialize the LLM client
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = "gpt-4"
+        Args:
+            api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+            backend: Transport for completions (defaults to the LLM_BACKEND setting)
+            scheduler: Rate-limit aware admission and retries (defaults to a private one)
+            router: Picks a model tier per snippet (defaults to the LLM_MODEL_TIERS setting)
+        """
+        self.backend = backend or create_backend(api_key=api_key)
+        self.scheduler = scheduler or RequestScheduler()
+        self.backend.on_headers = self.scheduler.observe_headers
+        self.router = router or ModelRouter.from_env(strongest="gpt-4")
+        # The strongest tier; simple snippets are routed to cheaper models
+        self.model = self.router.strongest
+        self._usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._usage_lock = threading.Lock()
     
-    def analyze_code(self, code: str, language: str) -> Dict[str, Any]:
+    def analyze_code(
+        self, code: str, language: str, context: Optional[str] = None, lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
         """
-        Analyze code and return structured explanation
+        Explain code line by line
         
         Args:
             code: The code to analyze
             language: Programming language
+            context: Extra instructions, e.g. where an excerpt sits in its file
+            lines: The only lines to explain (default all); the others are
+                shown as context the caller already has explanations for
             
         Returns:
-            Structured analysis as dictionary
+            Structured analysis as dictionary, with the statically detected
+            concepts and the DEFERRED_SECTIONS otherwise empty
+        
+        Raises:
+            TruncatedResponse: If the response was cut off or lost items;
+                it holds the explanations recovered and the lines still
+                missing one (see CodeAnalyzer)
         """
-        try:
-            prompt = self._get_analysis_prompt(code, language)
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            try:
+                analysis = self._complete_routed(
+                    code, language, context, static, decision, decision.models[0], lines=lines
+                )
+            except TruncatedResponse as truncated:
+                analysis = self._truncated(code, static, truncated, lines)
+            return static.apply(analysis)
+    
+    def analyze_section(
+        self, code: str, language: str, section: str, context: Optional[str] = None
+    ) -> List[Any]:
+        """
+        Generate one of the DEFERRED_SECTIONS with its own request
+        
+        Args:
+            code: The code to analyze
+            language: Programming language
+            section: "concepts", "misconceptions" or "quiz"
+            context: Extra instructions, e.g. where an excerpt sits in its file
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=2000,
-                response_format={"type": "json_object"}
-            )
+        Returns:
+            The section's validated items
+        """
+        _check_section(section)
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            try:
+                analysis = self._complete_routed(
+                    code, language, context, static, decision, decision.models[0], section
+                )
+            except TruncatedResponse as truncated:
+                analysis = self._kept(truncated)
+            return static.apply(analysis)[section]
+    
+    def analyze_code_stream(self, code: str, language: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Analyze code with a streamed response
+        
+        Args:
+            code: The code to analyze
+            language: Programming language
             
-            content = response.choices[0].message.content
-            if not content:
-                raise ValueError("Empty response from LLM")
+        Yields:
+            (section, item) for every line explanation, concept, misconception
+            and quiz item as soon as it is complete, then ("analysis", dict)
+            with the full validated analysis
+        """
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            request, model = self._fitted_request(code, language, None, static, decision, decision.models[0])
             
-            # Parse JSON response
-            analysis = json.loads(content)
+            # Template explanations and detected concepts are ready before the model starts
+            yield from static.items()
             
-            # Validate required fields
-            required_fields = ["line_explanations", "concepts", "misconceptions", "quiz"]
-            for field in required_fields:
-                if field not in analysis:
-                    raise ValueError(f"Missing required field: {field}")
+            # Streamed responses carry no usage block; count the request only
+            self._record_usage(None, model)
             
-            return analysis
+            response = _StreamedResponse(static, model)
+            for delta in self._stream(request):
+                yield from response.feed(delta)
             
+            try:
+                analysis, stronger = self._routed_result(response.content(), language, decision, model)
+                if analysis is None:
+                    # Items already streamed stay on screen until the stronger model's analysis replaces them
+                    analysis = self._complete_routed(code, language, None, static, decision, stronger)
+            except TruncatedResponse as truncated:
+                analysis = self._truncated(code, static, truncated)
+            yield "analysis", static.apply(analysis)
+    
+    @property
+    def model_key(self) -> str:
+        """Every model that may answer, so changing the tiers invalidates cached analyses"""
+        return self.router.signature
+    
+    def _complete_routed(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str],
+        static: StaticAnalysis,
+        decision: RoutingDecision,
+        model: str,
+        section: str = EXPLANATIONS,
+        lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Analyze with `model`, escalating to stronger tiers while the output fails validation"""
+        while True:
+            request, model = self._fitted_request(code, language, context, static, decision, model, section, lines)
+            completion = self._complete(request)
+            self._record_usage(completion, model)
+            analysis, model = self._routed_result(completion.content, language, decision, model, section)
+            if analysis is not None:
+                return analysis
+    
+    def _prepare(self, code: str, language: str) -> Tuple[StaticAnalysis, RoutingDecision]:
+        """Run the static pre-analysis and pick the model tiers for code"""
+        with metrics.span("static_analysis"):
+            static = analyze_static(code, language)
+        return static, self.router.route(code, language)
+    
+    def _routed_result(
+        self,
+        content: Optional[str],
+        language: str,
+        decision: RoutingDecision,
+        model: str,
+        section: str = EXPLANATIONS
+    ) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Parse `model`'s response to one stage and record the outcome with the router
+        
+        Returns:
+            (analysis, model), or (None, stronger model) when the response
+            failed validation and a stronger tier is left to ask
+        
+        Raises:
+            TruncatedResponse: If the response was cut off; a stronger model would not write a longer answer
+            ValueError: If the response failed validation on the strongest tier
+        """
+        try:
+            analysis = self._parse_analysis(content, section)
+        except TruncatedResponse:
+            # Usable as far as it goes
+            self.router.record(decision, model, language)
+            raise
+        except ValueError:
+            stronger = self.router.escalate(decision, model)
+            if stronger is None:
+                self.router.record(decision, model, language, succeeded=False)
+                raise
+            return None, stronger
+        self.router.record(decision, model, language)
+        return analysis, model
+    
+    def _fitted_request(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str],
+        static: StaticAnalysis,
+        decision: RoutingDecision,
+        model: str,
+        section: str = EXPLANATIONS,
+        lines: Optional[List[int]] = None
+    ) -> Tuple[Dict[str, Any], str]:
+        """Build the request for `model`, moving up the tiers until one has room for it"""
+        while True:
+            try:
+                with metrics.span("prompt_build"):
+                    return self._build_request(code, language, context, static, model, section, lines), model
+            except PromptTooLarge:
+                stronger = self.router.escalate(decision, model)
+                if stronger is None:
+                    raise
+                model = stronger
+    
+    def fits(self, code: str, language: str, section: str = EXPLANATIONS) -> bool:
+        """Whether a stage of code's analysis fits in a single request to the strongest model"""
+        try:
+            self._build_request(code, language, section=section)
+        except PromptTooLarge:
+            return False
+        return True
+    
+    def estimate_tokens(self, code: str, language: str, section: str = EXPLANATIONS) -> int:
+        """
+        Tokens one stage of code's analysis counts against rate limits and quotas: prompt plus max_tokens
+
+        Raises:
+            PromptTooLarge: If the stage does not fit in a single request
+        """
+        static = analyze_static(code, language)
+        return estimate_request_tokens(self._build_request(code, language, static=static, section=section))
+
+    def _complete(self, request: Dict[str, Any]) -> Completion:
+        """Send a request once the scheduler admits it, retrying transient failures"""
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            with metrics.span("queue_wait"):
+                self.scheduler.acquire(tokens)
+            try:
+                with metrics.span("api_call", model=request["model"]):
+                    return self.backend.complete(request)
+            except Exception as e:
+                delay = self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release()
+            time.sleep(delay)
+            attempt += 1
+    
+    def _stream(self, request: Dict[str, Any]) -> Iterator[str]:
+        """Stream a request once admitted, retrying failures that happen before the first piece"""
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            with metrics.span("queue_wait"):
+                self.scheduler.acquire(tokens)
+            received = False
+            try:
+                for delta in self.backend.stream(request):
+                    received = True
+                    yield delta
+                return
+            except Exception as e:
+                # Pieces already handed to the caller cannot be taken back
+                delay = None if received else self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release()
+            time.sleep(delay)
+            attempt += 1
+    
+    @contextmanager
+    def _llm_errors(self) -> Iterator[None]:
+        """Turn backend and parsing failures into ValueError, counting each by reason"""
+        try:
+            yield
+        except PromptTooLarge:
+            metrics.increment("llm_failures_total", reason="too_large")
+            raise
+        except TruncatedResponse:
+            # Carries the recovered explanations to the caller, which asks for the rest
+            raise
         except json.JSONDecodeError as e:
+            metrics.increment("llm_failures_total", reason="invalid_json")
             raise ValueError(f"Invalid JSON response from LLM: {e}")
-        except openai.APIError as e:
-            raise ValueError(f"OpenAI API error: {e}")
+        except BackendError as e:
+            metrics.increment("llm_failures_total", reason="backend_error")
+            raise ValueError(f"LLM backend error: {e}")
         except Exception as e:
+            if _is_openai_error(e):
+                metrics.increment("llm_failures_total", reason="api_error")
+                raise ValueError(f"OpenAI API error: {e}")
+            metrics.increment("llm_failures_total", reason="unexpected")
             raise ValueError(f"Unexpected error during code analysis: {e}")
     
+    def _build_request(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str] = None,
+        static: Optional[StaticAnalysis] = None,
+        model: Optional[str] = None,
+        section: str = EXPLANATIONS,
+        lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Keyword arguments of the chat completion call for one stage of an analysis
+        
+        max_tokens is sized to the lines left for the model to explain (of
+        `lines`, if given), or to the deferred section requested.
+        
+        Raises:
+            PromptTooLarge: If the prompt and answer cannot fit the model's context window
+        """
+        model = model or self.model
+        messages = self._get_messages(code, language, context, static, section, lines)
+        if section == EXPLANATIONS:
+            wanted = expected_output_tokens(max(len(self._lines_to_explain(code, static, lines)), 1))
+        else:
+            wanted = section_output_tokens(section)
+        return {
+            "model": model,
+            "messages": messages,
+            "temperature": 0.3,
+            "max_tokens": fit_output(count_message_tokens(messages), wanted, model),
+            "response_format": {"type": "json_object"}
+        }
+    
+    def _get_messages(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str] = None,
+        static: Optional[StaticAnalysis] = None,
+        section: str = EXPLANATIONS,
+        lines: Optional[List[int]] = None
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for one stage of an analysis"""
+        if section == EXPLANATIONS:
+            prompt = self._get_analysis_prompt(code, language, context, static, lines)
+        else:
+            prompt = self._get_section_prompt(code, language, section, context, static)
+        return [
+            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def usage_stats(self) -> Dict[str, int]:
+        """Return request and token counters since the client was created"""
+        with self._usage_lock:
+            stats = dict(self._usage)
+        stats["total_tokens"] = stats["prompt_tokens"] + stats["completion_tokens"]
+        return stats
+    
+    def _record_usage(self, completion: Optional[Completion], model: str) -> None:
+        """Add a completion's token usage to the counters"""
+        with self._usage_lock:
+            self._usage["requests"] += 1
+            if completion is not None:
+                self._usage["prompt_tokens"] += completion.prompt_tokens
+                self._usage["completion_tokens"] += completion.completion_tokens
+        
+        metrics.increment("llm_requests_total", model=model)
+        if completion is not None:
+            metrics.increment("llm_tokens_total", completion.prompt_tokens, model=model, kind="prompt")
+            metrics.increment("llm_tokens_total", completion.completion_tokens, model=model, kind="completion")
+    
+    def _parse_analysis(self, content: Optional[str], section: str = EXPLANATIONS) -> Dict[str, Any]:
+        """Parse and validate the JSON the model returned for one stage of an analysis"""
+        if not content:
+            raise ValueError("Empty response from LLM")
+        
+        # Parse JSON response
+        with metrics.span("parse"):
+            try:
+                data = json.loads(content)
+            except json.JSONDecodeError:
+                # Usually cut off at max_tokens: keep every finished item instead of paying for a full retry
+                recovered, complete = recover_analysis(content)
+                items = [item for item in recovered[section] if _is_valid_item(section, item)]
+                if not items:
+                    raise
+                data = {section: items}
+                # A list that closed can still have lost an item in the middle that did not decode
+                if section not in complete or len(items) < len(recovered[section]):
+                    stage = {field: [] for field in ANALYSIS_SECTIONS}
+                    stage[section] = items
+                    raise TruncatedResponse(section, Analysis.from_dict(stage).to_dict())
+                # Every item survived and only what followed the list was malformed
+                metrics.increment("llm_truncated_responses_total", section=section, outcome="repaired")
+        
+        # Validate the shape of the requested section and its items; the other sections have their own requests
+        with metrics.span("validate"):
+            if not isinstance(data, dict):
+                raise ValueError("Analysis must be a JSON object")
+            if section not in data:
+                raise ValueError(f"Missing required field: {section}")
+            stage = {field: [] for field in ANALYSIS_SECTIONS}
+            stage[section] = data[section]
+            analysis = Analysis.from_dict(stage).to_dict()
+        
+        return analysis
+    
+    def _truncated(
+        self, code: str, static: StaticAnalysis, truncated: TruncatedResponse, lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Explanations cut short or with items lost: the recovered ones if every line that needs one has one
+        
+        Raises:
+            TruncatedResponse: With the static results applied and the gaps set, if lines are missing
+            ValueError: If the response explained none of the lines that need it
+        """
+        explained = {explanation["line_number"] for explanation in truncated.analysis[EXPLANATIONS]}
+        needed = self._lines_to_explain(code, static, lines)
+        missing = [number for number in needed if number not in explained]
+        if not missing:
+            metrics.increment("llm_truncated_responses_total", section=EXPLANATIONS, outcome="kept")
+            return truncated.analysis
+        if len(missing) == len(needed):
+            # Continuing would resend the whole code
+            raise ValueError("Response was cut off before explaining any line")
+        # Missing lines separated only by blank or template-explained lines are asked for together
+        position = {number: index for index, number in enumerate(needed)}
+        gaps: List[Tuple[int, int]] = []
+        for number in missing:
+            if gaps and position[number] == position[gaps[-1][1]] + 1:
+                gaps[-1] = (gaps[-1][0], number)
+            else:
+                gaps.append((number, number))
+        metrics.increment("llm_truncated_responses_total", section=EXPLANATIONS, outcome="continued")
+        raise TruncatedResponse(EXPLANATIONS, static.apply(truncated.analysis), gaps)
+    
+    def _lines_to_explain(
+        self, code: str, static: Optional[StaticAnalysis], lines: Optional[List[int]] = None
+    ) -> List[int]:
+        """The non-blank lines of code (or of `lines`) the model is asked to explain, in order"""
+        source = split_source_lines(code)
+        wanted = set(lines) if lines is not None else None
+        return [
+            number for number in range(1, len(source) + 1)
+            if source[number - 1].strip()
+            and (wanted is None or number in wanted)
+            and (static is None or number not in static.boilerplate)
+        ]
+    
+    def _kept(self, truncated: TruncatedResponse) -> Dict[str, Any]:
+        """A deferred section cut short: its items stand on their own, so the finished ones are kept"""
+        metrics.increment("llm_truncated_responses_total", section=truncated.section, outcome="kept")
+        return truncated.analysis
+    
     def _get_system_prompt(self) -> str:
         """Get the system prompt for educational code analysis"""
         return """You are a programming tutor for undergraduate students. Your goal is to explain code clearly, identify learning gaps, and avoid giving shortcuts or answers directly.
@@ -82,44 +529,352 @@ RULES:
 
 Your explanations should help students understand the logic and flow, not just copy code."""
     
-    def _get_analysis_prompt(self, code: str, language: str) -> str:
+    def _get_analysis_prompt(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str] = None,
+        static: Optional[StaticAnalysis] = None,
+        lines: Optional[List[int]] = None
+    ) -> str:
         """Generate the main prompt for code analysis"""
-        return f"""Analyze the following {language} code line by line. For each line provide:
+        context_note = f"{context}\n\n" if context else ""
+        if lines is not None:
+            context_note += (
+                f"Explain only lines {format_lines(lines)}. The other lines are shown for context and "
+                f"already have explanations; leave them out of line_explanations.\n\n"
+            )
+        summary = static.summary() if static else ""
+        static_note = (
+            f"\nA static analysis already found the following. Leave the lines it already explained out of "
+            f"line_explanations and skip blank lines.\n{summary}\n"
+            if summary else ""
+        )
+        return f"""{context_note}Explain the following {language} code line by line. For each line provide:
 
 1. **What it does** (simple explanation)
 2. **Why it exists** (purpose in the overall logic)
 3. **What breaks if removed** (consequence)
 
-Then provide:
-- **Programming concepts used** (list key concepts)
-- **Common misconceptions** (what students typically misunderstand)
-- **3 concept-check questions** (test understanding, not memorization)
-
 Code to analyze:
 ```{language}
 {code}
 ```
+{static_note}
+Respond with a JSON object of this shape:
+{{"line_explanations": [{{"line_number": 1, "code": "...", "what_it_does": "...", "why_it_exists": "...", "what_breaks": "..."}}]}}"""
+    
+    def _get_section_prompt(
+        self,
+        code: str,
+        language: str,
+        section: str,
+        context: Optional[str] = None,
+        static: Optional[StaticAnalysis] = None
+    ) -> str:
+        """Generate the prompt for one deferred section"""
+        instruction, shape = _SECTION_PROMPTS[section]
+        context_note = f"{context}\n\n" if context else ""
+        static_note = ""
+        if section == "concepts" and static is not None and static.concepts:
+            static_note = f"\nThese were already detected; list only others: {', '.join(static.concepts)}\n"
+        return f"""{context_note}{instruction.format(language=language)}
+
+```{language}
+{code}
+```
+{static_note}
+Respond with a JSON object of this shape:
+{shape}"""
+
+
+def _is_valid_item(section: str, item: Any) -> bool:
+    """Whether a recovered item has the shape its section needs"""
+    try:
+        item_from_dict(section, item)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_section(section: str) -> None:
+    if section not in DEFERRED_SECTIONS:
+        raise ValueError(f"Unknown analysis section: {section}. Deferred sections: {list(DEFERRED_SECTIONS)}")
+
 
-Format your response as JSON with this structure:
-{{
-    "line_explanations": [
-        {{
-            "line_number": 1,
-            "code": "actual line of code",
-            "what_it_does": "simple explanation",
-            "why_it_exists": "purpose explanation",
-            "what_breaks": "consequence if removed"
-        }}
-    ],
-    "concepts": ["concept1", "concept2"],
-    "misconceptions": [
-        "Students often misunderstand..."
-    ],
-    "quiz": [
-        {{
-            "question": "Why does this code use a loop instead of direct access?",
-            "answer": "Because...",
-            "concept": "iteration"
-        }}
-    ]
-}}"""
\ No newline at end of file
+def _is_openai_error(error: Exception) -> bool:
+    """Whether an error came from the openai package, without importing it"""
+    # openai is only imported once a backend makes a request, so if it is not loaded it raised nothing
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIError)
+
+
+class _StreamedResponse:
+    """A response being streamed: hands out each new analysis item as soon as it is complete"""
+    
+    def __init__(self, static: StaticAnalysis, model: str):
+        """
+        Args:
+            static: Static results already handed out, whose items are not repeated
+            model: The model answering, for the latency metrics
+        """
+        self.static = static
+        self.model = model
+        self.parser = IncrementalJSONParser()
+        self.chunks: List[str] = []
+        self.started = time.perf_counter()
+    
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """Take the next piece of the response; returns the (section, item) pairs it completed"""
+        if not self.chunks:
+            metrics.observe("stage_duration_seconds", time.perf_counter() - self.started, stage="first_token")
+        self.chunks.append(delta)
+        return [
+            (section, item) for section, item in self.parser.feed(delta)
+            if section in ANALYSIS_SECTIONS and self.static.is_new(section, item)
+        ]
+    
+    def content(self) -> str:
+        """The whole response, once the stream has ended"""
+        metrics.observe(
+            "stage_duration_seconds", time.perf_counter() - self.started, stage="api_call", model=self.model
+        )
+        return "".join(self.chunks)
+
+
+class _EventLoopThread:
+    """Event loop running in a daemon thread, so synchronous callers can await coroutines"""
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-client-loop", daemon=True)
+        self.thread.start()
+    
+    def run(self, coroutine):
+        """Run a coroutine on the loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    LLM client on the backends' async API (AsyncOpenAI in production),
+    meant to be shared by every session in a process
+    
+    All requests go through one HTTP connection pool with keep-alive, and a
+    shared RequestScheduler caps how many are in flight and keeps them within
+    the account's rate limits, fairly across sessions. The synchronous analyze_code and
+    analyze_code_stream run on a private event loop, so the client is a
+    drop-in replacement for LLMClient in threaded code such as Streamlit.
+    """
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        backend: Optional[LLMBackend] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        router: Optional[ModelRouter] = None
+    ):
+        """
+        Initialize the async LLM client
+        
+        Args:
+            api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+            max_concurrency: Maximum in-flight requests (defaults to LLM_MAX_CONCURRENCY or 16)
+            max_connections: Size of the HTTP connection pool (defaults to max_concurrency)
+            backend: Transport for completions (defaults to the LLM_BACKEND setting)
+            scheduler: Admission and retries (defaults to one capped at max_concurrency)
+            router: Picks a model tier per snippet (defaults to the LLM_MODEL_TIERS setting)
+        """
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        connections = max_connections or self.max_concurrency
+        super().__init__(
+            backend=backend or create_backend(api_key=api_key, max_connections=connections),
+            scheduler=scheduler or RequestScheduler(max_in_flight=self.max_concurrency),
+            router=router
+        )
+        self._loop_thread: Optional[_EventLoopThread] = None
+        self._loop_lock = threading.Lock()
+    
+    async def aanalyze_code(
+        self, code: str, language: str, context: Optional[str] = None, lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Explain code line by line
+        
+        Args:
+            code: The code to analyze
+            language: Programming language
+            context: Extra instructions, e.g. where an excerpt sits in its file
+            lines: The only lines to explain (default all); the others are
+                shown as context the caller already has explanations for
+            
+        Returns:
+            Structured analysis as dictionary, with the statically detected
+            concepts and the DEFERRED_SECTIONS otherwise empty
+        
+        Raises:
+            TruncatedResponse: If the response was cut off or lost items;
+                it holds the explanations recovered and the lines still
+                missing one (see CodeAnalyzer)
+        """
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            try:
+                analysis = await self._acomplete_routed(
+                    code, language, context, static, decision, decision.models[0], lines=lines
+                )
+            except TruncatedResponse as truncated:
+                analysis = self._truncated(code, static, truncated, lines)
+            return static.apply(analysis)
+    
+    async def aanalyze_section(
+        self, code: str, language: str, section: str, context: Optional[str] = None
+    ) -> List[Any]:
+        """Generate one of the DEFERRED_SECTIONS with its own request"""
+        _check_section(section)
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            try:
+                analysis = await self._acomplete_routed(
+                    code, language, context, static, decision, decision.models[0], section
+                )
+            except TruncatedResponse as truncated:
+                analysis = self._kept(truncated)
+            return static.apply(analysis)[section]
+    
+    async def aanalyze_code_stream(self, code: str, language: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Analyze code with a streamed response
+        
+        Yields:
+            (section, item) as each item completes, then ("analysis", dict)
+        """
+        with self._llm_errors():
+            static, decision = self._prepare(code, language)
+            request, model = self._fitted_request(code, language, None, static, decision, decision.models[0])
+            
+            for section, item in static.items():
+                yield section, item
+            
+            self._record_usage(None, model)
+            
+            response = _StreamedResponse(static, model)
+            async for delta in self._astream(request):
+                for section, item in response.feed(delta):
+                    yield section, item
+            
+            try:
+                analysis, stronger = self._routed_result(response.content(), language, decision, model)
+                if analysis is None:
+                    analysis = await self._acomplete_routed(code, language, None, static, decision, stronger)
+            except TruncatedResponse as truncated:
+                analysis = self._truncated(code, static, truncated)
+            yield "analysis", static.apply(analysis)
+    
+    def analyze_code(
+        self, code: str, language: str, context: Optional[str] = None, lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Blocking wrapper around aanalyze_code"""
+        return self._get_loop_thread().run(self.aanalyze_code(code, language, context, lines))
+    
+    def analyze_section(
+        self, code: str, language: str, section: str, context: Optional[str] = None
+    ) -> List[Any]:
+        """Blocking wrapper around aanalyze_section"""
+        return self._get_loop_thread().run(self.aanalyze_section(code, language, section, context))
+    
+    def analyze_code_stream(self, code: str, language: str) -> Iterator[Tuple[str, Any]]:
+        """Blocking iterator over aanalyze_code_stream"""
+        events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        
+        async def pump():
+            try:
+                async for event in self.aanalyze_code_stream(code, language):
+                    events.put(("event", event))
+                events.put(("done", None))
+            except Exception as e:
+                events.put(("error", e))
+        
+        loop_thread = self._get_loop_thread()
+        future = asyncio.run_coroutine_threadsafe(pump(), loop_thread.loop)
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            # Release the connection if the caller stops reading early
+            future.cancel()
+    
+    async def _acomplete_routed(
+        self,
+        code: str,
+        language: str,
+        context: Optional[str],
+        static: StaticAnalysis,
+        decision: RoutingDecision,
+        model: str,
+        section: str = EXPLANATIONS,
+        lines: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Async _complete_routed"""
+        while True:
+            request, model = self._fitted_request(code, language, context, static, decision, model, section, lines)
+            completion = await self._acomplete(request)
+            self._record_usage(completion, model)
+            analysis, model = self._routed_result(completion.content, language, decision, model, section)
+            if analysis is not None:
+                return analysis
+    
+    async def _acomplete(self, request: Dict[str, Any]) -> Completion:
+        """Async _complete"""
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            with metrics.span("queue_wait"):
+                await self.scheduler.aacquire(tokens)
+            try:
+                with metrics.span("api_call", model=request["model"]):
+                    return await self.backend.acomplete(request)
+            except Exception as e:
+                delay = self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    async def _astream(self, request: Dict[str, Any]) -> AsyncIterator[str]:
+        """Async _stream"""
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            with metrics.span("queue_wait"):
+                await self.scheduler.aacquire(tokens)
+            received = False
+            try:
+                async for delta in self.backend.astream(request):
+                    received = True
+                    yield delta
+                return
+            except Exception as e:
+                delay = None if received else self.scheduler.backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.scheduler.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    def _get_loop_thread(self) -> _EventLoopThread:
+        """Start the background event loop on first synchronous use"""
+        with self._loop_lock:
+            if self._loop_thread is None:
+                self._loop_thread = _EventLoopThread()
+            return self._loop_thread
\ No newline at end of file
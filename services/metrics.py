@@ -0,0 +1,247 @@
+"""
+Metrics - Per-stage timings and counters for the analysis pipeline
+Exposed as Prometheus text, periodic structured log lines and, when the
+opentelemetry package is installed, OpenTelemetry spans
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger("code_explainer.metrics")
+
+PREFIX = "code_explainer_"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._tracer = None
+
+    def increment(self, name: str, amount: float = 1.0, **labels: str) -> None:
+        """Add to a counter"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record a value (usually seconds) in a histogram"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(DEFAULT_BUCKETS)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage: str, **labels: str) -> Iterator[None]:
+        """Time a block as one pipeline stage"""
+        tracer = self._tracer
+        trace_span = tracer.start_as_current_span(stage, attributes=labels) if tracer else nullcontext()
+        started = time.perf_counter()
+        with trace_span:
+            try:
+                yield
+            finally:
+                self.observe("stage_duration_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def describe(self, name: str, help_text: str) -> None:
+        """Set the HELP line of a metric"""
+        self._help[name] = help_text
+
+    def enable_tracing(self, tracer) -> None:
+        """Mirror every span to an OpenTelemetry tracer"""
+        self._tracer = tracer
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Flat view of every series: counters, plus _count/_sum of histograms"""
+        result: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                for key, value in series.items():
+                    result.setdefault(name, {})[_format_labels(key)] = value
+            for name, series in self._histograms.items():
+                for key, histogram in series.items():
+                    labels = _format_labels(key)
+                    result.setdefault(f"{name}_count", {})[labels] = histogram.count
+                    result.setdefault(f"{name}_sum", {})[labels] = round(histogram.total, 6)
+        return result
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full = PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{full}{_format_labels(key)} {value:g}")
+            for name in sorted(self._histograms):
+                full = PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{full}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {count}")
+                    lines.append(f"{full}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {histogram.total:g}")
+                    lines.append(f"{full}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Drop every series"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("stage_duration_seconds", "Time spent in each pipeline stage")
+REGISTRY.describe("llm_requests_total", "Completion requests sent to the LLM backend")
+REGISTRY.describe("llm_tokens_total", "Prompt and completion tokens reported by the LLM backend")
+REGISTRY.describe("llm_retries_total", "LLM requests retried, by status code")
+REGISTRY.describe("llm_failures_total", "Failed LLM analyses by reason")
+REGISTRY.describe("routing_decisions_total", "Requests by the model tier they were routed to")
+REGISTRY.describe("routing_escalations_total", "Invalid analyses retried on a stronger model")
+REGISTRY.describe("llm_truncated_responses_total", "Cut-off or malformed responses salvaged, by outcome (repaired, kept, continued)")
+REGISTRY.describe("routed_request_seconds", "End-to-end latency of routed requests by final model")
+REGISTRY.describe("cache_lookups_total", "Analysis cache lookups by result")
+REGISTRY.describe("cache_claim_waits_total", "Cache misses that waited on another worker computing the same entry")
+REGISTRY.describe("analysis_requests_total", "Analyses by where the result came from (shared: computed by another worker)")
+REGISTRY.describe("analysis_failures_total", "Analyses that failed")
+REGISTRY.describe("app_reruns_total", "Streamlit script reruns")
+REGISTRY.describe("coalesced_requests_total", "Requests that waited on an identical in-flight analysis")
+REGISTRY.describe("similarity_lookups_total", "Near-duplicate index lookups by result")
+REGISTRY.describe("analysis_sections_total", "Deferred analysis sections (concepts, misconceptions, quiz) by source")
+REGISTRY.describe("analysis_jobs_total", "Background analysis jobs by status")
+REGISTRY.describe("analysis_job_seconds", "Time from submitting a background analysis to its result")
+REGISTRY.describe("quota_decisions_total", "Analyses admitted by quota outcome (normal, cheaper, queued)")
+REGISTRY.describe("quota_tokens_total", "Estimated tokens charged to quotas by outcome")
+REGISTRY.describe("quota_anonymous_callers_total", "Sessions charged to the shared anonymous budget for lack of a signed identity")
+
+increment = REGISTRY.increment
+observe = REGISTRY.observe
+span = REGISTRY.span
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> "ThreadingHTTPServer":
+    """Serve /metrics in Prometheus text format from a daemon thread"""
+    # Imported here: http.server pulls in the email package, which most processes never need
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def start_metrics_logger(interval: float) -> threading.Thread:
+    """Log a JSON snapshot of every metric every `interval` seconds"""
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info(json.dumps({"event": "metrics", "metrics": REGISTRY.snapshot()}))
+
+    thread = threading.Thread(target=run, name="metrics-logger", daemon=True)
+    thread.start()
+    return thread
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_from_env() -> None:
+    """
+    Start the exporters selected by environment variables (once per process)
+
+    METRICS_PORT: serve /metrics on this port
+    METRICS_LOG_INTERVAL: log a metrics line every N seconds
+    OTEL_TRACES: set to 1 to mirror spans to OpenTelemetry (needs opentelemetry-api)
+    """
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port))
+        except OSError as e:
+            # Another worker on this host already owns the port
+            logger.warning("Metrics server not started on port %s: %s", port, e)
+
+    interval = os.getenv("METRICS_LOG_INTERVAL")
+    if interval:
+        start_metrics_logger(float(interval))
+
+    if os.getenv("OTEL_TRACES") == "1":
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            logger.warning("OTEL_TRACES=1 but opentelemetry is not installed")
+        else:
+            REGISTRY.enable_tracing(trace.get_tracer("code_explainer"))
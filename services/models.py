@@ -0,0 +1,204 @@
+"""
+Analysis Model - Typed, compact representation of an analysis
+Slotted classes validated once at decode time, with concept names interned
+and a binary encoding for storage that is several times smaller than JSON
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# Binary format: header, line numbers, string byte lengths, then the UTF-8 of every string
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BIIII")
+# Length marking a missing optional string (a quiz question without a concept)
+_NONE_LENGTH = 0xFFFFFFFF
+
+_EXPLANATION_TEXT_FIELDS = ("code", "what_it_does", "why_it_exists", "what_breaks")
+
+
+class LineExplanation:
+    """Explanation of one source line"""
+
+    __slots__ = ("line_number", "code", "what_it_does", "why_it_exists", "what_breaks")
+
+    def __init__(self, line_number: int, code: str, what_it_does: str, why_it_exists: str, what_breaks: str):
+        self.line_number = line_number
+        self.code = code
+        self.what_it_does = what_it_does
+        self.why_it_exists = why_it_exists
+        self.what_breaks = what_breaks
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "LineExplanation":
+        """Validate one explanation object; missing text fields become empty strings"""
+        if not isinstance(data, dict):
+            raise ValueError(f"Line explanation must be an object, got {type(data).__name__}")
+        line_number = data.get("line_number")
+        if isinstance(line_number, str) and line_number.strip().isdigit():
+            line_number = int(line_number)
+        if not isinstance(line_number, int) or isinstance(line_number, bool):
+            raise ValueError(f"Invalid line_number: {line_number!r}")
+        return cls(line_number, *(_text(data, field) for field in _EXPLANATION_TEXT_FIELDS))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "line_number": self.line_number,
+            "code": self.code,
+            "what_it_does": self.what_it_does,
+            "why_it_exists": self.why_it_exists,
+            "what_breaks": self.what_breaks,
+        }
+
+
+class QuizQuestion:
+    """A question testing the student's understanding"""
+
+    __slots__ = ("question", "answer", "concept")
+
+    def __init__(self, question: str, answer: str, concept: Optional[str] = None):
+        self.question = question
+        self.answer = answer
+        self.concept = sys.intern(concept) if concept else None
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "QuizQuestion":
+        """Validate one quiz object; it needs at least a question"""
+        if not isinstance(data, dict):
+            raise ValueError(f"Quiz item must be an object, got {type(data).__name__}")
+        question = _text(data, "question")
+        if not question:
+            raise ValueError("Quiz item has no question")
+        concept = data.get("concept")
+        return cls(question, _text(data, "answer"), concept if isinstance(concept, str) else None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"question": self.question, "answer": self.answer}
+        if self.concept is not None:
+            data["concept"] = self.concept
+        return data
+
+
+class Analysis:
+    """A complete analysis of one snippet"""
+
+    __slots__ = ("line_explanations", "concepts", "misconceptions", "quiz")
+
+    def __init__(
+        self,
+        line_explanations: List[LineExplanation],
+        concepts: List[str],
+        misconceptions: List[str],
+        quiz: List[QuizQuestion]
+    ):
+        self.line_explanations = line_explanations
+        self.concepts = [sys.intern(concept) for concept in concepts]
+        self.misconceptions = misconceptions
+        self.quiz = quiz
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "Analysis":
+        """
+        Validate a decoded analysis
+
+        Raises:
+            ValueError: If a section is missing or an item has the wrong shape
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Analysis must be a JSON object")
+        sections = {}
+        for field in ("line_explanations", "concepts", "misconceptions", "quiz"):
+            if field not in data:
+                raise ValueError(f"Missing required field: {field}")
+            if not isinstance(data[field], list):
+                raise ValueError(f"Field {field} must be a list")
+            sections[field] = data[field]
+        return cls(
+            [LineExplanation.from_dict(item) for item in sections["line_explanations"]],
+            [item for item in sections["concepts"] if isinstance(item, str)],
+            [item for item in sections["misconceptions"] if isinstance(item, str)],
+            [QuizQuestion.from_dict(item) for item in sections["quiz"]],
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict form, freshly built so callers may mutate it"""
+        return {
+            "line_explanations": [explanation.to_dict() for explanation in self.line_explanations],
+            "concepts": list(self.concepts),
+            "misconceptions": list(self.misconceptions),
+            "quiz": [question.to_dict() for question in self.quiz],
+        }
+
+    def encode(self) -> bytes:
+        """Compact binary form for storage"""
+        strings: List[Optional[str]] = []
+        for explanation in self.line_explanations:
+            strings.extend(getattr(explanation, field) for field in _EXPLANATION_TEXT_FIELDS)
+        strings.extend(self.concepts)
+        strings.extend(self.misconceptions)
+        for question in self.quiz:
+            strings.extend((question.question, question.answer, question.concept))
+
+        encoded = [string.encode("utf-8") if string is not None else b"" for string in strings]
+        lengths = array("I", [
+            len(data) if string is not None else _NONE_LENGTH for string, data in zip(strings, encoded)
+        ])
+        lines = array("i", [explanation.line_number for explanation in self.line_explanations])
+        header = _HEADER.pack(_FORMAT_VERSION, len(self.line_explanations), len(self.concepts),
+                              len(self.misconceptions), len(self.quiz))
+        return zlib.compress(header + lines.tobytes() + lengths.tobytes() + b"".join(encoded))
+
+    @classmethod
+    def decode(cls, blob: bytes) -> "Analysis":
+        """Inverse of encode"""
+        data = zlib.decompress(blob)
+        version, explanations, concepts, misconceptions, quiz = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported analysis encoding version {version}")
+        offset = _HEADER.size
+        lines = array("i")
+        lines.frombytes(data[offset:offset + explanations * lines.itemsize])
+        offset += explanations * lines.itemsize
+        lengths = array("I")
+        count = 4 * explanations + concepts + misconceptions + 3 * quiz
+        lengths.frombytes(data[offset:offset + count * lengths.itemsize])
+        offset += count * lengths.itemsize
+        strings = _iter_strings(data, offset, lengths)
+
+        return cls(
+            [LineExplanation(line, next(strings), next(strings), next(strings), next(strings)) for line in lines],
+            [next(strings) for _ in range(concepts)],
+            [next(strings) for _ in range(misconceptions)],
+            [QuizQuestion(next(strings), next(strings), next(strings)) for _ in range(quiz)],
+        )
+
+
+def item_from_dict(section: str, item: Any) -> Union[LineExplanation, QuizQuestion, str]:
+    """Validate one streamed item of an analysis section"""
+    if section == "line_explanations":
+        return LineExplanation.from_dict(item)
+    if section == "quiz":
+        return QuizQuestion.from_dict(item)
+    if not isinstance(item, str):
+        raise ValueError(f"Items of {section} must be strings")
+    return sys.intern(item) if section == "concepts" else item
+
+
+def _text(data: Dict[str, Any], field: str) -> str:
+    """A text field, with numbers and the like stringified and None as empty"""
+    value = data.get(field)
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _iter_strings(data: bytes, offset: int, lengths: array) -> Iterator[Optional[str]]:
+    view = memoryview(data)
+    for length in lengths:
+        if length == _NONE_LENGTH:
+            yield None
+            continue
+        yield str(view[offset:offset + length], "utf-8")
+        offset += length
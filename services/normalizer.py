@@ -0,0 +1,162 @@
+"""
+Code Normalizer - Whitespace/comment-insensitive canonical form of snippets
+Near-identical submissions share one canonical text and fingerprint
+"""
+
+import hashlib
+import io
+import re
+import tokenize
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Longest operators first so "a += 1" and "a+=1" tokenize the same way
+_C_FAMILY_TOKEN = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+    |(?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+    |(?P<word>[A-Za-z_$][\w$]*|\d[\w.]*)
+    |(?P<space>\s+)
+    |(?P<op>>>>=|<<=|>>=|===|!==|\.\.\.|->|::|\+\+|--|&&|\|\||<<|>>|=>|[-+*/%&|^!=<>]=|.)
+    """,
+    re.S | re.X,
+)
+
+_PYTHON_SKIPPED = {
+    tokenize.COMMENT,
+    tokenize.NL,
+    tokenize.NEWLINE,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+    tokenize.ENCODING,
+    tokenize.ENDMARKER,
+}
+
+
+class CanonicalCode:
+    """Canonical text of a snippet plus the mapping back to its source lines"""
+
+    def __init__(self, language: str, lines: List[str], line_map: List[int]):
+        """
+        Args:
+            language: Programming language
+            lines: Canonical lines, one per significant source line
+            line_map: 1-based source line number for each canonical line
+        """
+        self.language = language
+        self.lines = lines
+        self.line_map = line_map
+        self.text = "\n".join(lines)
+        self.fingerprint = hashlib.sha256(f"{language}\0{self.text}".encode("utf-8")).hexdigest()
+        self._canonical_by_source: Dict[int, int] = {
+            source: index + 1 for index, source in enumerate(line_map)
+        }
+
+    def to_canonical(self, line_number: int) -> Optional[int]:
+        """Map a 1-based source line to its 1-based canonical line (None for blank/comment lines)"""
+        return self._canonical_by_source.get(line_number)
+
+    def to_source(self, canonical_line: int) -> Optional[int]:
+        """Map a 1-based canonical line back to its 1-based source line"""
+        if 1 <= canonical_line <= len(self.line_map):
+            return self.line_map[canonical_line - 1]
+        return None
+
+    def to_canonical_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Renumber an analysis's line explanations from source lines to canonical lines
+        
+        Explanations of blank or comment-only lines have no canonical
+        counterpart and are dropped.
+        """
+        explanations = []
+        for explanation in analysis.get("line_explanations", []):
+            line_number = self.to_canonical(explanation.get("line_number"))
+            if line_number is not None:
+                explanations.append({**explanation, "line_number": line_number})
+        return {**analysis, "line_explanations": explanations}
+
+
+def canonicalize(code: str, language: str) -> CanonicalCode:
+    """
+    Reduce code to a whitespace- and comment-insensitive canonical form
+
+    Args:
+        code: The code to normalize
+        language: Programming language
+
+    Returns:
+        CanonicalCode with the canonical text, fingerprint and line mapping
+    """
+    language = language.lower()
+    code = code.replace("\r\n", "\n").replace("\r", "\n")
+
+    rows = None
+    if language == "python":
+        rows = _python_rows(code)
+    if rows is None:
+        rows = _c_family_rows(code) if language != "python" else _plain_rows(code)
+
+    line_map = sorted(rows)
+    return CanonicalCode(language, [rows[row] for row in line_map], line_map)
+
+
+def _python_rows(code: str) -> Optional[Dict[int, str]]:
+    """Group Python tokens by source row, encoding indentation as block depth"""
+    rows: Dict[int, List[str]] = {}
+    depths: Dict[int, int] = {}
+    depth = 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.INDENT:
+                depth += 1
+            elif token.type == tokenize.DEDENT:
+                depth -= 1
+            if token.type in _PYTHON_SKIPPED:
+                continue
+            row = token.start[0]
+            if row not in rows:
+                rows[row] = []
+                depths[row] = depth
+            rows[row].append(token.string)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+    return {row: "  " * depths[row] + " ".join(tokens) for row, tokens in rows.items()}
+
+
+def iter_c_family_tokens(code: str) -> Iterator[Tuple[str, str, int]]:
+    """
+    Tokenize C/C++/Java/JavaScript code, skipping comments and whitespace
+
+    Yields:
+        (kind, text, row) with kind one of "string", "word" or "op"
+        and row the 1-based line the token starts on
+    """
+    row = 1
+    for match in _C_FAMILY_TOKEN.finditer(code):
+        text = match.group()
+        if match.lastgroup not in ("comment", "space"):
+            yield match.lastgroup, text, row
+        row += text.count("\n")
+
+
+def _c_family_rows(code: str) -> Dict[int, str]:
+    """Group C/C++/Java/JavaScript tokens by source row, dropping comments and whitespace"""
+    rows: Dict[int, List[str]] = {}
+    for _, text, row in iter_c_family_tokens(code):
+        rows.setdefault(row, []).append(text)
+    return {row: " ".join(tokens) for row, tokens in rows.items()}
+
+
+def _plain_rows(code: str) -> Dict[int, str]:
+    """Fallback for code that does not tokenize: only trailing space and blank lines are ignored"""
+    return {
+        index + 1: line.rstrip()
+        for index, line in enumerate(code.split("\n"))
+        if line.strip()
+    }
+
+
+def split_source_lines(code: str) -> List[str]:
+    """Split code into source lines the same way canonicalize counts them"""
+    return code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
@@ -0,0 +1,230 @@
+"""
+Quotas - Token budgets per session, user and course
+Every analysis is estimated in tokens before it runs and charged against a
+token bucket for each scope its caller belongs to. A caller over budget is
+not refused but degraded: first to the cheapest model tier with a smaller
+share of the request queue, then, once deep in overdraft, queued until the
+budget has refilled. User and course ids only count when the link carrying them
+is signed; everyone else shares one anonymous budget
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from . import metrics
+from .scheduler import TokenBucket
+
+SCOPES = ("session", "user", "course")
+DEFAULT_WINDOW_SECONDS = 60 * 60
+# How far past empty a bucket may go, as a fraction of its capacity, before requests are queued
+DEFAULT_OVERDRAFT = 0.5
+# Queue share of a degraded caller relative to one within budget
+DEFAULT_DEGRADED_WEIGHT = 0.25
+
+NORMAL, CHEAPER, DELAYED = "normal", "cheaper", "queued"
+
+# User and course id charged for callers without a verified identity
+ANONYMOUS = "anonymous"
+
+
+class Caller:
+    """Who an analysis is for: always a session, optionally a signed-in user and their course"""
+
+    def __init__(self, session: str, user: Optional[str] = None, course: Optional[str] = None):
+        self.session = session
+        self.user = user
+        self.course = course
+
+    def scopes(self) -> List[Tuple[str, str]]:
+        """(scope, id) of every scope the caller belongs to"""
+        ids = {"session": self.session, "user": self.user, "course": self.course}
+        return [(scope, ids[scope]) for scope in SCOPES if ids[scope]]
+
+
+def sign_identity(user: str, course: Optional[str], key: str) -> str:
+    """
+    Signature a course page adds to the link it sends a student with
+
+    Args:
+        user: The student's id
+        course: Their course's id, if any
+        key: Secret shared with the app (QUOTA_SIGNING_KEY)
+
+    Returns:
+        Hex HMAC-SHA256 of the user and course
+    """
+    message = f"{user}\0{course or ''}".encode("utf-8")
+    return hmac.new(key.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def verified_identity(
+    user: Optional[str], course: Optional[str], signature: Optional[str], key: Optional[str] = None
+) -> Tuple[str, Optional[str]]:
+    """
+    The (user, course) a signed link vouches for
+
+    Ids a visitor could have typed in themselves would let them start over
+    with a full budget, so without a valid signature the caller is charged to
+    the ANONYMOUS user and course, whose budgets every such caller shares.
+
+    Args:
+        user: User id from the link
+        course: Course id from the link
+        signature: The link's sign_identity signature
+        key: Signing secret (defaults to QUOTA_SIGNING_KEY; unset means no link is trusted)
+    """
+    key = key if key is not None else os.getenv("QUOTA_SIGNING_KEY")
+    if key and user and signature and hmac.compare_digest(sign_identity(user, course, key), signature):
+        return user, course
+    metrics.increment("quota_anonymous_callers_total")
+    return ANONYMOUS, ANONYMOUS
+
+
+class QuotaDecision:
+    """How an analysis runs given its caller's remaining budget"""
+
+    def __init__(
+        self,
+        mode: str,
+        tokens: int,
+        wait_seconds: float = 0.0,
+        weight: float = 1.0,
+        scope: Optional[str] = None,
+        remaining: Optional[float] = None
+    ):
+        """
+        Args:
+            mode: NORMAL, CHEAPER (cheapest model, smaller queue share) or
+                DELAYED (as CHEAPER, after waiting for the budget to refill)
+            tokens: Estimated cost of the analysis
+            wait_seconds: How long a DELAYED analysis waits before it starts
+            weight: Share of the request queue, see scheduler.session_scope
+            scope: The scope whose budget is shortest, if any is limited
+            remaining: Tokens left in that scope's budget before this analysis
+        """
+        self.mode = mode
+        self.tokens = tokens
+        self.wait_seconds = wait_seconds
+        self.weight = weight
+        self.scope = scope
+        self.remaining = remaining
+
+    @property
+    def degraded(self) -> bool:
+        """Whether the analysis runs on the cheapest model"""
+        return self.mode != NORMAL
+
+
+class QuotaManager:
+    """Token buckets per scope, refilled continuously over a window"""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, float]] = None,
+        window_seconds: float = DEFAULT_WINDOW_SECONDS,
+        overdraft: float = DEFAULT_OVERDRAFT,
+        degraded_weight: float = DEFAULT_DEGRADED_WEIGHT,
+        max_buckets: int = 10000
+    ):
+        """
+        Args:
+            limits: Tokens per window for each of SCOPES; unlisted scopes are unlimited
+            window_seconds: Time over which a full budget refills
+            overdraft: Fraction of a budget a caller may overspend on the cheapest model before being queued
+            degraded_weight: Queue share of callers over budget
+            max_buckets: Buckets kept; the least recently used are forgotten, which refills them
+        """
+        for scope in limits or {}:
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown quota scope: {scope}. Scopes: {list(SCOPES)}")
+        self.limits = {scope: float(limit) for scope, limit in (limits or {}).items() if limit}
+        self.window_seconds = window_seconds
+        self.overdraft = overdraft
+        self.degraded_weight = degraded_weight
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "QuotaManager":
+        """
+        Quotas configured by environment variables
+
+        QUOTA_SESSION_TOKENS, QUOTA_USER_TOKENS, QUOTA_COURSE_TOKENS: Tokens
+            per window for each scope (unset or 0 for unlimited)
+        QUOTA_WINDOW: Window in seconds (default one hour)
+        QUOTA_OVERDRAFT: Fraction of a budget that may be overspent on the cheapest model
+        """
+        limits = {scope: float(os.getenv(f"QUOTA_{scope.upper()}_TOKENS") or 0) for scope in SCOPES}
+        return cls(
+            limits,
+            window_seconds=float(os.getenv("QUOTA_WINDOW", str(DEFAULT_WINDOW_SECONDS))),
+            overdraft=float(os.getenv("QUOTA_OVERDRAFT", str(DEFAULT_OVERDRAFT))),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any scope is limited"""
+        return bool(self.limits)
+
+    def check(self, caller: Caller, tokens: int) -> QuotaDecision:
+        """Decide how an analysis of `tokens` estimated tokens would run, without charging for it"""
+        with self._lock:
+            return self._decide(caller, tokens, time.monotonic())
+
+    def admit(self, caller: Caller, tokens: int) -> QuotaDecision:
+        """Decide how an analysis runs and charge its estimate to every scope of the caller"""
+        now = time.monotonic()
+        with self._lock:
+            decision = self._decide(caller, tokens, now)
+            for key in self._keys(caller):
+                self._bucket(key).spend(tokens, now)
+        metrics.increment("quota_decisions_total", mode=decision.mode)
+        metrics.increment("quota_tokens_total", amount=tokens, mode=decision.mode)
+        return decision
+
+    def _decide(self, caller: Caller, tokens: int, now: float) -> QuotaDecision:
+        """Compare the estimate with the tightest of the caller's budgets (lock held)"""
+        decision = QuotaDecision(NORMAL, tokens)
+        shortest = None
+        for key in self._keys(caller):
+            bucket = self._bucket(key)
+            available = bucket.available(now)
+            if shortest is None or available - tokens < shortest:
+                shortest = available - tokens
+                decision.scope, decision.remaining = key[0], available
+            if available >= tokens:
+                continue
+            floor = -self.overdraft * bucket.capacity
+            if available - tokens >= floor:
+                mode, wait = CHEAPER, 0.0
+            else:
+                # Wait until this analysis would leave the bucket no deeper than the overdraft;
+                # one larger than a whole budget only waits for the bucket to be full
+                wait = bucket.wait_time(tokens + floor, now)
+                mode = DELAYED if wait > 0 else CHEAPER
+            if mode == DELAYED or decision.mode == NORMAL:
+                decision.mode = mode
+            decision.wait_seconds = max(decision.wait_seconds, wait)
+        if decision.degraded:
+            decision.weight = self.degraded_weight
+        return decision
+
+    def _keys(self, caller: Caller) -> List[Tuple[str, str]]:
+        return [(scope, id_) for scope, id_ in caller.scopes() if scope in self.limits]
+
+    def _bucket(self, key: Tuple[str, str]) -> TokenBucket:
+        """The bucket of a (scope, id), created full (lock held)"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self.limits[key[0]]
+            bucket = self._buckets[key] = TokenBucket(limit, limit / self.window_seconds)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
@@ -0,0 +1,237 @@
+"""
+Model Router - Pick the cheapest model tier that can handle a snippet
+Scores each snippet locally by size, nesting depth, cyclomatic complexity and
+language, and escalates to a stronger tier when a cheap model's output fails
+validation. Every decision is recorded so the thresholds can be tuned.
+"""
+
+import ast
+import contextvars
+import json
+import math
+import os
+import re
+import textwrap
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import metrics
+from .normalizer import iter_c_family_tokens, split_source_lines
+
+# Default tiers as "model:max_score" from cheapest to strongest; the last has no ceiling
+DEFAULT_TIERS = "gpt-3.5-turbo-1106:10,{strongest}"
+
+# Lower-level languages are harder to explain at the same size
+LANGUAGE_WEIGHTS = {"python": 1.0, "javascript": 1.0, "java": 1.1, "c": 1.2, "cpp": 1.3}
+
+_PYTHON_BRANCHES = (ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler, ast.Assert)
+_PYTHON_BLOCKS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor,
+                  ast.While, ast.Try, ast.With, ast.AsyncWith)
+_PYTHON_BRANCH_WORDS = re.compile(r"\b(?:if|elif|for|while|and|or|except)\b")
+_C_FAMILY_BRANCHES = {"if", "for", "while", "case", "catch", "&&", "||", "?"}
+
+# Set inside cheapest_tier(): requests start at the cheapest tier whatever their score
+_cheapest: contextvars.ContextVar = contextvars.ContextVar("route_cheapest", default=False)
+
+
+@contextmanager
+def cheapest_tier() -> Iterator[None]:
+    """Route requests made inside the block to the cheapest tier; invalid output still escalates"""
+    token = _cheapest.set(True)
+    try:
+        yield
+    finally:
+        _cheapest.reset(token)
+
+
+class ModelTier:
+    """A model and the highest complexity score it is trusted with"""
+
+    def __init__(self, model: str, max_score: float = math.inf):
+        self.model = model
+        self.max_score = max_score
+
+    def __repr__(self) -> str:
+        return self.model if self.max_score == math.inf else f"{self.model}:{self.max_score:g}"
+
+
+class RoutingDecision:
+    """The tier chosen for one request and what happened to it"""
+
+    def __init__(self, score: float, features: Dict[str, Any], models: List[str]):
+        """
+        Args:
+            score: Complexity score of the snippet
+            features: Measurements the score was computed from
+            models: Chosen model followed by the stronger ones to escalate to
+        """
+        self.score = score
+        self.features = features
+        self.models = models
+        self.escalations = 0
+        self.started = time.perf_counter()
+
+
+def measure_complexity(code: str, language: str) -> Dict[str, Any]:
+    """
+    Measure a snippet
+
+    Returns:
+        lines (non-blank), depth (deepest block nesting) and
+        cyclomatic (1 + decision points)
+    """
+    lines = sum(1 for line in split_source_lines(code) if line.strip())
+    if language == "python":
+        try:
+            tree = ast.parse(textwrap.dedent(code))
+        except SyntaxError:
+            tree = None
+        if tree is not None:
+            branches = 0
+            for node in ast.walk(tree):
+                if isinstance(node, _PYTHON_BRANCHES):
+                    branches += 1
+                elif isinstance(node, ast.BoolOp):
+                    branches += len(node.values) - 1
+                elif isinstance(node, ast.comprehension):
+                    branches += 1 + len(node.ifs)
+            return {"lines": lines, "depth": _python_depth(tree), "cyclomatic": 1 + branches}
+        # Excerpts that do not parse are measured by indentation instead
+        indents = [len(line) - len(line.lstrip()) for line in split_source_lines(code) if line.strip()]
+        base = min(indents, default=0)
+        return {
+            "lines": lines,
+            "depth": max((indent - base) // 4 for indent in indents) if indents else 0,
+            "cyclomatic": 1 + len(_PYTHON_BRANCH_WORDS.findall(code)),
+        }
+
+    depth = max_depth = branches = 0
+    for _, text, _ in iter_c_family_tokens(code):
+        if text == "{":
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif text == "}":
+            depth = max(0, depth - 1)
+        elif text in _C_FAMILY_BRANCHES:
+            branches += 1
+    return {"lines": lines, "depth": max_depth, "cyclomatic": 1 + branches}
+
+
+def complexity_score(features: Dict[str, Any], language: str) -> float:
+    """Combine measurements into one score; roughly 3 for hello world, 20+ for a dense function"""
+    raw = features["cyclomatic"] + 2 * features["depth"] + features["lines"] / 10
+    return round(raw * LANGUAGE_WEIGHTS.get(language, 1.0), 2)
+
+
+def parse_tiers(spec: str) -> List[ModelTier]:
+    """Parse "model:max_score,...,model" into tiers ordered cheapest first"""
+    tiers = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        model, _, threshold = entry.rpartition(":")
+        try:
+            max_score = float(threshold)
+        except ValueError:
+            # No threshold, or a model name that itself contains colons
+            model, max_score = entry, math.inf
+        if not model:
+            raise ValueError(f"Invalid model tier: {entry!r}")
+        tiers.append(ModelTier(model, max_score))
+    if not tiers:
+        raise ValueError("At least one model tier is required")
+    tiers[-1].max_score = math.inf
+    return tiers
+
+
+class ModelRouter:
+    """Routes each snippet to a model tier and records the outcome"""
+
+    def __init__(self, tiers: List[ModelTier], log_path: Optional[str] = None):
+        """
+        Args:
+            tiers: Model tiers ordered cheapest first
+            log_path: JSONL file every decision is appended to, for tuning thresholds
+        """
+        if not tiers:
+            raise ValueError("At least one model tier is required")
+        self.tiers = tiers
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, strongest: str) -> "ModelRouter":
+        """
+        Router configured by environment variables
+
+        LLM_MODEL_TIERS: tiers such as "gpt-3.5-turbo-1106:10,gpt-4"; a single
+            model disables routing
+        ROUTING_LOG: JSONL file to record decisions in
+        """
+        spec = os.getenv("LLM_MODEL_TIERS") or DEFAULT_TIERS.format(strongest=strongest)
+        return cls(parse_tiers(spec), log_path=os.getenv("ROUTING_LOG") or None)
+
+    @property
+    def strongest(self) -> str:
+        """Model of the highest tier"""
+        return self.tiers[-1].model
+
+    @property
+    def signature(self) -> str:
+        """Identifies the routing configuration, e.g. for cache keys; analyses forced onto the cheapest tier differ"""
+        signature = ",".join(repr(tier) for tier in self.tiers)
+        if _cheapest.get() and len(self.tiers) > 1:
+            return f"{signature};cheapest"
+        return signature
+
+    def route(self, code: str, language: str) -> RoutingDecision:
+        """Choose the cheapest tier whose threshold covers the snippet's score (or the cheapest, see cheapest_tier)"""
+        features = measure_complexity(code, language)
+        score = complexity_score(features, language)
+        if _cheapest.get():
+            index = 0
+        else:
+            index = next(i for i, tier in enumerate(self.tiers) if score <= tier.max_score)
+        decision = RoutingDecision(score, features, [tier.model for tier in self.tiers[index:]])
+        metrics.increment("routing_decisions_total", model=decision.models[0])
+        return decision
+
+    def escalate(self, decision: RoutingDecision, failed_model: str) -> Optional[str]:
+        """Next stronger model after `failed_model` produced an invalid analysis, or None"""
+        position = decision.models.index(failed_model) + 1
+        if position >= len(decision.models):
+            return None
+        decision.escalations += 1
+        metrics.increment("routing_escalations_total", from_model=failed_model)
+        return decision.models[position]
+
+    def record(self, decision: RoutingDecision, model: str, language: str, succeeded: bool = True) -> None:
+        """Record the final model and end-to-end latency of a routed request"""
+        elapsed = time.perf_counter() - decision.started
+        metrics.observe("routed_request_seconds", elapsed, model=model, routed_to=decision.models[0])
+        if not self.log_path:
+            return
+        entry = {
+            "timestamp": time.time(),
+            "language": language,
+            "score": decision.score,
+            **decision.features,
+            "routed_to": decision.models[0],
+            "final_model": model,
+            "escalations": decision.escalations,
+            "succeeded": succeeded,
+            "latency_s": round(elapsed, 4),
+        }
+        with self._log_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+def _python_depth(node: ast.AST, depth: int = 0) -> int:
+    """Deepest nesting of compound statements below a node"""
+    deepest = depth
+    for child in ast.iter_child_nodes(node):
+        child_depth = depth + 1 if isinstance(child, _PYTHON_BLOCKS) else depth
+        deepest = max(deepest, _python_depth(child, child_depth))
+    return deepest
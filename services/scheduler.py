@@ -0,0 +1,401 @@
+"""
+Request Scheduler - Rate-limit aware admission and retries for LLM calls
+Tracks the request/token budget reported in x-ratelimit-* response headers,
+retries transient failures with jittered exponential backoff, and queues
+requests in weighted fair order across sessions while the budget is exhausted
+"""
+
+import asyncio
+import contextvars
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Mapping, Optional
+
+from . import metrics
+from .budget import count_message_tokens
+
+# Statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+current_session: contextvars.ContextVar = contextvars.ContextVar("llm_session", default="default")
+# Share of the queue a session's requests get relative to others (see session_scope)
+current_weight: contextvars.ContextVar = contextvars.ContextVar("llm_weight", default=1.0)
+
+# Finish tags kept for idle sessions before the stale ones are dropped
+_MAX_IDLE_TAGS = 4096
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+@contextmanager
+def session_scope(session_id: str, weight: float = 1.0) -> Iterator[None]:
+    """
+    Attribute LLM requests made inside the block to one session
+
+    Args:
+        session_id: Session the requests queue under
+        weight: Share of the queue relative to other sessions; a session of
+            weight 0.25 gets a quarter of the tokens a session of weight 1 does
+    """
+    token = current_session.set(session_id)
+    weight_token = current_weight.set(weight)
+    try:
+        yield
+    finally:
+        current_weight.reset(weight_token)
+        current_session.reset(token)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a reset duration such as "1s", "6m0s" or "20ms" into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def estimate_request_tokens(request: Mapping[str, Any]) -> int:
+    """Tokens a request counts against the limit: prompt estimate plus max_tokens"""
+    return count_message_tokens(request.get("messages", [])) + int(request.get("max_tokens") or 0)
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """HTTP status of a backend or OpenAI error, if it has one"""
+    status = getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def headers_of(error: BaseException) -> Mapping[str, str]:
+    """Response headers attached to an OpenAI error or BackendError"""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    return headers or {}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed request may succeed if sent again"""
+    status = status_code_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # No status at all means the request never got an HTTP response
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectionError", "TimeoutError")
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server-requested delay before retrying, from the error or its headers"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    headers = headers_of(error)
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget
+
+    An unknown capacity (None) means unlimited. The level may go negative
+    when more is spent than was available, which delays later requests.
+    """
+
+    def __init__(self, capacity: Optional[float] = None, refill_per_second: Optional[float] = None):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity or 0.0
+        self.updated = time.monotonic()
+
+    def available(self, now: float) -> float:
+        """Budget available at `now`"""
+        if self.capacity is None:
+            return math.inf
+        refilled = self.level + (self.refill_per_second or 0.0) * max(0.0, now - self.updated)
+        return min(self.capacity, refilled)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be spent (0 if it can be spent now)"""
+        if self.capacity is None:
+            return 0.0
+        shortfall = min(amount, self.capacity) - self.available(now)
+        if shortfall <= 0:
+            return 0.0
+        return shortfall / self.refill_per_second if self.refill_per_second else math.inf
+
+    def spend(self, amount: float, now: float) -> None:
+        """Take `amount` from the budget"""
+        if self.capacity is None:
+            return
+        self.level = self.available(now) - amount
+        self.updated = now
+
+    def observe(self, limit: float, remaining: float, reset_seconds: Optional[float], now: float) -> None:
+        """
+        Resynchronize with a server-reported budget
+
+        `reset_seconds` is how long until the budget is full again, which
+        gives the refill rate. Limits are per minute when it is unknown.
+        """
+        if limit <= 0:
+            return
+        if reset_seconds and remaining < limit:
+            self.refill_per_second = (limit - remaining) / reset_seconds
+        elif not self.refill_per_second:
+            self.refill_per_second = limit / 60.0
+        self.capacity = limit
+        self.level = remaining
+        self.updated = now
+
+
+class _Ticket:
+    """One request waiting for admission"""
+
+    def __init__(self, session: str, tokens: float, wake: Callable[[], None], weight: float = 1.0):
+        self.session = session
+        self.tokens = tokens
+        self.wake = wake
+        self.weight = weight
+        self.granted = False
+        # Virtual times between which the fair queue would serve this request
+        self.start = 0.0
+        self.finish = 0.0
+
+
+class RequestScheduler:
+    """
+    Admits LLM requests within the account's rate limits
+
+    Requests are admitted immediately while the budget allows. Otherwise
+    they wait in per-session FIFO queues served by start-time fair queueing
+    over tokens: each session gets its weight's share of the token budget,
+    so one session submitting many large requests cannot starve sessions
+    sending small ones. Failed requests are
+    retried with full-jitter exponential backoff, honoring Retry-After, and
+    a 429 pauses every admission until the server's delay has passed.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            max_in_flight: Maximum concurrently admitted requests (None for no cap)
+            max_retries: Retries per request (defaults to LLM_MAX_RETRIES or 4)
+            base_delay: Backoff ceiling of the first retry, in seconds
+            max_delay: Upper bound of any single backoff
+            seed: Seed for backoff jitter
+        """
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self._queues: Dict[str, Deque[_Ticket]] = {}
+        # Start tag of the request admitted last, and each session's latest finish tag
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """Update the budget from x-ratelimit-* response headers"""
+        now = time.monotonic()
+        with self._lock:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is None or remaining is None:
+                    continue
+                try:
+                    limit, remaining = float(limit), float(remaining)
+                except ValueError:
+                    continue
+                bucket.observe(limit, remaining, parse_duration(headers.get(f"x-ratelimit-reset-{kind}")), now)
+            self._dispatch(now, nudge=True)
+
+    def acquire(self, tokens: float = 0) -> None:
+        """Block until a request of `tokens` estimated tokens may be sent"""
+        event = threading.Event()
+        ticket = _Ticket(current_session.get(), tokens, event.set, current_weight.get())
+        delay = self._enqueue(ticket)
+        try:
+            while not ticket.granted:
+                event.wait(delay)
+                event.clear()
+                with self._lock:
+                    delay = self._dispatch(time.monotonic())
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def aacquire(self, tokens: float = 0) -> None:
+        """Wait without blocking the event loop until a request may be sent"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = _Ticket(current_session.get(), tokens, lambda: loop.call_soon_threadsafe(event.set),
+                         current_weight.get())
+        delay = self._enqueue(ticket)
+        try:
+            while not ticket.granted:
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+                with self._lock:
+                    delay = self._dispatch(time.monotonic())
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def release(self) -> None:
+        """Mark an admitted request as finished"""
+        with self._lock:
+            self._in_flight -= 1
+            self._dispatch(time.monotonic(), nudge=True)
+
+    @contextmanager
+    def slot(self, tokens: float = 0) -> Iterator[None]:
+        """Hold an admission for the duration of the block"""
+        self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens: float = 0) -> AsyncIterator[None]:
+        """Async version of slot"""
+        await self.aacquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """
+        Delay before retrying a failed request, or None if it should not be retried
+
+        Args:
+            attempt: Number of retries already made for this request
+            error: The failure
+        """
+        headers = headers_of(error)
+        if headers:
+            self.observe_headers(headers)
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+
+        status = status_code_of(error)
+        retry_after = retry_after_seconds(error)
+        with self._lock:
+            delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if status == 429:
+                # Everyone else would hit the same limit; hold the whole queue
+                pause = retry_after if retry_after is not None else delay
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+        metrics.increment("llm_retries_total", reason=str(status) if status else "connection")
+        return delay
+
+    def stats(self) -> Dict[str, float]:
+        """Current queue depth, admissions in flight and known budget"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "in_flight": self._in_flight,
+                "requests_available": self.requests.available(now),
+                "tokens_available": self.tokens.available(now),
+            }
+
+    def _enqueue(self, ticket: _Ticket) -> Optional[float]:
+        with self._lock:
+            # A session that was idle starts at the current virtual time rather than banking credit
+            ticket.start = max(self._virtual_time, self._finish_tags.get(ticket.session, 0.0))
+            ticket.finish = ticket.start + max(ticket.tokens, 1.0) / max(ticket.weight, 1e-6)
+            self._finish_tags[ticket.session] = ticket.finish
+            if len(self._finish_tags) > _MAX_IDLE_TAGS:
+                self._finish_tags = {
+                    session: tag for session, tag in self._finish_tags.items()
+                    if tag > self._virtual_time or session in self._queues
+                }
+            self._queues.setdefault(ticket.session, deque()).append(ticket)
+            return self._dispatch(time.monotonic())
+
+    def _abandon(self, ticket: _Ticket) -> None:
+        """Forget a ticket whose waiter gave up, returning its slot if it had one"""
+        with self._lock:
+            if ticket.granted:
+                self._in_flight -= 1
+            else:
+                queue = self._queues.get(ticket.session)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[ticket.session]
+            self._dispatch(time.monotonic(), nudge=True)
+
+    def _dispatch(self, now: float, nudge: bool = False) -> Optional[float]:
+        """
+        Grant queued tickets in order of their finish tags across sessions (lock held)
+
+        Returns:
+            Seconds until the blocked head of the queue may be admitted,
+            or None if nothing is waiting on time (empty, or at max_in_flight)
+        """
+        while self._queues:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                return None
+
+            session, queue = min(self._queues.items(), key=lambda item: item[1][0].finish)
+            ticket = queue[0]
+            wait = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(ticket.tokens, now),
+            )
+            if wait > 0:
+                if nudge:
+                    # The head may be sleeping without a timeout; make it re-check
+                    ticket.wake()
+                return min(wait, self.max_delay)
+
+            queue.popleft()
+            if not queue:
+                del self._queues[session]
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            self.requests.spend(1, now)
+            self.tokens.spend(ticket.tokens, now)
+            self._in_flight += 1
+            ticket.granted = True
+            ticket.wake()
+        return None
@@ -0,0 +1,338 @@
+"""
+Similarity Index - Find past analyses of structurally identical code
+Identifiers are abstracted away, so the same algorithm with renamed variables
+gets the same MinHash signature. Signatures are bucketed with LSH in SQLite,
+which keeps lookups to a handful of indexed reads however large the index is.
+"""
+
+import builtins
+import difflib
+import hashlib
+import io
+import json
+import keyword
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import tokenize
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+from .normalizer import iter_c_family_tokens
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "similar.sqlite3")
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+# Estimated Jaccard similarity above which a stored analysis is reused
+DEFAULT_THRESHOLD = 0.8
+# Most recent entries read per bucket, which bounds lookups when common idioms crowd a bucket
+BUCKET_READ_LIMIT = 16
+# Candidates (by number of colliding bands) whose signatures are compared
+MAX_CANDIDATES = 8
+
+# Each permutation XORs the shingle hashes with its own random mask
+_PERMUTATION_MASKS = [
+    int.from_bytes(hashlib.blake2b(f"permutation {i}".encode(), digest_size=8).digest(), "big")
+    for i in range(NUM_PERMUTATIONS)
+]
+
+_PYTHON_KEPT = set(keyword.kwlist) | set(dir(builtins)) | {"self", "cls"}
+_C_FAMILY_KEPT = {
+    # Keywords and types
+    "auto", "break", "case", "catch", "char", "class", "const", "continue", "default", "delete", "do",
+    "double", "else", "enum", "extends", "false", "final", "float", "for", "function", "if", "implements",
+    "import", "include", "int", "let", "long", "new", "null", "nullptr", "private", "protected", "public",
+    "return", "short", "signed", "sizeof", "static", "struct", "switch", "this", "throw", "throws", "true",
+    "try", "typedef", "typeof", "unsigned", "var", "void", "volatile", "while", "bool", "boolean", "const",
+    "undefined", "template", "typename", "namespace", "using", "virtual", "override", "async", "await",
+    "yield", "instanceof", "in", "of", "interface", "package", "super", "byte", "size_t",
+    # Library names whose meaning matters to an explanation
+    "std", "cout", "cin", "endl", "printf", "scanf", "puts", "malloc", "calloc", "free", "strlen",
+    "System", "out", "println", "print", "String", "Integer", "Math", "ArrayList", "List", "Map",
+    "HashMap", "Scanner", "console", "log", "Array", "Object", "JSON", "Math", "vector", "string", "main",
+}
+
+# Short identifiers that are also English words are only substituted inside code
+_ENGLISH_WORDS = {"a", "i", "an", "as", "at", "be", "by", "do", "if", "in", "is", "it", "no", "of",
+                  "on", "or", "so", "to", "up", "us", "we", "the", "and", "for", "not", "all", "any"}
+
+_EXPLANATION_TEXT_FIELDS = ("what_it_does", "why_it_exists", "what_breaks")
+
+
+class Match:
+    """A stored analysis of code that is structurally close to a query"""
+
+    def __init__(self, code: str, analysis: Dict[str, Any], similarity: float, renames: Dict[str, str]):
+        """
+        Args:
+            code: Code the stored analysis was made for
+            analysis: The stored analysis
+            similarity: Estimated Jaccard similarity of the structural shingles
+            renames: Stored identifier -> query identifier
+        """
+        self.code = code
+        self.analysis = analysis
+        self.similarity = similarity
+        self.renames = renames
+
+    def adapted(self) -> Tuple[str, Dict[str, Any]]:
+        """The stored code and analysis with the query's identifiers substituted in"""
+        return substitute_identifiers(self.code, self.analysis, self.renames)
+
+
+def structural_tokens(code: str, language: str) -> List[Tuple[str, str]]:
+    """
+    Tokens with identifiers abstracted
+
+    Returns:
+        (shape, original) pairs where shape is "ID" for every user-chosen
+        identifier, "STR" for string literals and the token itself otherwise
+    """
+    tokens = []
+    if language == "python":
+        previous = ""
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(code).readline):
+                if token.type == tokenize.NAME:
+                    renamed = token.string not in _PYTHON_KEPT and previous != "."
+                    tokens.append(("ID" if renamed else token.string, token.string))
+                elif token.type == tokenize.STRING:
+                    tokens.append(("STR", token.string))
+                elif token.type in (tokenize.OP, tokenize.NUMBER):
+                    tokens.append((token.string, token.string))
+                previous = token.string
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            pass
+        return tokens
+
+    previous = ""
+    for kind, text, _ in iter_c_family_tokens(code):
+        if kind == "word" and not text[0].isdigit():
+            renamed = text not in _C_FAMILY_KEPT and previous not in (".", "->", "::")
+            tokens.append(("ID" if renamed else text, text))
+        elif kind == "string":
+            tokens.append(("STR", text))
+        else:
+            tokens.append((text, text))
+        previous = text
+    return tokens
+
+
+def minhash_signature(shapes: List[str]) -> array:
+    """MinHash signature of the token shingles of a structural token sequence"""
+    shingles = {" ".join(shapes[i:i + SHINGLE_SIZE]) for i in range(max(1, len(shapes) - SHINGLE_SIZE + 1))}
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in shingles
+    ]
+    return array("Q", [min(map(mask.__xor__, hashes)) for mask in _PERMUTATION_MASKS])
+
+
+def band_keys(signature: array, language: str, variant: str = "") -> List[int]:
+    """One LSH bucket per band, as signed 64-bit integers SQLite can index; each variant has its own buckets"""
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+    keys = []
+    suffix = language.encode() + (b"\0" + variant.encode() if variant else b"")
+    for band in range(LSH_BANDS):
+        payload = struct.pack(f"<I{rows}Q", band, *signature[band * rows:(band + 1) * rows]) + suffix
+        keys.append(int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big", signed=True))
+    return keys
+
+
+def identifier_renames(stored: List[Tuple[str, str]], query: List[Tuple[str, str]]) -> Dict[str, str]:
+    """Pair the identifiers of two structurally aligned token sequences"""
+    matcher = difflib.SequenceMatcher(None, [shape for shape, _ in stored], [shape for shape, _ in query],
+                                      autojunk=False)
+    renames: Dict[str, str] = {}
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            shape, old = stored[block.a + offset]
+            if shape == "ID":
+                renames.setdefault(old, query[block.b + offset][1])
+    return {old: new for old, new in renames.items() if old != new}
+
+
+def substitute_identifiers(code: str, analysis: Dict[str, Any], renames: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
+    """Rename identifiers in code and in the prose of an analysis, all at once so swaps work"""
+    if not renames:
+        return code, analysis
+    in_code = _rename_pattern(renames)
+    prose_renames = {old: new for old, new in renames.items() if old.lower() not in _ENGLISH_WORDS}
+    in_prose = _rename_pattern(prose_renames) if prose_renames else None
+
+    def prose(text: Any) -> Any:
+        if in_prose is None or not isinstance(text, str):
+            return text
+        return in_prose.sub(lambda match: prose_renames[match.group()], text)
+
+    explanations = []
+    for explanation in analysis.get("line_explanations", []):
+        adapted = {**explanation}
+        if isinstance(explanation.get("code"), str):
+            adapted["code"] = in_code.sub(lambda match: renames[match.group()], explanation["code"])
+        for field in _EXPLANATION_TEXT_FIELDS:
+            adapted[field] = prose(explanation.get(field))
+        explanations.append(adapted)
+    adapted_analysis = {
+        **analysis,
+        "line_explanations": explanations,
+        "misconceptions": [prose(item) for item in analysis.get("misconceptions", [])],
+        "quiz": [
+            {**question, "question": prose(question.get("question")), "answer": prose(question.get("answer"))}
+            for question in analysis.get("quiz", [])
+        ],
+    }
+    return in_code.sub(lambda match: renames[match.group()], code), adapted_analysis
+
+
+def _rename_pattern(renames: Dict[str, str]) -> "re.Pattern":
+    names = sorted(renames, key=len, reverse=True)
+    return re.compile(r"(?<![\w$])(?:" + "|".join(re.escape(name) for name in names) + r")(?![\w$])")
+
+
+class SimilarityIndex:
+    """MinHash/LSH index of past analyses, stored in SQLite"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_INDEX_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: int = 500000):
+        """
+        Args:
+            path: SQLite file, or None to keep the index in memory
+            threshold: Minimum estimated similarity for a match
+            max_entries: Oldest entries are dropped beyond this many
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, language TEXT NOT NULL, code TEXT NOT NULL, "
+            "analysis TEXT NOT NULL, signature BLOB NOT NULL, created REAL NOT NULL, "
+            "variant TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}
+        if "variant" not in columns:
+            # Indexes written before variants; their entries no longer match any lookup and age out
+            self._db.execute("ALTER TABLE entries ADD COLUMN variant TEXT NOT NULL DEFAULT ''")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "bucket INTEGER NOT NULL, entry INTEGER NOT NULL, PRIMARY KEY (bucket, entry)) WITHOUT ROWID"
+        )
+        self._bucket_query = " UNION ALL ".join(
+            ["SELECT * FROM (SELECT entry FROM buckets WHERE bucket = ? ORDER BY entry DESC LIMIT ?)"] * LSH_BANDS
+        )
+        self._lock = threading.Lock()
+
+    def add(self, code: str, language: str, analysis: Dict[str, Any], variant: str = "") -> None:
+        """
+        Index an analysis of code
+
+        Args:
+            code: The analyzed code
+            language: Programming language
+            analysis: Its analysis
+            variant: What else the analysis depends on (model tiers, prompt version); only
+                lookups for the same variant find it, as with the exact-match cache key
+        """
+        tokens = structural_tokens(code, language)
+        if len(tokens) < SHINGLE_SIZE:
+            return
+        signature = minhash_signature([shape for shape, _ in tokens])
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                entry = self._db.execute(
+                    "INSERT INTO entries (language, code, analysis, signature, created, variant) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (language, code, json.dumps(analysis), signature.tobytes(), time.time(), variant),
+                ).lastrowid
+                self._db.executemany(
+                    "INSERT INTO buckets (bucket, entry) VALUES (?, ?)",
+                    [(key, entry) for key in band_keys(signature, language, variant)],
+                )
+                if entry % 1000 == 0:
+                    self._evict()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def find(self, code: str, language: str, variant: str = "") -> Optional[Match]:
+        """Return the most similar stored analysis of the same variant above the threshold, or None"""
+        with metrics.span("similarity_lookup"):
+            tokens = structural_tokens(code, language)
+            if len(tokens) < SHINGLE_SIZE:
+                return None
+            signature = minhash_signature([shape for shape, _ in tokens])
+            keys = band_keys(signature, language, variant)
+            with self._lock:
+                hits = Counter(entry for entry, in self._db.execute(
+                    self._bucket_query, [value for key in keys for value in (key, BUCKET_READ_LIMIT)]
+                ))
+                best, best_similarity = None, self.threshold
+                for entry, _ in hits.most_common(MAX_CANDIDATES):
+                    stored = array("Q")
+                    row = self._db.execute(
+                        "SELECT signature FROM entries WHERE id = ? AND variant = ?", (entry, variant)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    stored.frombytes(row[0])
+                    similarity = sum(x == y for x, y in zip(stored, signature)) / NUM_PERMUTATIONS
+                    if similarity >= best_similarity:
+                        best, best_similarity = entry, similarity
+                if best is None:
+                    metrics.increment("similarity_lookups_total", result="miss")
+                    return None
+                stored_code, analysis = self._db.execute(
+                    "SELECT code, analysis FROM entries WHERE id = ?", (best,)
+                ).fetchone()
+        metrics.increment("similarity_lookups_total", result="hit")
+        renames = identifier_renames(structural_tokens(stored_code, language), tokens)
+        return Match(stored_code, json.loads(analysis), best_similarity, renames)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _evict(self) -> None:
+        """Drop the oldest entries over max_entries (transaction held)"""
+        overflow = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            newest_evicted = self._db.execute(
+                "SELECT id FROM entries ORDER BY id ASC LIMIT 1 OFFSET ?", (overflow - 1,)
+            ).fetchone()[0]
+            self._db.execute("DELETE FROM entries WHERE id <= ?", (newest_evicted,))
+            self._db.execute("DELETE FROM buckets WHERE entry <= ?", (newest_evicted,))
+
+
+_default_index: Optional[SimilarityIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index() -> Optional[SimilarityIndex]:
+    """Return the process-wide index configured from the environment, or None if disabled"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            path = os.getenv("SIMILARITY_INDEX_PATH", DEFAULT_INDEX_PATH)
+            if os.getenv("SIMILARITY_INDEX", "1") == "0":
+                return None
+            _default_index = SimilarityIndex(
+                path=path or None,
+                threshold=float(os.getenv("SIMILARITY_THRESHOLD", str(DEFAULT_THRESHOLD))),
+            )
+        return _default_index
@@ -0,0 +1,90 @@
+"""
+Single-flight - Coalesce identical concurrent calls into one
+The first caller for a key does the work; everyone else waits for its result
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import metrics
+
+
+class Flight:
+    """One in-progress call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """
+        Join the flight for a key, starting one if none is in progress
+
+        Returns:
+            (flight, leader) where leader is True if the caller must do the
+            work and then call resolve()
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                metrics.increment("coalesced_requests_total")
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def wait(self, flight: Flight) -> Any:
+        """Block until the leader resolves the flight; re-raise its error if it failed"""
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def resolve(self, key: str, flight: Flight, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Publish the leader's result (or error) to every waiter"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if not flight.done.is_set():
+            flight.result = result
+            flight.error = error
+            flight.done.set()
+
+    def do(self, key: str, function: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run function once for all concurrent callers with the same key
+
+        Args:
+            key: Deduplication key
+            function: Work to perform if no identical call is in flight
+
+        Returns:
+            (result, shared) where shared is True if the result came from
+            another caller's call
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight), True
+        try:
+            result = function()
+        except BaseException as e:
+            self.resolve(key, flight, error=e)
+            raise
+        self.resolve(key, flight, result=result)
+        return result, False
+
+    def in_flight(self) -> int:
+        """Number of keys currently being computed"""
+        with self._lock:
+            return len(self._flights)
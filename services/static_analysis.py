@@ -0,0 +1,389 @@
+"""
+Static Analysis - Deterministic pre-analysis that runs before the LLM
+Detects programming concepts, explains boilerplate lines from templates and
+summarizes the code's structure so the prompt can skip what is already known
+"""
+
+import ast
+import io
+import re
+import textwrap
+import tokenize
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .chunker import concept_key
+from .normalizer import iter_c_family_tokens, split_source_lines
+
+# Concept names match the snake_case vocabulary the model is shown in the prompt
+_KEYWORD_CONCEPTS = {
+    "for": "iteration", "while": "iteration", "do": "iteration",
+    "if": "conditionals", "elif": "conditionals", "else": "conditionals", "switch": "conditionals",
+    "case": "conditionals",
+    "class": "classes", "struct": "classes", "interface": "classes",
+    "def": "functions", "function": "functions", "return": "functions", "lambda": "functions",
+    "try": "exception_handling", "catch": "exception_handling", "except": "exception_handling",
+    "raise": "exception_handling", "throw": "exception_handling", "throws": "exception_handling",
+    "import": "modules", "include": "modules", "require": "modules",
+    "yield": "generators",
+    "async": "asynchronous_programming", "await": "asynchronous_programming",
+    "new": "objects",
+}
+
+_PYTHON_NON_CODE = {
+    tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER,
+}
+# Python 3.12 splits f-strings into start, middle and end tokens
+_PYTHON_STRINGS = {tokenize.STRING} | {
+    getattr(tokenize, name) for name in ("FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END") if hasattr(tokenize, name)
+}
+
+_IO_CALLS = {"print", "input", "printf", "scanf", "puts", "cout", "cin", "println", "log"}
+_C_CONTROL_WORDS = {"if", "for", "while", "switch", "catch", "return", "sizeof", "do", "else", "new", "typeof"}
+_CLOSING_ONLY = re.compile(r"^[\s\]\)\}]+[;,]?$")
+_IMPORT_LINE = re.compile(r"^\s*(import\s|from\s+\S+\s+import\s|#\s*include\b|using\s+namespace\s)")
+_JS_REQUIRE = re.compile(r"^\s*(const|let|var)\s+[\w{}\s,]+=\s*require\(")
+
+_TEMPLATES = {
+    "import": (
+        "Makes code from another module or library available in this file",
+        "The code below uses names that are defined elsewhere",
+        "Every use of the imported names fails because they are undefined",
+    ),
+    "package": (
+        "Declares which package this file belongs to",
+        "Packages group related files, and other code finds this file's names through its package",
+        "The file ends up in the wrong package and other code cannot find it",
+    ),
+    "closing": (
+        "Closes the block or bracket opened above",
+        "Every opening bracket needs a matching closing one to mark where the block ends",
+        "The code no longer compiles because the block is never closed",
+    ),
+    "pass": (
+        "Does nothing; it is a placeholder statement",
+        "Python needs at least one statement in a block, even an empty one",
+        "The block is empty, which is a syntax error",
+    ),
+    "comment": (
+        "A comment for human readers; it is not executed",
+        "Explains the code around it to whoever reads it next",
+        "Nothing changes when the program runs, but the code gets harder to understand",
+    ),
+    "main_guard": (
+        "Runs the code below only when this file is executed directly",
+        "Lets the file be imported as a module without running its script part",
+        "The script part also runs whenever another file imports this one",
+    ),
+}
+
+
+class StaticAnalysis:
+    """What local analysis already knows about a snippet"""
+
+    def __init__(self, concepts: List[str], boilerplate: Dict[int, Dict[str, Any]], structure: List[str]):
+        """
+        Args:
+            concepts: Concepts detected deterministically
+            boilerplate: Template explanations by line number
+            structure: One-line descriptions of functions, classes and loops
+        """
+        self.concepts = concepts
+        self.boilerplate = boilerplate
+        self.structure = structure
+
+    def summary(self) -> str:
+        """Compact description for the analysis prompt"""
+        parts = []
+        if self.structure:
+            parts.append("Structure:\n" + "\n".join(f"- {entry}" for entry in self.structure))
+        if self.concepts:
+            parts.append(f"Concepts already detected: {', '.join(self.concepts)}")
+        if self.boilerplate:
+            parts.append(f"Lines already explained: {format_lines(self.boilerplate)}")
+        return "\n".join(parts)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """(section, item) pairs known before the model answers"""
+        for line_number in sorted(self.boilerplate):
+            yield "line_explanations", self.boilerplate[line_number]
+        for concept in self.concepts:
+            yield "concepts", concept
+
+    def is_new(self, section: str, item: Any) -> bool:
+        """Whether a model-produced item adds to what items() already gave"""
+        if section == "line_explanations":
+            return item.get("line_number") not in self.boilerplate
+        if section == "concepts":
+            return concept_key(str(item)) not in {concept_key(concept) for concept in self.concepts}
+        return True
+
+    def apply(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge the static results into the model's analysis"""
+        explanations = list(self.boilerplate.values()) + [
+            explanation for explanation in analysis.get("line_explanations", [])
+            if self.is_new("line_explanations", explanation)
+        ]
+        explanations.sort(key=lambda explanation: explanation.get("line_number") or 0)
+        concepts = list(self.concepts) + [
+            concept for concept in analysis.get("concepts", []) if self.is_new("concepts", concept)
+        ]
+        return {**analysis, "line_explanations": explanations, "concepts": concepts}
+
+
+def analyze_static(code: str, language: str) -> StaticAnalysis:
+    """
+    Run the local pre-analysis
+
+    Args:
+        code: The code to analyze
+        language: Programming language
+
+    Returns:
+        Detected concepts, boilerplate explanations and structure
+    """
+    lines = split_source_lines(code)
+    if language == "python":
+        concepts, structure = _python_facts(code)
+        code_rows = _python_code_rows(code, lines)
+    else:
+        concepts, structure = _c_family_facts(code, language)
+        code_rows = _c_family_code_rows(code)
+
+    boilerplate = {}
+    for number, line in enumerate(lines, start=1):
+        kind = _boilerplate_kind(line, language, code_rows.get(number))
+        if kind:
+            what, why, breaks = _TEMPLATES[kind]
+            boilerplate[number] = {
+                "line_number": number,
+                "code": line.strip(),
+                "what_it_does": what,
+                "why_it_exists": why,
+                "what_breaks": breaks,
+            }
+    return StaticAnalysis(concepts, boilerplate, structure)
+
+
+def _boilerplate_kind(line: str, language: str, starts_code: Optional[bool]) -> Optional[str]:
+    """
+    Template that explains a line completely, if any
+
+    Args:
+        line: The source line
+        language: Programming language
+        starts_code: None for a line with no code, False when its code continues
+            a token from an earlier line (such as a multi-line string), True otherwise
+    """
+    stripped = line.strip()
+    if not stripped:
+        return None
+    if starts_code is None:
+        return "comment"
+    if not starts_code:
+        # The line's text belongs to a string, so it only looks like an import or a closing bracket
+        return None
+    if stripped.startswith("package ") and language in ("java", "go"):
+        return "package"
+    if _IMPORT_LINE.match(line) or (language == "javascript" and _JS_REQUIRE.match(line)):
+        return "import"
+    if _CLOSING_ONLY.match(stripped):
+        return "closing"
+    if language == "python":
+        if stripped == "pass":
+            return "pass"
+        if re.match(r"""^if\s+__name__\s*==\s*['"]__main__['"]\s*:$""", stripped):
+            return "main_guard"
+    return None
+
+
+def _python_code_rows(code: str, lines: List[str]) -> Dict[int, bool]:
+    """
+    Lines holding something other than a comment, including every line of a multi-line string
+
+    Each line maps to whether its first token starts on it and is not a string.
+    """
+    rows: Dict[int, bool] = {}
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type in _PYTHON_NON_CODE:
+                continue
+            for row in range(token.start[0], token.end[0] + 1):
+                rows.setdefault(row, row == token.start[0] and token.type not in _PYTHON_STRINGS)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return {number: True for number, line in enumerate(lines, start=1) if not line.strip().startswith("#")}
+    return rows
+
+
+def _c_family_code_rows(code: str) -> Dict[int, bool]:
+    """
+    Lines holding something other than a comment, including every line of a multi-line string or template literal
+
+    Each line maps to whether its first token starts on it and is not a string.
+    """
+    rows: Dict[int, bool] = {}
+    # The tokenizer already tells comments from strings across lines; a token covers every row it spans
+    for kind, text, row in iter_c_family_tokens(code):
+        for spanned in range(row, row + text.count("\n") + 1):
+            rows.setdefault(spanned, spanned == row and kind != "string")
+    return rows
+
+
+def _python_facts(code: str) -> Tuple[List[str], List[str]]:
+    """Concepts and structure of Python code from its AST"""
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        # Excerpts of a larger file do not always parse on their own
+        return _keyword_concepts(re.findall(r"[A-Za-z_]\w*", code)), []
+
+    concepts: List[str] = []
+    structure: List[str] = []
+    loops: List[int] = []
+
+    def add(concept: str) -> None:
+        if concept not in concepts:
+            concepts.append(concept)
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            add("functions")
+            recursive = any(
+                isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == node.name
+                for call in ast.walk(node)
+            )
+            if recursive:
+                add("recursion")
+            if isinstance(node, ast.AsyncFunctionDef):
+                add("asynchronous_programming")
+            args = ", ".join(arg.arg for arg in node.args.args)
+            structure.append(
+                f"function {node.name}({args}), lines {node.lineno}-{node.end_lineno}"
+                + (", recursive" if recursive else "")
+            )
+        elif isinstance(node, ast.ClassDef):
+            add("classes")
+            structure.append(f"class {node.name}, lines {node.lineno}-{node.end_lineno}")
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            add("iteration")
+            loops.append(node.lineno)
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            add("iteration")
+            add("data_structures")
+        elif isinstance(node, (ast.If, ast.IfExp)):
+            add("conditionals")
+        elif isinstance(node, (ast.Try, ast.Raise)):
+            add("exception_handling")
+        elif isinstance(node, (ast.List, ast.Dict, ast.Set)):
+            add("data_structures")
+        elif isinstance(node, (ast.Yield, ast.YieldFrom)):
+            add("generators")
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            add("modules")
+        elif isinstance(node, ast.Lambda):
+            add("functions")
+        elif isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            add("variables")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _IO_CALLS:
+            add("input_output")
+
+    if loops:
+        structure.append(f"loops on lines {format_lines(loops)}")
+    return concepts, structure
+
+
+def _c_family_facts(code: str, language: str) -> Tuple[List[str], List[str]]:
+    """Concepts and structure of C/C++/Java/JavaScript code from its tokens"""
+    tokens = list(iter_c_family_tokens(code))
+    concepts = _keyword_concepts(text for kind, text, _ in tokens if kind == "word")
+    structure: List[str] = []
+    loops: List[int] = []
+
+    def add(concept: str) -> None:
+        if concept not in concepts:
+            concepts.append(concept)
+
+    depth = 0
+    functions: List[Tuple[str, int, int]] = []
+    open_function: Optional[Tuple[str, int, int]] = None
+    for index, (kind, text, row) in enumerate(tokens):
+        if kind == "word" and text in ("for", "while"):
+            loops.append(row)
+        elif kind == "word" and text in _IO_CALLS:
+            add("input_output")
+        elif text in ("->", "malloc", "free") and language in ("c", "cpp"):
+            add("pointers")
+        elif text == "[":
+            add("arrays")
+        elif text == "=>":
+            add("functions")
+        elif text == "{":
+            name = _function_name(tokens, index)
+            if name and open_function is None:
+                open_function = (name, row, depth)
+            depth += 1
+        elif text == "}":
+            depth -= 1
+            if open_function is not None and depth == open_function[2]:
+                functions.append((open_function[0], open_function[1], row))
+                open_function = None
+
+    for name, start, end in functions:
+        add("functions")
+        body = [text for kind, text, row in tokens if start < row <= end and kind == "word"]
+        recursive = name in body
+        if recursive:
+            add("recursion")
+        structure.append(f"function {name}, lines {start}-{end}" + (", recursive" if recursive else ""))
+    if loops:
+        structure.append(f"loops on lines {format_lines(loops)}")
+    return concepts, structure
+
+
+def _function_name(tokens: List[Tuple[str, str, int]], brace: int) -> Optional[str]:
+    """Name of the function whose body starts at tokens[brace], if it is one"""
+    index = brace - 1
+    # Skip a Java throws clause or C++ qualifiers between ")" and "{"
+    while index >= 0 and tokens[index][0] == "word" and tokens[index][1] in ("const", "throws", "noexcept", "override"):
+        index -= 1
+    while index >= 1 and tokens[index][0] == "word" and tokens[index - 1][1] in ("throws", ","):
+        index -= 2
+    if index < 0 or tokens[index][1] != ")":
+        return None
+    depth = 0
+    while index >= 0:
+        text = tokens[index][1]
+        if text == ")":
+            depth += 1
+        elif text == "(":
+            depth -= 1
+            if depth == 0:
+                break
+        index -= 1
+    if index < 1:
+        return None
+    kind, name, _ = tokens[index - 1]
+    if kind != "word" or name in _C_CONTROL_WORDS:
+        return None
+    return name
+
+
+def _keyword_concepts(words) -> List[str]:
+    """Concepts implied by the keywords present"""
+    concepts: List[str] = []
+    for word in words:
+        concept = _KEYWORD_CONCEPTS.get(word)
+        if concept and concept not in concepts:
+            concepts.append(concept)
+    return concepts
+
+
+def format_lines(lines) -> str:
+    """Compact line list such as "1-3, 7, 9-10" """
+    numbers = sorted(set(lines))
+    ranges: List[List[int]] = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
@@ -0,0 +1,335 @@
+"""
+Cache Stores - The shared tier behind each process's in-memory cache
+Every worker on a host can open the same SQLite file (WAL mode, so readers
+never block the writer), and workers on several hosts can share a Redis
+server, spoken to over its wire protocol without a client library. Both
+hold encoded analyses plus short-lived claims, which let one worker
+compute a missing entry while the others wait for it
+"""
+
+import abc
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+# Key prefixes in Redis, which may be shared with other applications
+_REDIS_VALUE_PREFIX = "code-explainer:analysis:"
+_REDIS_CLAIM_PREFIX = "code-explainer:claim:"
+# A hit records its access time only when the stored one is older than this, so most reads never write;
+# eviction order is that coarse
+ACCESS_TOUCH_SECONDS = 300
+# Deletes a claim only if this worker still holds it
+REDIS_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+class CacheStore(abc.ABC):
+    """Shared key-value tier with TTL eviction and per-key claims"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """(encoded value, created) of a live entry, or None"""
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, now: float) -> int:
+        """Store an entry; returns how many entries were evicted to make room"""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove an entry if present"""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Remove every entry"""
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        """Number of stored entries"""
+
+    @abc.abstractmethod
+    def claim(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        """Atomically take the claim on key unless another owner holds a live one"""
+
+    @abc.abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """Drop owner's claim on key"""
+
+    @abc.abstractmethod
+    def is_claimed(self, key: str) -> bool:
+        """Whether any owner holds a live claim on key"""
+
+
+class SQLiteStore(CacheStore):
+    """Store in a SQLite file that every process on the host can open"""
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl_seconds: float = 7 * 24 * 60 * 60):
+        """
+        Args:
+            path: SQLite file
+            max_entries: Rows kept before the least recently used are evicted
+            ttl_seconds: Age after which rows are treated as expired
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Writers from other processes wait for the lock instead of failing at once
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_accessed ON analyses (accessed)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created, accessed FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                return None
+            if now - row[2] > ACCESS_TOUCH_SECONDS:
+                # Every replica reads this file; a write per hit would serialize them on the write lock
+                self._db.execute("UPDATE analyses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0], row[1]
+
+    def set(self, key: str, value: bytes, now: float) -> int:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            return self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM analyses")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def claim(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            # One statement, so two processes can never both see the claim as free
+            claimed = self._db.execute(
+                "INSERT INTO claims (key, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE claims.expires < ?",
+                (key, owner, now + ttl_seconds, now),
+            ).rowcount
+        return claimed == 1
+
+    def release(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def is_claimed(self, key: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM claims WHERE key = ? AND expires >= ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def _evict(self, now: float) -> int:
+        """Remove expired rows, then the least recently used rows over the size limit (lock held)"""
+        expired = self._db.execute(
+            "DELETE FROM analyses WHERE created < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        overflow = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM analyses WHERE key IN "
+                "(SELECT key FROM analyses ORDER BY accessed ASC LIMIT ?)",
+                (overflow,),
+            )
+        self._db.execute("DELETE FROM claims WHERE expires < ?", (now,))
+        return max(expired, 0) + max(overflow, 0)
+
+
+class RedisStore(CacheStore):
+    """Store on a Redis server (or anything speaking its protocol) shared across hosts"""
+
+    def __init__(self, url: str, ttl_seconds: float = 7 * 24 * 60 * 60, timeout: float = 10.0):
+        """
+        Args:
+            url: redis://[:password@]host[:port][/db], rediss:// for TLS
+            ttl_seconds: Expiry set on every entry; size is bounded by the server's maxmemory policy
+            timeout: Socket timeout in seconds
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise ValueError(f"Unsupported cache URL: {url}")
+        self.ttl_seconds = ttl_seconds
+        self._address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self._tls = parsed.scheme == "rediss"
+        self._password = unquote(parsed.password) if parsed.password else None
+        self._username = unquote(parsed.username) if parsed.username else None
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        value, remaining = self._call(("GET", _REDIS_VALUE_PREFIX + key), ("TTL", _REDIS_VALUE_PREFIX + key))
+        if value is None:
+            return None
+        # Redis tracks expiry rather than creation; recover the creation time from it
+        return value, time.time() - (self.ttl_seconds - max(remaining, 0))
+
+    def set(self, key: str, value: bytes, now: float) -> int:
+        self._call(("SET", _REDIS_VALUE_PREFIX + key, value, "EX", max(1, int(self.ttl_seconds))))
+        return 0
+
+    def delete(self, key: str) -> None:
+        self._call(("DEL", _REDIS_VALUE_PREFIX + key))
+
+    def clear(self) -> None:
+        for keys in self._scan(_REDIS_VALUE_PREFIX + "*"):
+            if keys:
+                self._call(("DEL", *keys))
+
+    def count(self) -> int:
+        return sum(len(keys) for keys in self._scan(_REDIS_VALUE_PREFIX + "*"))
+
+    def claim(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        reply, = self._call(("SET", _REDIS_CLAIM_PREFIX + key, owner, "NX", "PX", max(1, int(ttl_seconds * 1000))))
+        return reply is not None
+
+    def release(self, key: str, owner: str) -> None:
+        self._call(("EVAL", REDIS_RELEASE_SCRIPT, 1, _REDIS_CLAIM_PREFIX + key, owner))
+
+    def is_claimed(self, key: str) -> bool:
+        reply, = self._call(("EXISTS", _REDIS_CLAIM_PREFIX + key))
+        return bool(reply)
+
+    def _scan(self, pattern: str) -> Iterator[List[bytes]]:
+        cursor = b"0"
+        while True:
+            (cursor, keys), = self._call(("SCAN", cursor, "MATCH", pattern, "COUNT", 1000))
+            yield keys
+            if cursor == b"0":
+                return
+
+    def _call(self, *commands: Sequence[Any]) -> List[Any]:
+        """Send commands in one pipeline and return their replies; reconnects once on a dropped connection"""
+        payload = b"".join(_encode_command(command) for command in commands)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    self._socket.sendall(payload)
+                    replies = [_read_reply(self._reader) for _ in commands]
+                    break
+                except (OSError, EOFError):
+                    self._disconnect()
+                    if attempt:
+                        raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _connect(self) -> None:
+        """Open the connection and authenticate (lock held)"""
+        sock = socket.create_connection(self._address, timeout=self._timeout)
+        if self._tls:
+            import ssl
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self._address[0])
+        self._socket, self._reader = sock, sock.makefile("rb")
+        setup = []
+        if self._password is not None:
+            setup.append(("AUTH", self._username, self._password) if self._username else ("AUTH", self._password))
+        if self._db:
+            setup.append(("SELECT", self._db))
+        if setup:
+            self._socket.sendall(b"".join(_encode_command(command) for command in setup))
+            for _ in setup:
+                reply = _read_reply(self._reader)
+                if isinstance(reply, RedisError):
+                    self._disconnect()
+                    raise reply
+
+    def _disconnect(self) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = self._reader = None
+
+
+class RedisError(RuntimeError):
+    """Error reply from a Redis server"""
+
+
+def _encode_command(command: Sequence[Any]) -> bytes:
+    """Encode a command as a RESP array of bulk strings"""
+    parts = [b"*%d\r\n" % len(command)]
+    for argument in command:
+        if not isinstance(argument, bytes):
+            argument = str(argument).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(argument), argument))
+    return b"".join(parts)
+
+
+def _read_reply(reader: Any) -> Any:
+    """Read one RESP reply; error replies are returned as RedisError rather than raised"""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise EOFError("Connection closed by the cache server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body
+    if kind == b"-":
+        return RedisError(body.decode("utf-8", "replace"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise EOFError("Connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise RedisError(f"Unexpected reply from the cache server: {line[:40]!r}")
+
+
+def open_store(location: str, max_entries: int, ttl_seconds: float) -> CacheStore:
+    """
+    Open the store at a SQLite path or a redis:// URL
+
+    Args:
+        location: File path, or redis:// / rediss:// URL
+        max_entries: Entries kept in a SQLite store
+        ttl_seconds: Entry expiry
+    """
+    if location.startswith(("redis://", "rediss://")):
+        return RedisStore(location, ttl_seconds=ttl_seconds)
+    return SQLiteStore(location, max_entries=max_entries, ttl_seconds=ttl_seconds)
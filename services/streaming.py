@@ -0,0 +1,147 @@
+"""
+Streaming support - Incremental parsing of the analysis JSON
+Yields each list item as soon as its closing bracket/quote arrives
+"""
+
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ANALYSIS_SECTIONS = ["line_explanations", "concepts", "misconceptions", "quiz"]
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for a JSON object whose values are lists
+
+    Text is fed in arbitrary chunks; every element of a top-level list
+    is returned as (key, element) once it is complete. Only the text of the
+    element currently being read is kept for decoding. The keys of lists
+    whose closing bracket has been read are collected in `closed`, and the
+    key of every element that did not decode (and was skipped) in `dropped`.
+    """
+
+    def __init__(self):
+        """Initialize the parser state"""
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars: List[str] = []
+        self._last_key: Optional[str] = None
+        self._array_key: Optional[str] = None
+        self._element: Optional[List[str]] = None
+        self._element_is_scalar = False
+        self.closed: List[str] = []
+        self.dropped: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consume a chunk of text
+
+        Args:
+            chunk: Next piece of the JSON document
+
+        Returns:
+            (key, element) pairs completed by this chunk
+        """
+        completed = []
+        for char in chunk:
+            item = self._consume(char)
+            if item is not None:
+                completed.append(item)
+        return completed
+
+    def _consume(self, char: str) -> Optional[Tuple[str, Any]]:
+        """Advance the state machine by one character"""
+        if self._element is not None:
+            self._element.append(char)
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    self._last_key = "".join(self._string_chars)
+                elif self._depth == 2 and self._element is not None and self._element_is_scalar:
+                    return self._finish_element(len(self._element))
+            elif self._depth == 1:
+                self._string_chars.append(char)
+            return None
+
+        if self._depth == 2 and self._array_key is not None and self._element is None:
+            # Between elements of a top-level list
+            if char in " \t\r\n,":
+                return None
+            if char == "]":
+                self._close_array()
+                return None
+            self._element = [char]
+            self._element_is_scalar = char not in "{["
+
+        if self._element is not None and self._element_is_scalar and self._depth == 2 and char in ",]":
+            item = self._finish_element(len(self._element) - 1)
+            if char == "]":
+                self._close_array()
+            return item
+
+        if char == '"':
+            self._in_string = True
+            self._string_chars = []
+        elif char in "{[":
+            self._depth += 1
+            if self._depth == 2 and char == "[":
+                self._array_key = self._last_key
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 2 and self._element is not None:
+                return self._finish_element(len(self._element))
+        return None
+
+    def _close_array(self) -> None:
+        """Leave a top-level list"""
+        self.closed.append(self._array_key)
+        self._depth = 1
+        self._array_key = None
+
+    def _finish_element(self, end: int) -> Optional[Tuple[str, Any]]:
+        """Decode the buffered element and reset for the next one"""
+        text = "".join(self._element[:end]).strip()
+        self._element = None
+        try:
+            return self._array_key, json.loads(text)
+        except json.JSONDecodeError:
+            self.dropped.append(self._array_key)
+            return None
+
+
+def iter_analysis_items(analysis: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """Yield (section, item) pairs of a complete analysis in streaming order"""
+    for section in ANALYSIS_SECTIONS:
+        for item in analysis.get(section, []):
+            yield section, item
+
+
+def recover_analysis(content: str) -> Tuple[Dict[str, List[Any]], List[str]]:
+    """
+    Salvage what is complete in a truncated or slightly malformed analysis
+
+    Items cut off midway and items that do not decode are dropped; a
+    response cut off at max_tokens thus keeps everything before the cut.
+
+    Args:
+        content: Model output that json.loads rejected
+
+    Returns:
+        The complete items of each of ANALYSIS_SECTIONS, and the sections
+        nothing is missing from: their list was closed and every item decoded
+    """
+    parser = IncrementalJSONParser()
+    recovered: Dict[str, List[Any]] = {section: [] for section in ANALYSIS_SECTIONS}
+    for section, item in parser.feed(content):
+        if section in recovered:
+            recovered[section].append(item)
+    return recovered, [
+        section for section in parser.closed if section in recovered and section not in parser.dropped
+    ]
@@ -0,0 +1,151 @@
+"""
+Tests for CodeAnalyzer request coalescing, cached results and truncated responses
+Runs on the synthetic backend, so no API key or network is needed
+"""
+
+import threading
+import time
+import unittest
+
+from services.analyzer import CodeAnalyzer
+from services.backends import Completion, SyntheticBackend
+from services.cache import AnalysisCache
+from services.llm import LLMClient
+
+CODE = "def total(values):\n    result = sum(values)\n    return result * 2\n"
+STEPS = "".join(f"step_{number} = {number}\n" for number in range(1, 7))
+COMMENTED = "# totals\ndef total(values):\n\n    # add them up\n    result = sum(values)\n    return result * 2\n"
+
+
+class DamagedBackend(SyntheticBackend):
+    """Synthetic backend whose first response is passed through `damage`"""
+
+    def __init__(self, damage):
+        super().__init__(seed=1)
+        self.damage = damage
+        self.prompts = []
+
+    def _build(self, request):
+        completion = super()._build(request)
+        self.prompts.append(request["messages"][-1]["content"])
+        if len(self.prompts) == 1:
+            return Completion(self.damage(completion.content), completion.prompt_tokens, completion.completion_tokens)
+        return completion
+
+
+def make_analyzer(backend=None) -> CodeAnalyzer:
+    """An analyzer whose one LLM call stays in flight long enough for a second request to join it"""
+    return CodeAnalyzer(
+        cache=AnalysisCache(path=None),
+        llm_client=LLMClient(backend=backend or SyntheticBackend(latency="fixed:0.3", seed=1)),
+        incremental=False,
+        near_duplicates=False,
+        precomputed=False,
+    )
+
+
+def run_overlapping(first, second):
+    """Start `first`, then `second` while it is in flight; return both results or raise the first error"""
+    results, errors = {}, []
+
+    def call(name, function):
+        try:
+            results[name] = function()
+        except Exception as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=("first", first))
+    leader.start()
+    time.sleep(0.1)
+    follower = threading.Thread(target=call, args=("second", second))
+    follower.start()
+    leader.join()
+    follower.join()
+    if errors:
+        raise errors[0]
+    return results["first"], results["second"]
+
+
+class CoalescingTest(unittest.TestCase):
+
+    def test_plain_follower_of_streamed_request(self):
+        analyzer = make_analyzer()
+        streamed, plain = run_overlapping(
+            lambda: list(analyzer.analyze_code_stream(CODE, "python"))[-1][1],
+            lambda: analyzer.analyze_code(CODE, "python"),
+        )
+        self.assertEqual(plain, streamed)
+        self.assertEqual(analyzer.llm_client.usage_stats()["requests"], 1)
+
+    def test_streamed_follower_of_plain_request(self):
+        analyzer = make_analyzer()
+        plain, streamed = run_overlapping(
+            lambda: analyzer.analyze_code(CODE, "python"),
+            lambda: list(analyzer.analyze_code_stream(CODE, "python"))[-1][1],
+        )
+        self.assertEqual(streamed, plain)
+        self.assertEqual(analyzer.llm_client.usage_stats()["requests"], 1)
+
+
+class CachedResultsTest(unittest.TestCase):
+
+    def test_cache_hit_matches_fresh_analysis(self):
+        analyzer = make_analyzer()
+        fresh = analyzer.analyze_code(COMMENTED, "python")
+        self.assertEqual([e["line_number"] for e in fresh["line_explanations"]], [1, 2, 4, 5, 6])
+        self.assertEqual(analyzer.analyze_code(COMMENTED, "python"), fresh)
+        self.assertEqual(list(analyzer.analyze_code_stream(COMMENTED, "python"))[-1][1], fresh)
+        self.assertEqual(analyzer.llm_client.usage_stats()["requests"], 1)
+
+    def test_variant_hit_explains_its_own_comments(self):
+        analyzer = make_analyzer()
+        analyzer.analyze_code(CODE, "python")
+        variant = analyzer.analyze_code(COMMENTED, "python")
+        self.assertEqual([e["line_number"] for e in variant["line_explanations"]], [1, 2, 4, 5, 6])
+        self.assertEqual(variant["line_explanations"][2]["code"], "# add them up")
+        self.assertEqual(analyzer.llm_client.usage_stats()["requests"], 1)
+
+    def test_coalesced_follower_matches_leader(self):
+        analyzer = make_analyzer()
+        first, second = run_overlapping(
+            lambda: analyzer.analyze_code(COMMENTED, "python"),
+            lambda: analyzer.analyze_code(COMMENTED, "python"),
+        )
+        self.assertEqual(second, first)
+
+
+class TruncatedResponseTest(unittest.TestCase):
+
+    def assert_every_line_once(self, analysis):
+        self.assertEqual([e["line_number"] for e in analysis["line_explanations"]], [1, 2, 3, 4, 5, 6])
+
+    def test_cut_off_response_continues_from_the_first_missing_line(self):
+        backend = DamagedBackend(lambda content: content[:content.index('"line_number": 4') + 10])
+        self.assert_every_line_once(make_analyzer(backend).analyze_code(STEPS, "python"))
+        self.assertEqual(len(backend.prompts), 2)
+        self.assertIn("lines 4-6 of a 7-line python snippet", backend.prompts[1])
+
+    def test_malformed_middle_item_is_asked_for_again(self):
+        backend = DamagedBackend(lambda content: content.replace('"line_number": 2,', '"line_number": 2,,'))
+        self.assert_every_line_once(make_analyzer(backend).analyze_code(STEPS, "python"))
+        self.assertEqual(len(backend.prompts), 2)
+        self.assertIn("lines 2-2 of a 7-line python snippet", backend.prompts[1])
+
+    def test_streamed_response_with_malformed_and_cut_off_items(self):
+        def damage(content):
+            content = content.replace('"line_number": 2,', '"line_number": 2,,')
+            return content[:content.index('"line_number": 5') + 10]
+        backend = DamagedBackend(damage)
+        analysis = list(make_analyzer(backend).analyze_code_stream(STEPS, "python"))[-1][1]
+        self.assert_every_line_once(analysis)
+        self.assertEqual(len(backend.prompts), 3)
+
+    def test_response_cut_off_before_any_line_is_retried_in_full(self):
+        backend = DamagedBackend(lambda content: content[:20])
+        self.assert_every_line_once(make_analyzer(backend).analyze_code(STEPS, "python"))
+        self.assertEqual(len(backend.prompts), 2)
+        self.assertNotIn("This excerpt is", backend.prompts[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Tests for precomputed analysis bundles
+Lookups in the memory-mapped index, and deferred sections served from it
+without any LLM request
+"""
+
+import os
+import tempfile
+import unittest
+
+from services.analyzer import CodeAnalyzer
+from services.backends import SyntheticBackend
+from services.bundle import AnalysisBundle, BundleWriter
+from services.cache import AnalysisCache
+from services.llm import DEFERRED_SECTIONS, LLMClient
+from services.normalizer import canonicalize
+
+CODE = "def total(values):\n    result = sum(values)\n    return result\n"
+VARIANT = "# sums\ndef total( values ):\n    result=sum(values)\n    return result\n"
+
+
+def analysis_of(code: str, tag: str) -> dict:
+    """A complete analysis whose every text names `tag`"""
+    return {
+        "line_explanations": [
+            {"line_number": number, "code": line.strip(), "what_it_does": f"{tag} {number}",
+             "why_it_exists": tag, "what_breaks": tag}
+            for number, line in enumerate(code.split("\n"), start=1) if line.strip()
+        ],
+        "concepts": ["functions", "variables"],
+        "misconceptions": [f"{tag} misconception"],
+        "quiz": [{"question": f"{tag}?", "answer": tag, "concept": "functions"}],
+    }
+
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "course.bundle")
+
+    def write(self, snippets, metadata=None) -> AnalysisBundle:
+        writer = BundleWriter(metadata)
+        for code, analysis in snippets:
+            writer.add(code, "python", analysis)
+        writer.write(self.path)
+        bundle = AnalysisBundle(self.path)
+        self.addCleanup(bundle.close)
+        return bundle
+
+    def test_every_entry_is_found_and_others_are_not(self):
+        snippets = [(f"value_{index} = {index}\n", analysis_of(f"value_{index} = {index}\n", f"entry {index}"))
+                    for index in range(300)]
+        bundle = self.write(snippets, {"model": "m"})
+        self.assertEqual(len(bundle), 300)
+        self.assertEqual(bundle.metadata["model"], "m")
+        for code, analysis in snippets:
+            found = bundle.get(canonicalize(code, "python"))
+            self.assertEqual(found["misconceptions"], analysis["misconceptions"])
+        self.assertIsNone(bundle.get(canonicalize("value_300 = 300\n", "python")))
+
+    def test_variants_share_an_entry(self):
+        bundle = self.write([(CODE, analysis_of(CODE, "course"))])
+        found = bundle.get(canonicalize(VARIANT, "python"))
+        self.assertEqual([e["line_number"] for e in found["line_explanations"]], [1, 2, 3])
+
+    def test_a_later_analysis_of_the_same_code_replaces_the_earlier(self):
+        bundle = self.write([(CODE, analysis_of(CODE, "old")), (VARIANT, analysis_of(VARIANT, "new"))])
+        self.assertEqual(len(bundle), 1)
+        self.assertEqual(bundle.get(canonicalize(CODE, "python"))["misconceptions"], ["new misconception"])
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a bundle at all, just some bytes")
+        with self.assertRaises(ValueError):
+            AnalysisBundle(self.path)
+
+
+class BundledAnalyzerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "course.bundle")
+        writer = BundleWriter()
+        writer.add(CODE, "python", analysis_of(CODE, "course"))
+        writer.write(path)
+        bundle = AnalysisBundle(path)
+        self.addCleanup(bundle.close)
+        self.analyzer = CodeAnalyzer(
+            cache=AnalysisCache(path=None),
+            llm_client=LLMClient(backend=SyntheticBackend(seed=1)),
+            near_duplicates=False,
+            bundle=bundle,
+        )
+
+    def test_bundled_snippet_needs_no_request(self):
+        analysis = self.analyzer.analyze_code(VARIANT, "python", sections=DEFERRED_SECTIONS)
+        self.assertEqual([e["line_number"] for e in analysis["line_explanations"]], [1, 2, 3, 4])
+        self.assertEqual(analysis["line_explanations"][1]["what_it_does"], "course 1")
+        self.assertEqual(analysis["quiz"][0]["question"], "course?")
+        self.assertTrue(self.analyzer.is_precomputed(VARIANT, "python"))
+        self.assertEqual(self.analyzer.estimate_tokens(VARIANT, "python", DEFERRED_SECTIONS), 0)
+        self.assertEqual(self.analyzer.llm_client.usage_stats()["requests"], 0)
+
+    def test_deferred_sections_come_from_the_bundle(self):
+        for section in DEFERRED_SECTIONS:
+            self.assertEqual(self.analyzer.analyze_section(VARIANT, "python", section),
+                             analysis_of(CODE, "course")[section])
+        self.assertEqual(self.analyzer.llm_client.usage_stats()["requests"], 0)
+
+    def test_other_snippets_go_to_the_model(self):
+        self.analyzer.analyze_section("print('hello')\n", "python", "quiz")
+        self.assertFalse(self.analyzer.is_precomputed("print('hello')\n", "python"))
+        self.assertEqual(self.analyzer.llm_client.usage_stats()["requests"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
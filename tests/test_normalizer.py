@@ -0,0 +1,59 @@
+"""
+Tests for canonical snippets and their line mapping
+Variants differing in whitespace or comments share a canonical form, and
+explanations are renumbered between each variant's lines and the canonical ones
+"""
+
+import unittest
+
+from services.normalizer import canonicalize
+
+PYTHON = "def total(values):\n    result = sum(values)\n    return result\n"
+PYTHON_VARIANT = "# sums\ndef total( values ):\n\n    result=sum(values)  # add\n    return result\n"
+
+
+class CanonicalFormTest(unittest.TestCase):
+
+    def test_whitespace_and_comments_do_not_matter(self):
+        self.assertEqual(canonicalize(PYTHON, "python").fingerprint,
+                         canonicalize(PYTHON_VARIANT, "python").fingerprint)
+
+    def test_indentation_and_language_do_matter(self):
+        flat = "def total(values):\n    result = sum(values)\nreturn result\n"
+        self.assertNotEqual(canonicalize(PYTHON, "python").fingerprint, canonicalize(flat, "python").fingerprint)
+        self.assertNotEqual(canonicalize("x = 1", "python").fingerprint,
+                            canonicalize("x = 1", "javascript").fingerprint)
+
+    def test_c_family_comments_spanning_lines(self):
+        plain = "int f() {\n  return 1;\n}\n"
+        commented = "/* header\n   comment */\nint f()   {\n  return 1; // one\n}\n"
+        self.assertEqual(canonicalize(plain, "c").fingerprint, canonicalize(commented, "c").fingerprint)
+        self.assertEqual(canonicalize(commented, "c").line_map, [3, 4, 5])
+
+
+class LineMappingTest(unittest.TestCase):
+
+    def test_source_and_canonical_lines_map_both_ways(self):
+        canonical = canonicalize(PYTHON_VARIANT, "python")
+        self.assertEqual(canonical.line_map, [2, 4, 5])
+        self.assertEqual([canonical.to_canonical(line) for line in range(1, 6)], [None, 1, None, 2, 3])
+        self.assertEqual([canonical.to_source(line) for line in (1, 2, 3, 4)], [2, 4, 5, None])
+
+    def test_analysis_is_renumbered_onto_another_variant(self):
+        variant = canonicalize(PYTHON_VARIANT, "python")
+        analysis = {"line_explanations": [{"line_number": number, "what_it_does": f"line {number}"}
+                                          for number in range(1, 6)]}
+        stored = variant.to_canonical_analysis(analysis)
+        # Comment and blank lines have no canonical counterpart
+        self.assertEqual([(e["line_number"], e["what_it_does"]) for e in stored["line_explanations"]],
+                         [(1, "line 2"), (2, "line 4"), (3, "line 5")])
+        original = canonicalize(PYTHON, "python")
+        self.assertEqual([original.to_source(e["line_number"]) for e in stored["line_explanations"]], [1, 2, 3])
+
+    def test_code_that_does_not_tokenize_keeps_its_lines(self):
+        canonical = canonicalize("def broken(:\n\n    return '\n", "python")
+        self.assertEqual(canonical.line_map, [1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
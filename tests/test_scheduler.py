@@ -0,0 +1,111 @@
+"""
+Tests for the rate-limit aware RequestScheduler
+Token-bucket refill, retry backoff and weighted fair queueing across sessions
+"""
+
+import threading
+import time
+import unittest
+
+from services.backends import BackendError
+from services.scheduler import RequestScheduler, TokenBucket, parse_duration, session_scope
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refills_continuously_up_to_capacity(self):
+        bucket = TokenBucket(capacity=10, refill_per_second=2)
+        bucket.spend(10, now=bucket.updated)
+        self.assertAlmostEqual(bucket.available(bucket.updated + 2.5), 5)
+        self.assertAlmostEqual(bucket.wait_time(4, bucket.updated), 2.0)
+        self.assertEqual(bucket.available(bucket.updated + 100), 10)
+
+    def test_overspending_delays_later_requests(self):
+        bucket = TokenBucket(capacity=10, refill_per_second=1)
+        bucket.spend(14, now=bucket.updated)
+        self.assertAlmostEqual(bucket.wait_time(1, bucket.updated), 5.0)
+
+    def test_unknown_capacity_is_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.wait_time(10 ** 9, time.monotonic()), 0.0)
+
+    def test_observe_takes_refill_rate_from_reset_time(self):
+        bucket = TokenBucket()
+        bucket.observe(limit=60, remaining=30, reset_seconds=15, now=0.0)
+        self.assertEqual(bucket.capacity, 60)
+        self.assertAlmostEqual(bucket.refill_per_second, 2.0)
+        self.assertAlmostEqual(bucket.available(5.0), 40)
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("6m0s"), 360.0)
+        self.assertAlmostEqual(parse_duration("20ms"), 0.02)
+        self.assertIsNone(parse_duration("soon"))
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_retryable_errors_back_off_exponentially_until_max_retries(self):
+        scheduler = RequestScheduler(max_retries=3, base_delay=0.5, seed=1)
+        error = BackendError("unavailable", status_code=503)
+        for attempt in range(3):
+            delay = scheduler.backoff(attempt, error)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, 0.5 * 2 ** attempt)
+        self.assertIsNone(scheduler.backoff(3, error))
+
+    def test_client_errors_are_not_retried(self):
+        scheduler = RequestScheduler(seed=1)
+        self.assertIsNone(scheduler.backoff(0, BackendError("bad request", status_code=400)))
+
+    def test_retry_after_is_honored(self):
+        scheduler = RequestScheduler(seed=1)
+        self.assertGreaterEqual(scheduler.backoff(0, BackendError("busy", status_code=503, retry_after=5.0)), 5.0)
+
+    def test_rate_limit_pauses_every_admission(self):
+        scheduler = RequestScheduler(seed=1)
+        scheduler.backoff(0, BackendError("slow down", status_code=429, retry_after=0.3))
+        started = time.monotonic()
+        scheduler.acquire()
+        scheduler.release()
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+
+class FairQueueTest(unittest.TestCase):
+
+    def admission_order(self, requests):
+        """
+        Queue (session, weight) requests of 100 tokens behind a held slot and
+        return the sessions in the order they are admitted
+        """
+        scheduler = RequestScheduler(max_in_flight=1)
+        scheduler.acquire()
+        order, threads = [], []
+
+        def request(session, weight):
+            with session_scope(session, weight):
+                scheduler.acquire(100)
+            order.append(session)
+            scheduler.release()
+
+        for index, (session, weight) in enumerate(requests):
+            thread = threading.Thread(target=request, args=(session, weight))
+            thread.start()
+            threads.append(thread)
+            while scheduler.stats()["queued"] < index + 1:
+                time.sleep(0.001)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_sessions_of_equal_weight_alternate(self):
+        order = self.admission_order([("heavy", 1.0)] * 4 + [("light", 1.0)] * 2)
+        self.assertEqual(order, ["heavy", "light", "heavy", "light", "heavy", "heavy"])
+
+    def test_heavier_weight_gets_a_larger_share(self):
+        order = self.admission_order([("degraded", 1.0)] * 3 + [("normal", 4.0)] * 3)
+        self.assertEqual(order, ["normal", "normal", "normal", "degraded", "degraded", "degraded"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Tests for the static pre-analysis
+Which lines get a template explanation, and which must be left to the model
+"""
+
+import unittest
+
+from services.static_analysis import analyze_static
+
+
+def template_kinds(code: str, language: str):
+    """Line number -> first words of the template explaining it"""
+    return {
+        number: " ".join(explanation["what_it_does"].split()[:2])
+        for number, explanation in analyze_static(code, language).boilerplate.items()
+    }
+
+
+class PythonTemplatesTest(unittest.TestCase):
+
+    def test_comments_imports_and_closing_brackets(self):
+        code = "# totals\nimport os\n\ndef total(values):\n    return sum(\n        values\n    )\n"
+        self.assertEqual(template_kinds(code, "python"), {
+            1: "A comment", 2: "Makes code", 7: "Closes the",
+        })
+
+    def test_lines_inside_a_docstring_are_left_to_the_model(self):
+        code = 'def load():\n    """\n    import the data first\n    )\n    # not a comment\n    """\n'
+        self.assertEqual(template_kinds(code, "python"), {})
+
+    def test_package_is_a_variable_name_in_python(self):
+        self.assertEqual(template_kinds("package = 5\n", "python"), {})
+
+
+class CFamilyTemplatesTest(unittest.TestCase):
+
+    def test_comments_imports_and_closing_brackets(self):
+        code = "import java.util.List;\n/* sums\n   values */\nclass A {\n  int x;\n}\n"
+        self.assertEqual(template_kinds(code, "java"), {
+            1: "Makes code", 2: "A comment", 3: "A comment", 6: "Closes the",
+        })
+
+    def test_package_declaration(self):
+        self.assertEqual(template_kinds("package app.model;\n", "java"), {1: "Declares which"})
+
+    def test_lines_inside_a_template_literal_are_left_to_the_model(self):
+        code = "const page = `\n}\nimport x\n// not a comment\n`;\n"
+        self.assertEqual(template_kinds(code, "javascript"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
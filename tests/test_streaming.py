@@ -0,0 +1,61 @@
+"""
+Tests for incremental parsing and recovery of analysis JSON
+Covers responses cut off partway and items that do not decode
+"""
+
+import json
+import unittest
+
+from services.streaming import IncrementalJSONParser, recover_analysis
+
+
+def explanation(number: int) -> dict:
+    return {"line_number": number, "code": f"x = {number}", "what_it_does": "a", "why_it_exists": "b",
+            "what_breaks": "c"}
+
+
+FULL = json.dumps({"line_explanations": [explanation(number) for number in (1, 2, 3)], "concepts": ["loops"]})
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_items_complete_across_chunk_boundaries(self):
+        parser = IncrementalJSONParser()
+        items = []
+        for start in range(0, len(FULL), 7):
+            items.extend(parser.feed(FULL[start:start + 7]))
+        self.assertEqual(items, [("line_explanations", explanation(number)) for number in (1, 2, 3)]
+                         + [("concepts", "loops")])
+        self.assertEqual(parser.closed, ["line_explanations", "concepts"])
+        self.assertEqual(parser.dropped, [])
+
+
+class RecoverAnalysisTest(unittest.TestCase):
+
+    def test_cut_off_inside_an_item(self):
+        content = FULL[:FULL.index('"line_number": 3') + 20]
+        recovered, complete = recover_analysis(content)
+        self.assertEqual(recovered["line_explanations"], [explanation(1), explanation(2)])
+        self.assertEqual(complete, [])
+
+    def test_cut_off_inside_a_string_list(self):
+        content = json.dumps({"concepts": ["loops", "recursion"]})[:-8]
+        recovered, complete = recover_analysis(content)
+        self.assertEqual(recovered["concepts"], ["loops"])
+        self.assertEqual(complete, [])
+
+    def test_malformed_middle_item_leaves_its_list_incomplete(self):
+        content = FULL.replace('"line_number": 2,', '"line_number": 2,,')
+        recovered, complete = recover_analysis(content)
+        self.assertEqual(recovered["line_explanations"], [explanation(1), explanation(3)])
+        self.assertEqual(complete, ["concepts"])
+
+    def test_garbage_after_closed_lists_keeps_them_complete(self):
+        recovered, complete = recover_analysis(FULL[:-1] + ', "quiz": [{"question": "Why')
+        self.assertEqual(len(recovered["line_explanations"]), 3)
+        self.assertEqual(recovered["quiz"], [])
+        self.assertEqual(complete, ["line_explanations", "concepts"])
+
+
+if __name__ == "__main__":
+    unittest.main()